@@ -0,0 +1,75 @@
+"""! @brief Benchmark of per-record versus batched DB ingestion."""
+##
+# @file bench_db_ingest.py
+# @package benchmarks
+# @brief Benchmark of per-record versus batched DB ingestion.
+#
+# @section description_bench_db_ingest Description
+# Ingests synthetic Activity records into a fresh FileStorage in a temporary
+# directory, once with DBManager.insert_record (one commit per record) and
+# once with DBManager.insert_many (one commit per batch), and reports the
+# throughput of both. Run from the src directory: python -m benchmarks.bench_db_ingest
+# Pass --storage memory to measure without disk I/O.
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+
+def make_activities(count: int, hotspots: int):
+    from bot.db.model.Activity import Activity
+    now = int(time.time())
+    return [
+        Activity('owner-{}'.format(i % hotspots), 'hotspot-{}'.format(i % hotspots),
+                 transaction_hash='hash-{}'.format(i), time=now - i, height=1500000 - i,
+                 type='poc_receipts_v2', role='witness')
+        for i in range(count)
+    ]
+
+
+def run(records: int, hotspots: int, batch_size: int, chunk_size: int):
+    from bot.db.DBManager import DBManager
+    from util.constants import DbConstants
+    DBManager.init_db()
+    tree = DbConstants.TREE_NAME_ACTIVITIES
+    results = []
+
+    activities = make_activities(records, hotspots)
+    started = time.perf_counter()
+    for activity in activities:
+        DBManager.insert_record(tree, str(activity.uuid), activity)
+    elapsed = time.perf_counter() - started
+    results.append({'mode': 'per_record', 'records': records, 'seconds': round(elapsed, 3),
+                    'records_per_s': round(records / elapsed, 1)})
+    print(json.dumps(results[-1]))
+
+    activities = make_activities(records, hotspots)
+    started = time.perf_counter()
+    for offset in range(0, records, batch_size):
+        batch = activities[offset:offset + batch_size]
+        DBManager.insert_many(tree, [(str(activity.uuid), activity) for activity in batch], chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    results.append({'mode': 'insert_many', 'records': records, 'batch_size': batch_size, 'chunk_size': chunk_size,
+                    'seconds': round(elapsed, 3), 'records_per_s': round(records / elapsed, 1)})
+    print(json.dumps(results[-1]))
+    print('speedup: {:.1f}x'.format(results[0]['seconds'] / results[1]['seconds']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--hotspots', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=5000, help='records per insert_many call')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='records between savepoints')
+    parser.add_argument('--storage', default='file', help='file, zlib or memory')
+    args = parser.parse_args()
+    from bot.db.db import configure
+    configure(storage=args.storage, path=os.path.join(tempfile.mkdtemp(prefix='bench_db_ingest_'), 'dataz.fs'))
+    run(args.records, args.hotspots, args.batch_size, args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""! @brief Offline end-to-end benchmark of the bot and DB micro-benchmarks."""
+##
+# @file bench_e2e.py
+# @package benchmarks
+# @brief Offline end-to-end benchmark of the bot and DB micro-benchmarks.
+#
+# @section description_bench_e2e Description
+# Starts the local Helium and Telegram stubs, builds the bot with init_bot()
+# on an in-memory DB and simulates N concurrent users. Every user sends its
+# next command or menu tap as soon as the reply to the previous one arrived.
+# Reports p50/p95/p99 latency from an update being available to its reply,
+# per request kind and overall, throughput, peak RSS, the response cache and
+# renderer counters, and a set of DBManager micro-benchmarks run first.
+# Results are written as JSON; pass --compare with an earlier result file to
+# print the relative change of the main numbers.
+# Run from the src directory: python -m benchmarks.bench_e2e
+#
+# @section notes_bench_e2e Notes
+# - The send queue rate limits are raised far above Telegram's so the
+#   numbers show the bot itself; pass --real-limits to keep the defaults.
+# - Only requests answered with exactly one message are part of the mix, so
+#   every reply can be matched to its request.
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import time
+from datetime import datetime, timezone
+
+from benchmarks import stub_helium, stub_telegram
+
+# (kind, text) of the simulated requests; {address} is replaced per user
+REQUEST_MIX = [
+    ('bc_stats', '/bc_stats'),
+    ('hs_data', '/hs_data {address}'),
+    ('hs_activity_recent', '/hs_activity_recent {address}'),
+    ('menu_tap', 'Settings ⚙'),
+    ('menu_tap', 'Notifications 🔔'),
+    ('menu_tap', 'Back ↩'),
+]
+
+
+def _percentiles(samples) -> dict:
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def percentile(fraction):
+        return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 2)
+    return {'count': len(samples), 'p50_ms': percentile(0.5), 'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99), 'max_ms': round(samples[-1] * 1000, 2)}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def _setup_db():
+    """! Open an in-memory DB and install the schema."""
+    from bot.db.db import configure
+    configure(storage='memory')
+    from bot import init
+    init.open_database()
+
+
+def _prepare(args, helium_url: str, telegram_url: str):
+    """! Configure the bot for the stubs, then build it with init_bot()."""
+    from bot import init
+    from util.read_secrets import read_secrets
+    config = dict(read_secrets(), BOT_TOKEN='123456:BENCH', TELEGRAM_API_URL=telegram_url, HELIUM_API_URL=helium_url,
+                  CONCURRENT_UPDATES=args.concurrent_updates)
+    if not args.real_limits:
+        config.update({'SEND_GLOBAL_RATE': 100000, 'SEND_GLOBAL_BURST': 100000,
+                       'SEND_CHAT_RATE': 100000, 'SEND_CHAT_BURST': 100000})
+    return init.init_bot(config)
+
+
+async def run_load(args) -> dict:
+    waiters = {}
+    latencies = {}
+    update_ids = iter(range(1, 10 ** 9))
+
+    def on_sent(received, chat_id, text):
+        waiter = waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(received)
+
+    helium = stub_helium.make_app(latency=args.helium_latency)
+    helium_runner, helium_url = await stub_helium.start_stub(helium)
+    telegram = stub_telegram.make_app()
+    telegram['on_sent'] = on_sent
+    telegram_runner, telegram_url = await stub_telegram.start_stub(telegram)
+    application = _prepare(args, helium_url, telegram_url)
+
+    async def user(chat_id):
+        address = 'owner-{}-hotspot-{}'.format(chat_id, chat_id)
+        for i in range(args.requests):
+            kind, text = REQUEST_MIX[(chat_id + i) % len(REQUEST_MIX)]
+            waiter = waiters[chat_id] = asyncio.get_running_loop().create_future()
+            started = time.monotonic()
+            stub_telegram.push_update(telegram, stub_telegram.make_update(next(update_ids), chat_id, text.format(address=address)))
+            try:
+                received = await asyncio.wait_for(waiter, args.timeout)
+            except asyncio.TimeoutError:
+                latencies.setdefault('timeout', []).append(args.timeout)
+                continue
+            latencies.setdefault(kind, []).append(received - started)
+
+    try:
+        async with application:
+            # run_polling() would call the hooks that start the send queue and the Helium client
+            await application.post_init(application)
+            # background jobs would only add noise
+            for job in application.job_queue.jobs():
+                job.schedule_removal()
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            begin = time.monotonic()
+            await asyncio.gather(*(user(1000 + i) for i in range(args.users)))
+            elapsed = time.monotonic() - begin
+            from bot import helium_requests
+            from bot.renderer import get_renderer
+            cache_stats = helium_requests.get_cache_stats()
+            renderer_stats = get_renderer().stats()
+            await application.updater.stop()
+            await application.stop()
+            await application.post_shutdown(application)
+    finally:
+        await telegram_runner.cleanup()
+        await helium_runner.cleanup()
+    answered = sum(len(samples) for kind, samples in latencies.items() if kind != 'timeout')
+    return {
+        'users': args.users,
+        'requests_per_user': args.requests,
+        'seconds': round(elapsed, 3),
+        'requests_per_s': round(answered / elapsed, 1),
+        'timeouts': len(latencies.pop('timeout', [])),
+        'latency': _percentiles([sample for samples in latencies.values() for sample in samples]),
+        'latency_by_kind': {kind: _percentiles(samples) for kind, samples in sorted(latencies.items())},
+        'helium_requests': helium['requests'],
+        'response_cache': cache_stats,
+        'renderer': renderer_stats,
+    }
+
+
+def _timed(name: str, count: int, func) -> dict:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    return {'name': name, 'ops': count, 'seconds': round(elapsed, 4),
+            'ops_per_s': round(count / elapsed, 1), 'us_per_op': round(elapsed / count * 1e6, 2)}
+
+
+def run_db(records: int, hotspots: int, lookups: int) -> list:
+    """! DBManager micro-benchmarks; the records stay in the DB for the load test."""
+    from benchmarks.bench_db_ingest import make_activities
+    from bot.db.DBManager import DBManager
+    from util.constants import DbConstants
+    tree = DbConstants.TREE_NAME_ACTIVITIES
+    activities = make_activities(records, hotspots)
+    # taken before inserting, the stored records are ghosts once their connection is closed
+    keys = [str(activity.uuid) for activity in activities]
+    now = int(time.time())
+    results = [
+        _timed('insert_many', records, lambda: DBManager.insert_many(tree, list(zip(keys, activities)))),
+        _timed('insert_record', min(records, 1000), lambda: [DBManager.insert_record(tree, str(activity.uuid), activity)
+                                                            for activity in make_activities(min(records, 1000), hotspots)]),
+        _timed('get_record', lookups, lambda: [DBManager.get_record(tree, keys[i % records]) for i in range(lookups)]),
+        _timed('find_records_by_hotspot', lookups, lambda: [DBManager.find_records_by(tree, 'hotspot_address', 'hotspot-{}'.format(i % hotspots))
+                                                            for i in range(lookups)]),
+        _timed('get_hotspot_activities_1h', lookups, lambda: [DBManager.get_hotspot_activities('hotspot-{}'.format(i % hotspots), since=now - 3600)
+                                                              for i in range(lookups)]),
+        _timed('get_activity_summary', lookups, lambda: [DBManager.get_activity_summary('hotspot-{}'.format(i % hotspots))
+                                                         for i in range(lookups)]),
+    ]
+    for result in results:
+        print(json.dumps(result))
+    return results
+
+
+def _compare(result: dict, previous: dict):
+    def change(name, new, old):
+        if old:
+            print('{}: {} -> {} ({:+.1f}%)'.format(name, old, new, (new - old) / old * 100))
+    change('requests_per_s', result['load']['requests_per_s'], previous['load']['requests_per_s'])
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        change('latency ' + key, result['load']['latency'].get(key), previous['load']['latency'].get(key))
+    change('peak_rss_mb', result['peak_rss_mb'], previous['peak_rss_mb'])
+    old_db = {entry['name']: entry for entry in previous.get('db', [])}
+    for entry in result['db']:
+        if entry['name'] in old_db:
+            change('db ' + entry['name'] + ' ops_per_s', entry['ops_per_s'], old_db[entry['name']]['ops_per_s'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50, help='concurrent simulated users')
+    parser.add_argument('--requests', type=int, default=20, help='requests per user')
+    parser.add_argument('--concurrent-updates', type=int, default=1, help='updates the Application handles in parallel')
+    parser.add_argument('--helium-latency', type=float, default=0.01, help='stub Helium API latency per request in seconds')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a reply')
+    parser.add_argument('--real-limits', action='store_true', help="keep the send queue's Telegram rate limits")
+    parser.add_argument('--db-records', type=int, default=20000)
+    parser.add_argument('--db-hotspots', type=int, default=200)
+    parser.add_argument('--db-lookups', type=int, default=2000)
+    parser.add_argument('--output', help='result file, bench_e2e_<UTC time>.json by default')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    args = parser.parse_args()
+
+    result = {
+        'benchmark': 'bench_e2e',
+        'started': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+    }
+    _setup_db()
+    result['db'] = run_db(args.db_records, args.db_hotspots, args.db_lookups)
+    # shuts the DB down at the end
+    result['load'] = asyncio.run(run_load(args))
+    print(json.dumps(result['load']))
+    result['peak_rss_mb'] = _peak_rss_mb()
+    output = args.output or 'bench_e2e_{}.json'.format(datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+    with open(output, 'w') as result_file:
+        json.dump(result, result_file, indent=2)
+    print('peak RSS: {} MB, results written to {}'.format(result['peak_rss_mb'], output))
+    if args.compare:
+        with open(args.compare) as previous_file:
+            _compare(result, json.load(previous_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""! @brief Pickle size and load time of the stored records before and after compaction."""
+##
+# @file bench_model_size.py
+# @package benchmarks
+# @brief Pickle size and load time of the stored records before and after compaction.
+#
+# @section description_bench_model_size Description
+# Stores synthetic users, owners, hotspots and activities in the format used
+# before the records were compacted (uuid.UUID object, tree_name, ISO-8601
+# timestamps, default active and deactivated_at values) in an in-memory DB.
+# It reports the pickle size per record and the time to load every record
+# from an empty object cache. It then runs the generation 5 evolve step,
+# which rewrites the records in place, and reports the same numbers again
+# together with the time the migration took. With --interrupt-after the
+# migration is aborted after that many chunks and run again, which has to
+# resume from the checkpoint instead of starting over.
+# Run from the src directory: python -m benchmarks.bench_model_size
+#
+# @section notes_bench_model_size Notes
+# - The old format is written and read by temporarily switching BaseModel
+#   back to the plain persistent.Persistent state methods.
+
+import argparse
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import persistent
+
+MODEL_TREES = ['users', 'owners', 'hotspots', 'activities']
+
+
+@contextmanager
+def _legacy_format():
+    """! Make BaseModel pickle and load its state unchanged, as before the compact format."""
+    from bot.db.model.BaseModel import BaseModel
+    getstate, setstate = BaseModel.__getstate__, BaseModel.__setstate__
+    BaseModel.__getstate__, BaseModel.__setstate__ = persistent.Persistent.__getstate__, persistent.Persistent.__setstate__
+    try:
+        yield
+    finally:
+        BaseModel.__getstate__, BaseModel.__setstate__ = getstate, setstate
+
+
+def _legacy(record):
+    """! Give a new record the state it would have had in the old format."""
+    state = dict(record.__dict__)
+    state['uuid'] = record.uuid
+    del state['uid']
+    state['tree_name'] = record.tree_name
+    state['active'] = True
+    state['deactivated_at'] = None
+    for name in ('last_updated_at', 'last_active_at'):
+        if name in state:
+            state[name] = datetime.utcfromtimestamp(state[name]).isoformat()
+    persistent.Persistent.__setstate__(record, state)
+    return record
+
+
+def make_records(activities: int, hotspots: int):
+    """! (tree name, records) tuples with one user and owner per hotspot."""
+    from benchmarks.bench_db_ingest import make_activities
+    from bot.db.model.Hotspot import Hotspot
+    from bot.db.model.Owner import Owner
+    from bot.db.model.User import User
+    return [
+        ('users', [User(1000 + i, 'user{}'.format(i)) for i in range(hotspots)]),
+        ('owners', [Owner('owner-{}'.format(i), 1000 + i) for i in range(hotspots)]),
+        ('hotspots', [Hotspot('hotspot-{}'.format(i), 'animal-name-{}'.format(i), 'owner-{}'.format(i)) for i in range(hotspots)]),
+        ('activities', make_activities(activities, hotspots)),
+    ]
+
+
+def measure(label: str) -> dict:
+    """! Pickle sizes of the records and the time to load them from an empty cache."""
+    from bot.db.DBManager import DBManager
+    storage = DBManager.get_db_ref().storage
+    result = {'format': label}
+    with DBManager.connection() as conn:
+        for tree_name in MODEL_TREES:
+            tree = conn.root()[tree_name]
+            sizes = [len(storage.load(record._p_oid)[0]) for record in tree.values()]
+            conn.cacheMinimize()
+            started = time.perf_counter()
+            for record in tree.values():
+                record._p_activate()
+            elapsed = time.perf_counter() - started
+            result[tree_name] = {'records': len(sizes), 'pickle_bytes_avg': round(sum(sizes) / len(sizes), 1),
+                                 'pickle_bytes_total': sum(sizes), 'load_ms': round(elapsed * 1000, 2),
+                                 'load_us_per_record': round(elapsed / len(sizes) * 1e6, 2)}
+    result['pickle_bytes_total'] = sum(result[tree_name]['pickle_bytes_total'] for tree_name in MODEL_TREES)
+    return result
+
+
+class _Interrupted(Exception):
+    pass
+
+
+def migrate(chunk_size: int, interrupt_after: int) -> dict:
+    """! Run the generation 5 evolve step, optionally interrupting it once after interrupt_after chunks."""
+    from bot.db import migrations
+    from bot.db.DBMigrationManager import DBMigrationManager
+    migration = DBMigrationManager.get_migration(5)
+    result = {'chunk_size': chunk_size}
+    started = time.perf_counter()
+    if interrupt_after:
+        visit = migration.visit
+        visited = [0]
+
+        def interrupted(conn, tree_name, key, record):
+            visited[0] += 1
+            if visited[0] > interrupt_after * chunk_size:
+                raise _Interrupted()
+            visit(conn, tree_name, key, record)
+        migration.visit = interrupted
+        try:
+            DBMigrationManager.run(None, 5, chunk_size=chunk_size)
+        except _Interrupted:
+            result['interrupted_at'] = DBMigrationManager.get_progress(5)['count']
+        finally:
+            migration.visit = visit
+    DBMigrationManager.run(None, 5, chunk_size=chunk_size)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    progress = DBMigrationManager.get_progress(5)
+    result['records'] = progress['count']
+    result['done'] = progress['done']
+    return result
+
+
+def run(activities: int, hotspots: int, chunk_size: int, interrupt_after: int) -> dict:
+    from bot import init
+    from bot.db.DBManager import DBManager
+    from bot.db.db import configure
+    configure(storage='memory')
+    init.open_database()
+    records = make_records(activities, hotspots)
+    # the model equality and hashing work with sets
+    unique = {tree_name: len(set(tree_records)) for tree_name, tree_records in records}
+    with _legacy_format():
+        for tree_name, tree_records in records:
+            DBManager.insert_many(tree_name, [(str(record.uuid), _legacy(record)) for record in tree_records])
+        before = measure('legacy')
+    migration = migrate(chunk_size, interrupt_after)
+    after = measure('compact')
+    DBManager.close_db()
+    return {
+        'unique_records': unique,
+        'before': before,
+        'after': after,
+        'migration': migration,
+        'pickle_size_ratio': round(after['pickle_bytes_total'] / before['pickle_bytes_total'], 3),
+        'activity_load_speedup': round(before['activities']['load_ms'] / after['activities']['load_ms'], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--activities', type=int, default=20000)
+    parser.add_argument('--hotspots', type=int, default=1000)
+    parser.add_argument('--chunk-size', type=int, default=1000, help='records per migration transaction')
+    parser.add_argument('--interrupt-after', type=int, default=0, help='abort the migration once after this many chunks')
+    args = parser.parse_args()
+    result = run(args.activities, args.hotspots, args.chunk_size, args.interrupt_after)
+    for key in ('before', 'after'):
+        print(json.dumps(result.pop(key)))
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
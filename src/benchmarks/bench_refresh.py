@@ -0,0 +1,66 @@
+"""! @brief Synthetic benchmark for the bounded-concurrency hotspot refresh."""
+##
+# @file bench_refresh.py
+# @package benchmarks
+# @brief Synthetic benchmark for the bounded-concurrency hotspot refresh.
+#
+# @section description_bench_refresh Description
+# Refreshes the recent activity of N synthetic hotspots against the local
+# Helium stub and reports the wall time for each concurrency level.
+# Run from the src directory: python -m benchmarks.bench_refresh
+
+import argparse
+import asyncio
+import json
+
+from benchmarks.stub_helium import make_app, start_stub
+from bot import helium_requests
+from bot.fanout import fan_out
+from bot.helium_client import HeliumClient
+
+
+async def run(hotspots: int, concurrency_levels, latency: float, role_pages: int):
+    runner, base_url = await start_stub(make_app(latency=latency, role_pages=role_pages))
+    helium_requests.configure({'HELIUM_API_URL': base_url})
+    addresses = ['stub-hotspot-{:05d}'.format(i) for i in range(hotspots)]
+    results = []
+    try:
+        for concurrency in concurrency_levels:
+            client = HeliumClient(limit=concurrency, limit_per_host=concurrency)
+            await client.start()
+            helium_requests.set_client(client)
+            result = await fan_out(
+                addresses,
+                helium_requests.get_recent_hotspot_activity,
+                concurrency=concurrency,
+                batch_size=max(1, hotspots // 5),
+                progress=lambda r: print('  progress:', r),
+            )
+            await client.close()
+            results.append({
+                'hotspots': hotspots,
+                'concurrency': concurrency,
+                'wall_time_s': round(result.elapsed, 3),
+                'hotspots_per_s': round(hotspots / result.elapsed, 1),
+                'failed': result.failed,
+            })
+            print(json.dumps(results[-1]))
+    finally:
+        helium_requests.set_client(None)
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hotspots', type=int, default=5000)
+    parser.add_argument('--concurrency', default='10,50,200', help='comma separated concurrency levels')
+    parser.add_argument('--latency', type=float, default=0.02, help='stub latency per request in seconds')
+    parser.add_argument('--role-pages', type=int, default=1, help='cursor pages served per hotspot')
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+    asyncio.run(run(args.hotspots, levels, args.latency, args.role_pages))
+
+
+if __name__ == '__main__':
+    main()
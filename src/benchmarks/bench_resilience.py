@@ -0,0 +1,164 @@
+"""! @brief Fault-injection scenarios for the latency-bounded Helium client."""
+##
+# @file bench_resilience.py
+# @package benchmarks
+# @brief Fault-injection scenarios for the latency-bounded Helium client.
+#
+# @section description_bench_resilience Description
+# Runs the Helium requests of the bot against the local Helium stub while it
+# injects errors, 429 responses and hanging requests, and checks that
+# - transient errors and 429s are retried and succeed,
+# - hanging requests are cut off by the timeouts and open the circuit
+#   breaker, after which requests fail fast,
+# - cached routes keep serving the last known good response during an
+#   outage, and
+# - the breaker closes again once the API recovered.
+# Prints one JSON line per scenario and exits with status 1 if a check failed.
+# Run from the src directory: python -m benchmarks.bench_resilience
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.stub_helium import FAULTS, make_app, start_stub
+from bot import helium_requests
+from bot.helium_client import CircuitBreaker, HeliumAPIError, HeliumClient
+
+
+def _summary(latencies) -> dict:
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2)
+    return {'p50_ms': percentile(0.5), 'p99_ms': percentile(0.99), 'max_ms': round(latencies[-1] * 1000, 2)}
+
+
+async def _calls(count: int, concurrency: int, call) -> dict:
+    """! Run call() count times with the given concurrency.
+    @return dict with ok/failed counts and latency percentiles
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    result = {'calls': count, 'ok': 0, 'failed': 0}
+
+    async def one():
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await call()
+                result['ok'] += 1
+            except HeliumAPIError:
+                result['failed'] += 1
+            latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    result.update(_summary(latencies))
+    return result
+
+
+def _client(args) -> HeliumClient:
+    client = HeliumClient(read_timeout=args.read_timeout, connect_timeout=1, total_timeout=args.read_timeout * 2,
+                          route_timeouts={}, retries=args.retries, retry_backoff=0.05, max_wait=args.max_wait,
+                          breaker=CircuitBreaker(threshold=args.breaker_threshold, reset_timeout=args.breaker_reset))
+    helium_requests.set_client(client)
+    return client
+
+
+async def run(args) -> list:
+    stub = make_app(latency=0.005)
+    runner, base_url = await start_stub(stub)
+    # only the stats route is cached
+    helium_requests.configure({'HELIUM_API_URL': base_url, 'CACHE_TTL_STATS': args.ttl, 'CACHE_TTL_TOKEN_SUPPLY': 0,
+                               'CACHE_TTL_HOTSPOT': 0, 'CACHE_MAX_STALE': 3600})
+    results = []
+
+    def report(name, result, client, **checks):
+        stats = client.stats()
+        result.update(scenario=name, faulted=stub['faulted'], retried=stats['retried'], rate_limited=stats['rate_limited'],
+                      breaker_state=stats['breaker_state'], breaker_opened=stats['breaker_opened'],
+                      stale_served=helium_requests.get_cache_stats()['stale_served'],
+                      checks=checks, passed=all(checks.values()))
+        results.append(result)
+        print(json.dumps(result))
+
+    def faults(**values):
+        stub['faults'] = dict(FAULTS, **values)
+        stub['faulted'] = 0
+
+    hotspot = lambda: helium_requests.get_hotspot_data('stub-hotspot-1')
+    try:
+        client = _client(args)
+        faults()
+        result = await _calls(args.calls, args.concurrency, hotspot)
+        report('healthy', result, client, all_ok=result['failed'] == 0)
+        await client.close()
+
+        client = _client(args)
+        faults(error_rate=args.error_rate)
+        result = await _calls(args.calls, args.concurrency, hotspot)
+        # a call only fails if all of its attempts failed
+        report('flaky', result, client, mostly_ok=result['ok'] >= args.calls * 0.9, retried=client.retried > 0)
+        await client.close()
+
+        client = _client(args)
+        faults(rate_limit_rate=0.2, retry_after=0.2)
+        result = await _calls(args.calls, args.concurrency, hotspot)
+        report('rate_limited', result, client, mostly_ok=result['ok'] >= args.calls * 0.9, paused=client.rate_limited > 0)
+        await client.close()
+
+        client = _client(args)
+        faults(hang_rate=1.0, hang_seconds=30)
+        bound = (args.retries + 1) * args.read_timeout + args.retries * 0.2 + 0.5
+        result = await _calls(args.calls, args.concurrency, hotspot)
+        report('hanging', result, client, all_failed=result['ok'] == 0, bounded=result['max_ms'] / 1000 < bound,
+               breaker_open=client.breaker.state == CircuitBreaker.OPEN)
+        result = await _calls(args.calls, args.concurrency, hotspot)
+        report('hanging_fail_fast', result, client, all_failed=result['ok'] == 0, fast=result['p99_ms'] < 50)
+        await client.close()
+
+        client = _client(args)
+        faults()
+        await helium_requests.get_bc_stats()
+        faults(error_rate=1.0)
+        await asyncio.sleep(args.ttl + 0.05)
+        result = await _calls(args.calls, args.concurrency, helium_requests.get_bc_stats)
+        report('outage_last_known_good', result, client, all_ok=result['failed'] == 0,
+               stale=helium_requests.get_cache_stats()['stale_served'] > 0)
+        faults()
+        await asyncio.sleep(args.breaker_reset + 0.05)
+        # the trial request of the half-open breaker
+        await hotspot()
+        result = await _calls(args.calls, args.concurrency, hotspot)
+        report('recovered', result, client, all_ok=result['failed'] == 0, breaker_closed=client.breaker.state == CircuitBreaker.CLOSED)
+        await client.close()
+    finally:
+        helium_requests.set_client(None)
+        await runner.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.3, help='fraction of 503 responses in the flaky scenario')
+    parser.add_argument('--read-timeout', type=float, default=0.3)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--max-wait', type=float, default=2)
+    parser.add_argument('--breaker-threshold', type=int, default=5)
+    parser.add_argument('--breaker-reset', type=float, default=1)
+    parser.add_argument('--ttl', type=float, default=0.2, help='TTL of cached stats responses')
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    failed = [result['scenario'] for result in results if not result['passed']]
+    if failed:
+        print('failed scenarios: {}'.format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""! @brief Load test of webhook mode against long polling."""
+##
+# @file bench_webhook.py
+# @package benchmarks
+# @brief Load test of webhook mode against long polling.
+#
+# @section description_bench_webhook Description
+# Runs the echo handler of the bot against the local Telegram stub, once
+# receiving updates by long polling and once through PTB's webhook server,
+# and reports the end-to-end latency from an update being available to its
+# reply arriving at the stub, plus the throughput of both modes. Updates are
+# sent all at once for throughput, or paced with --rate for latency under
+# normal load.
+# Run from the src directory: python -m benchmarks.bench_webhook
+
+import argparse
+import asyncio
+import json
+import secrets
+import socket
+import time
+
+import aiohttp
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from benchmarks.stub_telegram import make_app, make_update, push_update, start_stub, wait_for_sent
+from bot.actions import echo
+
+WEBHOOK_PATH = 'telegram'
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _summary(mode: str, stub, started: dict, elapsed: float, **extra) -> dict:
+    latencies = sorted(received - started[text] for received, _, text in stub['sent'] if text in started)
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2)
+    return dict(mode=mode, updates=len(latencies), seconds=round(elapsed, 3),
+                updates_per_s=round(len(latencies) / elapsed, 1), latency_ms_p50=percentile(0.5),
+                latency_ms_p95=percentile(0.95), latency_ms_max=round(latencies[-1] * 1000, 2), **extra)
+
+
+def _build_application(base_url: str, concurrent_updates: int):
+    application = (
+        ApplicationBuilder()
+        .token('123456:BENCH')
+        .base_url(base_url + '/bot')
+        .concurrent_updates(concurrent_updates)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), echo))
+    return application
+
+
+async def _pace(begin: float, i: int, rate: float):
+    """! Sleep until update i is due when sending rate updates per second, 0 sends all at once."""
+    if rate:
+        await asyncio.sleep(max(0, begin + i / rate - time.monotonic()))
+
+
+async def run_polling(updates: int, chats: int, concurrent_updates: int, rate: float) -> dict:
+    stub = make_app()
+    runner, base_url = await start_stub(stub)
+    application = _build_application(base_url, concurrent_updates)
+    try:
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            started = {}
+            begin = time.monotonic()
+            for i in range(updates):
+                await _pace(begin, i, rate)
+                text = 'bench-{}'.format(i)
+                started[text] = time.monotonic()
+                push_update(stub, make_update(i + 1, 1000 + i % chats, text))
+            await wait_for_sent(stub, updates)
+            elapsed = time.monotonic() - begin
+            await application.updater.stop()
+            await application.stop()
+    finally:
+        await runner.cleanup()
+    return _summary('polling', stub, started, elapsed, rate=rate, get_updates_calls=stub['calls'].get('getUpdates', 0))
+
+
+async def run_webhook(updates: int, chats: int, concurrent_updates: int, rate: float, concurrency: int,
+                      max_connections: int) -> dict:
+    stub = make_app()
+    runner, base_url = await start_stub(stub)
+    application = _build_application(base_url, concurrent_updates)
+    port = _free_port()
+    secret_token = secrets.token_urlsafe(32)
+    url = 'http://127.0.0.1:{}/{}'.format(port, WEBHOOK_PATH)
+    try:
+        async with application:
+            await application.start()
+            await application.updater.start_webhook(listen='127.0.0.1', port=port, url_path=WEBHOOK_PATH,
+                                                    webhook_url=url, secret_token=secret_token,
+                                                    max_connections=max_connections)
+            started = {}
+            semaphore = asyncio.Semaphore(concurrency)
+            async with aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': secret_token}) as session:
+                async with session.post(url, json=make_update(0, 1000, 'bench-forged'),
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as response:
+                    rejected = response.status
+
+                async def post(i):
+                    text = 'bench-{}'.format(i)
+                    await _pace(begin, i, rate)
+                    async with semaphore:
+                        started[text] = time.monotonic()
+                        async with session.post(url, json=make_update(i + 1, 1000 + i % chats, text)) as response:
+                            response.raise_for_status()
+
+                begin = time.monotonic()
+                await asyncio.gather(*(post(i) for i in range(updates)))
+                await wait_for_sent(stub, updates)
+                elapsed = time.monotonic() - begin
+            await application.updater.stop()
+            await application.stop()
+    finally:
+        await runner.cleanup()
+    return _summary('webhook', stub, started, elapsed, rate=rate, concurrency=concurrency, wrong_secret_status=rejected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20, help='parallel webhook POSTs')
+    parser.add_argument('--max-connections', type=int, default=40)
+    parser.add_argument('--concurrent-updates', type=int, default=1, help='updates the Application handles in parallel')
+    parser.add_argument('--rate', type=float, default=0, help='updates per second, 0 sends all at once')
+    parser.add_argument('--modes', default='polling,webhook')
+    args = parser.parse_args()
+    for mode in args.modes.split(','):
+        if mode == 'polling':
+            result = asyncio.run(run_polling(args.updates, args.chats, args.concurrent_updates, args.rate))
+        else:
+            result = asyncio.run(run_webhook(args.updates, args.chats, args.concurrent_updates, args.rate,
+                                             args.concurrency, args.max_connections))
+        print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""! @brief Throughput of the multi-worker mode with 1 to N worker processes."""
+##
+# @file bench_workers.py
+# @package benchmarks
+# @brief Throughput of the multi-worker mode with 1 to N worker processes.
+#
+# @section description_bench_workers Description
+# Seeds a FileStorage with synthetic activities once, then for every worker
+# count starts python main.py with BOT_MODE workers on a copy of it, in a
+# temporary directory with its own secrets.json pointing at the local Helium
+# and Telegram stubs. The front process serves the copy through ZEO and
+# forwards the updates posted to its webhook to the workers. N simulated
+# users send /hs_activity_recent, /hs_summary and /add_hotspot, every user
+# its next one as soon as the reply to the previous one arrived, and the
+# throughput and latency per worker count are reported, with the speedup
+# over the first worker count.
+# Run from the src directory: python -m benchmarks.bench_workers
+#
+# @section notes_bench_workers Notes
+# - The workers only scale up to the number of CPU cores; the benchmark
+#   process and the ZEO server need some of them as well.
+# - /add_hotspot writes to the DB from all workers at once, so conflicts and
+#   their retries are part of the numbers.
+# - The logs of the bot processes are written to src/logs/bench-workers*.log.
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks import stub_helium, stub_telegram
+from definitions import ROOT_DIR
+
+# (kind, text) of the simulated requests; {address} is replaced per user
+REQUEST_MIX = [
+    ('hs_activity_recent', '/hs_activity_recent {address}'),
+    ('hs_summary', '/hs_summary {address}'),
+    ('hs_activity_recent', '/hs_activity_recent {address}'),
+    ('add_hotspot', '/add_hotspot {address}'),
+]
+SECRET_TOKEN = 'bench-workers-secret'
+
+
+def _free_ports(count: int) -> int:
+    """! First of count consecutive free local ports."""
+    while True:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            first = sock.getsockname()[1]
+        if first + count > 65535:
+            continue
+        try:
+            for port in range(first, first + count):
+                with socket.socket() as sock:
+                    sock.bind(('127.0.0.1', port))
+            return first
+        except OSError:
+            continue
+
+
+def _percentiles(samples) -> dict:
+    samples = sorted(samples)
+
+    def percentile(fraction):
+        return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 2)
+    return {'p50_ms': percentile(0.5), 'p95_ms': percentile(0.95), 'max_ms': round(samples[-1] * 1000, 2)}
+
+
+def seed(path: str, hotspots: int, activities: int):
+    """! Write a FileStorage with the schema and activities of hotspots 'hotspot-0' ... in the last hours."""
+    from benchmarks.bench_db_ingest import make_activities
+    from bot import init
+    from bot.db.DBManager import DBManager
+    from bot.db.db import configure
+    from util.constants import DbConstants
+    configure(storage='file', path=path)
+    init.open_database()
+    records = make_activities(hotspots * activities, hotspots)
+    DBManager.insert_many(DbConstants.TREE_NAME_ACTIVITIES, [(str(record.uuid), record) for record in records])
+    DBManager.close_db()
+
+
+def _write_secrets(directory: str, workers: int, helium_url: str, telegram_url: str, concurrent_updates: int) -> str:
+    """! secrets.json of a bot run in directory.
+    @return webhook URL of the front process
+    """
+    webhook_port = _free_ports(1)
+    config = {
+        'BOT_NAME': 'bench-workers',
+        'BOT_TOKEN': '123456:BENCH',
+        'BOT_MODE': 'workers',
+        'WORKERS': workers,
+        'WORKERS_BASE_PORT': _free_ports(workers),
+        'WEBHOOK_URL': 'http://127.0.0.1:{}'.format(webhook_port),
+        'WEBHOOK_PORT': webhook_port,
+        'WEBHOOK_SECRET_TOKEN': SECRET_TOKEN,
+        'TELEGRAM_API_URL': telegram_url,
+        'HELIUM_API_URL': helium_url,
+        'CONCURRENT_UPDATES': concurrent_updates,
+        'DB_STORAGE': 'file',
+        'DB_PATH': os.path.join(directory, 'dataz.fs'),
+        'DB_ZEO_ADDRESS': '127.0.0.1:{}'.format(_free_ports(1)),
+        # background jobs would only add noise
+        'SYNC_FIRST_RUN_DELAY': 86400,
+        'RETENTION_FIRST_RUN_DELAY': 86400,
+        'MAINTENANCE_FIRST_RUN_DELAY': 86400,
+        'SEND_GLOBAL_RATE': 100000, 'SEND_GLOBAL_BURST': 100000,
+        'SEND_CHAT_RATE': 100000, 'SEND_CHAT_BURST': 100000,
+    }
+    os.makedirs(os.path.join(directory, '.secret'))
+    with open(os.path.join(directory, '.secret', 'secrets.json'), 'w') as secrets_file:
+        json.dump(config, secrets_file)
+    return '{}/telegram'.format(config['WEBHOOK_URL'])
+
+
+async def _wait_started(telegram, front: subprocess.Popen, timeout: float):
+    """! Wait until the front registered its webhook, which it does once all workers are up."""
+    deadline = time.monotonic() + timeout
+    while not telegram['calls'].get('setWebhook'):
+        if front.poll() is not None:
+            raise RuntimeError('The front process exited with status {}.'.format(front.returncode))
+        if time.monotonic() > deadline:
+            raise RuntimeError('The workers did not start within {}s.'.format(timeout))
+        await asyncio.sleep(0.1)
+
+
+async def run(workers: int, seed_path: str, args) -> dict:
+    waiters = {}
+    latencies = {}
+    update_ids = iter(range(1, 10 ** 9))
+
+    def on_sent(received, chat_id, text):
+        waiter = waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(received)
+
+    helium = stub_helium.make_app(latency=args.helium_latency)
+    helium_runner, helium_url = await stub_helium.start_stub(helium)
+    telegram = stub_telegram.make_app()
+    telegram['on_sent'] = on_sent
+    telegram_runner, telegram_url = await stub_telegram.start_stub(telegram)
+    directory = tempfile.mkdtemp(prefix='bench-workers-')
+    front = None
+    try:
+        shutil.copy(seed_path, os.path.join(directory, 'dataz.fs'))
+        webhook_url = _write_secrets(directory, workers, helium_url, telegram_url, args.concurrent_updates)
+        env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+        output = None if args.verbose else subprocess.DEVNULL
+        front = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'main.py')], cwd=directory, env=env,
+                                 stdout=output, stderr=output)
+        started = time.monotonic()
+        await _wait_started(telegram, front, args.start_timeout)
+        startup = time.monotonic() - started
+
+        async with aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': SECRET_TOKEN}) as session:
+            async def request(chat_id, text):
+                waiter = waiters[chat_id] = asyncio.get_running_loop().create_future()
+                started = time.monotonic()
+                async with session.post(webhook_url, json=stub_telegram.make_update(next(update_ids), chat_id, text)) as response:
+                    response.raise_for_status()
+                return await asyncio.wait_for(waiter, args.timeout) - started
+
+            async def user(chat_id, requests, record):
+                address = 'hotspot-{}'.format(chat_id % args.hotspots)
+                for i in range(requests):
+                    kind, text = REQUEST_MIX[(chat_id + i) % len(REQUEST_MIX)]
+                    try:
+                        latency = await request(chat_id, text.format(address=address))
+                    except asyncio.TimeoutError:
+                        kind, latency = 'timeout', args.timeout
+                    if record:
+                        latencies.setdefault(kind, []).append(latency)
+
+            # fills the object caches of the workers
+            await asyncio.gather(*(user(1000 + i, 1, False) for i in range(args.users)))
+            begin = time.monotonic()
+            await asyncio.gather(*(user(1000 + i, args.requests, True) for i in range(args.users)))
+            elapsed = time.monotonic() - begin
+    finally:
+        if front is not None and front.poll() is None:
+            front.terminate()
+            await asyncio.to_thread(front.wait)
+        await telegram_runner.cleanup()
+        await helium_runner.cleanup()
+        shutil.rmtree(directory, ignore_errors=True)
+    answered = [latency for kind, samples in latencies.items() if kind != 'timeout' for latency in samples]
+    return {
+        'workers': workers,
+        'users': args.users,
+        'requests': len(answered),
+        'timeouts': len(latencies.get('timeout', [])),
+        'startup_s': round(startup, 2),
+        'seconds': round(elapsed, 3),
+        'requests_per_s': round(len(answered) / elapsed, 1),
+        'latency': dict(_percentiles(answered), **{kind: _percentiles(samples)['p50_ms'] for kind, samples in latencies.items()
+                                                   if kind != 'timeout'}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=20, help='requests per user')
+    parser.add_argument('--hotspots', type=int, default=32)
+    parser.add_argument('--activities', type=int, default=200, help='stored activities per hotspot')
+    parser.add_argument('--concurrent-updates', type=int, default=1, help='updates every worker handles in parallel')
+    parser.add_argument('--helium-latency', type=float, default=0.01)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--start-timeout', type=float, default=120)
+    parser.add_argument('--verbose', action='store_true', help='show the output of the bot processes')
+    args = parser.parse_args()
+    print(json.dumps({'cpu_count': os.cpu_count()}))
+    with tempfile.TemporaryDirectory(prefix='bench-workers-seed-') as directory:
+        seed_path = os.path.join(directory, 'dataz.fs')
+        started = time.monotonic()
+        seed(seed_path, args.hotspots, args.activities)
+        print(json.dumps({'seeded_activities': args.hotspots * args.activities, 'seconds': round(time.monotonic() - started, 2)}))
+        baseline = None
+        for workers in [int(count) for count in args.workers.split(',')]:
+            result = asyncio.run(run(workers, seed_path, args))
+            baseline = baseline or result['requests_per_s']
+            result['speedup'] = round(result['requests_per_s'] / baseline, 2)
+            print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
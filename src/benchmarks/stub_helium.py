@@ -0,0 +1,129 @@
+"""! @brief Local stand-in for the Helium API used by the benchmarks."""
+##
+# @file stub_helium.py
+# @package benchmarks
+# @brief Local stand-in for the Helium API used by the benchmarks.
+#
+# @section description_stub_helium Description
+# aiohttp application serving synthetic responses for the Helium API routes
+# the bot uses, with a configurable artificial latency per request. Errors,
+# 429 responses and hanging requests can be injected through app['faults'].
+
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+
+def _roles(address: str, count: int, newest: int, step: int = 600):
+    return [
+        {
+            'type': 'poc_receipts_v2',
+            'time': newest - i * step,
+            'role': 'witness',
+            'height': 1500000 - i,
+            'hash': '{}-{}'.format(address[-8:], newest - i * step),
+        }
+        for i in range(count)
+    ]
+
+
+# fault injection, change app['faults'] at runtime; rates are fractions of all requests
+FAULTS = {
+    'error_rate': 0.0,       # answered with error_status
+    'error_status': 503,
+    'rate_limit_rate': 0.0,  # answered with 429 and a Retry-After of retry_after seconds
+    'retry_after': 1,
+    'hang_rate': 0.0,        # answered after hang_seconds
+    'hang_seconds': 30,
+}
+
+
+@web.middleware
+async def _faults(request, handler):
+    faults = request.app['faults']
+    draw = random.random()
+    if draw < faults['hang_rate']:
+        request.app['faulted'] += 1
+        await asyncio.sleep(faults['hang_seconds'])
+        return await handler(request)
+    draw -= faults['hang_rate']
+    if draw < faults['error_rate']:
+        request.app['faulted'] += 1
+        return web.json_response({'error': 'stub failure'}, status=faults['error_status'])
+    draw -= faults['error_rate']
+    if draw < faults['rate_limit_rate']:
+        request.app['faulted'] += 1
+        return web.json_response({'error': 'rate limited'}, status=429, headers={'Retry-After': str(faults['retry_after'])})
+    return await handler(request)
+
+
+def make_app(latency: float = 0.01, roles_per_page: int = 20, role_pages: int = 3) -> web.Application:
+    """! Build the stub application.
+    @param latency seconds every response is delayed by
+    @param roles_per_page number of roles in one page of /roles
+    @param role_pages number of cursor pages /roles serves
+    @return aiohttp.web.Application
+    """
+    app = web.Application(middlewares=[_faults])
+    app['requests'] = 0
+    app['faults'] = dict(FAULTS)
+    app['faulted'] = 0
+
+    async def delay(request):
+        request.app['requests'] += 1
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def stats(request):
+        await delay(request)
+        return web.json_response({'data': {'block_times': {'last_hour': {'avg': 60.0}}, 'counts': {'hotspots': 5000}}})
+
+    async def token_supply(request):
+        await delay(request)
+        return web.json_response({'data': {'token_supply': 124000000.0}})
+
+    async def hotspot(request):
+        await delay(request)
+        address = request.match_info['address']
+        owner = address.split('-hotspot-')[0] if '-hotspot-' in address else 'owner-stub'
+        return web.json_response({'data': {'address': address, 'name': 'stub-' + address[-6:], 'owner': owner,
+                                           'status': {'online': 'online'}}})
+
+    async def roles(request):
+        await delay(request)
+        address = request.match_info['address']
+        page = int(request.query.get('cursor', 0))
+        newest = int(time.time()) - page * roles_per_page * 600
+        body = {'data': _roles(address, roles_per_page, newest)}
+        if page + 1 < role_pages:
+            body['cursor'] = str(page + 1)
+        return web.json_response(body)
+
+    async def account_hotspots(request):
+        await delay(request)
+        owner = request.match_info['address']
+        return web.json_response({'data': [
+            {'address': '{}-hotspot-{}'.format(owner, i), 'name': 'stub-{}'.format(i), 'owner': owner}
+            for i in range(3)
+        ]})
+
+    app.router.add_get('/v1/stats', stats)
+    app.router.add_get('/v1/stats/token_supply', token_supply)
+    app.router.add_get('/v1/hotspots/{address}', hotspot)
+    app.router.add_get('/v1/hotspots/{address}/roles', roles)
+    app.router.add_get('/v1/accounts/{address}/hotspots', account_hotspots)
+    return app
+
+
+async def start_stub(app: web.Application, host: str = '127.0.0.1', port: int = 0):
+    """! Serve the stub application on a local port.
+    @return tuple of (AppRunner, base URL)
+    """
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://{}:{}'.format(host, port)
@@ -0,0 +1,144 @@
+"""! @brief Local stand-in for the Telegram Bot API used by the benchmarks."""
+##
+# @file stub_telegram.py
+# @package benchmarks
+# @brief Local stand-in for the Telegram Bot API used by the benchmarks.
+#
+# @section description_stub_telegram Description
+# aiohttp application answering the Bot API methods the bot uses. getUpdates
+# long-polls a queue of synthetic updates, and every sendMessage call is
+# recorded with its arrival time, so benchmarks can measure the latency from
+# an update to the reply of its handler. A callable stored in app['on_sent']
+# is called with (received, chat_id, text) for every sent message. Point the Application at it with
+# ApplicationBuilder().base_url(base_url + '/bot').
+
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    """! Synthetic Update JSON of a private text message; text starting with / is marked as a bot command.
+    @return dict
+    """
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User{}'.format(chat_id)},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split(' ', 1)[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def push_update(app: web.Application, update: dict):
+    """! Make an update available to getUpdates.
+    @return None
+    """
+    app['updates'].append(update)
+    app['update_event'].set()
+
+
+async def wait_for_sent(app: web.Application, count: int, timeout: float = 60):
+    """! Wait until count messages were sent in total.
+    @return None
+    """
+    async with app['sent_condition']:
+        await asyncio.wait_for(app['sent_condition'].wait_for(lambda: len(app['sent']) >= count), timeout)
+
+
+async def _parameters(request: web.Request) -> dict:
+    if request.content_type == 'application/json':
+        return await request.json()
+    parameters = {}
+    for key, value in (await request.post()).items():
+        try:
+            parameters[key] = json.loads(value)
+        except (TypeError, ValueError):
+            parameters[key] = value
+    return parameters
+
+
+def make_app(latency: float = 0.0) -> web.Application:
+    """! Build the stub application.
+    @param latency seconds every response is delayed by, on top of long polling
+    @return aiohttp.web.Application
+    """
+    app = web.Application()
+    app['updates'] = []
+    app['update_event'] = asyncio.Event()
+    app['sent'] = []
+    app['sent_condition'] = asyncio.Condition()
+    app['calls'] = {}
+    app['on_sent'] = None
+
+    def ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_updates(parameters):
+        offset = int(parameters.get('offset') or 0)
+        deadline = time.monotonic() + float(parameters.get('timeout') or 0)
+        while True:
+            updates = [update for update in app['updates'] if update['update_id'] >= offset]
+            # confirmed updates are dropped, like the Bot API does
+            app['updates'] = updates
+            remaining = deadline - time.monotonic()
+            if updates or remaining <= 0:
+                return updates[:int(parameters.get('limit') or 100)]
+            app['update_event'].clear()
+            try:
+                await asyncio.wait_for(app['update_event'].wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send_message(parameters):
+        received = time.monotonic()
+        chat_id = int(parameters['chat_id'])
+        async with app['sent_condition']:
+            app['sent'].append((received, chat_id, parameters.get('text')))
+            app['sent_condition'].notify_all()
+        if app['on_sent'] is not None:
+            app['on_sent'](received, chat_id, parameters.get('text'))
+        return {
+            'message_id': len(app['sent']),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': parameters.get('text'),
+        }
+
+    async def method(request):
+        name = request.match_info['method']
+        parameters = await _parameters(request)
+        app['calls'][name] = app['calls'].get(name, 0) + 1
+        if latency:
+            await asyncio.sleep(latency)
+        if name == 'getMe':
+            return ok(BOT_USER)
+        if name == 'getUpdates':
+            return ok(await get_updates(parameters))
+        if name == 'sendMessage':
+            return ok(await send_message(parameters))
+        # setWebhook, deleteWebhook, answerCallbackQuery, ...
+        return ok(True)
+
+    app.router.add_route('*', '/bot{token}/{method}', method)
+    return app
+
+
+async def start_stub(app: web.Application, host: str = '127.0.0.1', port: int = 0):
+    """! Serve the stub application on a local port.
+    @return tuple of (AppRunner, base URL)
+    """
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, 'http://{}:{}'.format(host, port)
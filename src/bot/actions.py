@@ -1,45 +1,178 @@
+import logging
+
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 from bot.helium_requests import *
+from bot.helium_client import HeliumAPIError
+from bot import metrics
+from bot.send_queue import send_message
+from bot.renderer import send_rendered
+from bot.activity_sync import get_stored_hotspot_activity, get_stored_recent_hotspot_activity, get_hotspot_summary, rebuild_hotspot_aggregates
+from bot.tracking import register_owner, register_hotspot, get_user_hotspots
+from bot.db.AsyncDBManager import AsyncDBManager
+from bot.notifications import snooze_notifications, resume_notifications
+from util.constants import AggregateConstants, RendererConstants
+from util.time_helper import format_utc_time
+
+log = logging.getLogger(__name__)
 
+@metrics.handler
 async def echo(update: Update, context: ContextTypes):
     '''
     Text that is not a command will be echoed back to the user.
     '''
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=update.message.text)
+    await send_message(context, update.effective_chat.id, update.message.text)
 
+@metrics.handler
 async def send_blockchain_stats(update: Update, context: ContextTypes):
     '''
     Get Helium Blockchain stats
     '''
     response = await get_bc_stats()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=response, parse_mode=ParseMode.MARKDOWN)
+    await send_rendered(context, update.effective_chat.id, RendererConstants.TEMPLATE_STATS, response)
 
+@metrics.handler
 async def send_token_supply(update: Update, context: ContextTypes):
     '''
     Get current token supply
     '''
     response = await get_token_supply()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+    await send_rendered(context, update.effective_chat.id, RendererConstants.TEMPLATE_TOKEN_SUPPLY, response)
+
+def _address_argument(context: ContextTypes):
+    '''
+    First command argument, None if the command was sent without one.
+    '''
+    return context.args[0] if context.args else None
 
+@metrics.handler
 async def send_hotspot_data(update: Update, context: ContextTypes):
     '''
     Get current token supply
     '''
-    response = await get_hotspot_data()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+    response = await get_hotspot_data(_address_argument(context))
+    await send_rendered(context, update.effective_chat.id, RendererConstants.TEMPLATE_HOTSPOT, response)
 
+@metrics.handler
 async def send_all_hotspot_activity(update: Update, context: ContextTypes):
     '''
     Get current token supply
     '''
-    response = await get_hotspot_activity()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+    response = await get_stored_hotspot_activity(_address_argument(context))
+    await send_rendered(context, update.effective_chat.id, RendererConstants.TEMPLATE_ACTIVITY, response)
 
+@metrics.handler
 async def send_recent_hotspot_activity(update: Update, context: ContextTypes):
     '''
     Get recent 24h hotspot activity
     '''
-    response = await get_hotspot_activity()
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+    response = await get_stored_recent_hotspot_activity(_address_argument(context))
+    await send_rendered(context, update.effective_chat.id, RendererConstants.TEMPLATE_RECENT_ACTIVITY, response, hours=24)
+
+@metrics.handler
+async def send_hotspot_summary(update: Update, context: ContextTypes):
+    '''
+    Rewards, witnesses and beacons of a hotspot in the last 24h, 7d and 30d
+    '''
+    response = await get_hotspot_summary(_address_argument(context))
+    if response is None:
+        await send_message(context, update.effective_chat.id,
+                           'No activity of this hotspot recorded yet. Track it with /add_hotspot or backfill it with /hs_summary_rebuild.')
+        return
+    await send_rendered(context, update.effective_chat.id, RendererConstants.TEMPLATE_SUMMARY, response)
+
+@metrics.handler
+async def rebuild_hotspot_summary(update: Update, context: ContextTypes):
+    '''
+    Backfill the activity summary of a tracked hotspot from the Helium API history
+    '''
+    max_days = AggregateConstants.RETENTION_HOURS // 24
+    hotspot_address = _address_argument(context) or get_config().get('HOTSPOT_ADDRESS')
+    try:
+        days = int(context.args[1]) if len(context.args or ()) > 1 else AggregateConstants.REBUILD_DAYS
+    except ValueError:
+        days = 0
+    if not hotspot_address or not 1 <= days <= max_days:
+        await send_message(context, update.effective_chat.id, 'Usage: /hs_summary_rebuild <hotspot address> [days, 1-{}]'.format(max_days))
+        return
+    tracked = {hotspot.hotspot_address for hotspot in await AsyncDBManager.run(get_user_hotspots, update.effective_user.id)}
+    if hotspot_address not in tracked and hotspot_address != get_config().get('HOTSPOT_ADDRESS'):
+        await send_message(context, update.effective_chat.id, 'Only tracked hotspots can be rebuilt, add it with /add_hotspot first.')
+        return
+    count = await rebuild_hotspot_aggregates(hotspot_address, days)
+    await send_message(context, update.effective_chat.id, 'Rebuilt the summary from {} activities of the last {} days.'.format(count, days))
+
+@metrics.handler
+async def add_user_owner(update: Update, context: ContextTypes):
+    '''
+    Register an owner account and track all of its hotspots
+    '''
+    owner_address = _address_argument(context)
+    if not owner_address:
+        await send_message(context, update.effective_chat.id, 'Usage: /add_owner <owner address>')
+        return
+    user = update.effective_user
+    added = await register_owner(user.id, user.username, owner_address)
+    await send_message(context, update.effective_chat.id, 'Owner registered, {} new hotspots tracked.'.format(added))
+
+@metrics.handler
+async def add_user_hotspot(update: Update, context: ContextTypes):
+    '''
+    Register a single hotspot
+    '''
+    hotspot_address = _address_argument(context)
+    if not hotspot_address:
+        await send_message(context, update.effective_chat.id, 'Usage: /add_hotspot <hotspot address>')
+        return
+    user = update.effective_user
+    data = await register_hotspot(user.id, user.username, hotspot_address)
+    text = 'Hotspot {} is now tracked.'.format(data.get('name')) if data else 'Hotspot not found.'
+    await send_message(context, update.effective_chat.id, text)
+
+@metrics.handler
+async def send_user_hotspots(update: Update, context: ContextTypes):
+    '''
+    List hotspots tracked for the user
+    '''
+    hotspots = await AsyncDBManager.run(get_user_hotspots, update.effective_user.id)
+    text = '\n'.join('{} - {}'.format(hotspot.animal_name, hotspot.hotspot_address) for hotspot in hotspots)
+    await send_message(context, update.effective_chat.id, text or 'No hotspots tracked yet.')
+
+@metrics.handler
+async def snooze_user_notifications(update: Update, context: ContextTypes):
+    '''
+    Snooze notifications for the given number of hours
+    '''
+    try:
+        hours = float(context.args[0]) if context.args else None
+    except ValueError:
+        hours = 0
+    if hours is not None and hours <= 0:
+        await send_message(context, update.effective_chat.id, 'Usage: /snooze <hours>')
+        return
+    until = await snooze_notifications(update.effective_user.id, hours)
+    await send_message(context, update.effective_chat.id, 'Notifications snoozed until {}.'.format(format_utc_time(until)))
+
+@metrics.handler
+async def resume_user_notifications(update: Update, context: ContextTypes):
+    '''
+    Resume snoozed notifications
+    '''
+    resumed = await resume_notifications(update.effective_user.id)
+    await send_message(context, update.effective_chat.id, 'Notifications resumed.' if resumed else 'Notifications are not snoozed.')
+
+async def handle_error(update: object, context: ContextTypes):
+    '''
+    Log errors raised by handlers and jobs, and tell the user when the Helium API request of a command failed
+    '''
+    error = context.error
+    if isinstance(error, HeliumAPIError) and isinstance(update, Update) and update.effective_chat is not None:
+        log.info('Helium API request of update %s failed: %s', update.update_id, error)
+        if error.status == 404:
+            text = 'Not found on the Helium API.'
+        else:
+            text = 'The Helium API is not available right now, please try again later.'
+        await send_message(context, update.effective_chat.id, text)
+        return
+    log.error('Error while handling %s', update, exc_info=error)
@@ -0,0 +1,214 @@
+"""! @brief Background incremental sync of hotspot activity into the DB."""
+##
+# @file activity_sync.py
+# @package bot
+# @brief Background incremental sync of hotspot activity into the DB.
+#
+# @section description_activity_sync Description
+# A repeating JobQueue job fetches, for every tracked hotspot, only the roles
+# newer than the last synced transaction and stores them as Activity records.
+# Activity commands are then answered from the local DB, and users tracking
+# a hotspot are notified about its new events. Storing the activities also
+# updates the hourly activity aggregates that /hs_summary reads; older
+# history is backfilled into them by rebuild_hotspot_aggregates().
+#
+# @section notes_activity_sync Notes
+# - Each hotspot is written in a single transaction together with its sync state.
+
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from telegram.ext import Application, ContextTypes
+
+from bot.db.AsyncDBManager import AsyncDBManager
+from bot.db.model.Activity import Activity
+from bot.fanout import fan_out
+from bot.tracking import get_tracked_hotspots
+from bot.helium_requests import iter_hotspot_roles, get_hotspot_data, get_hotspot_activity, get_recent_hotspot_activity
+from bot.notifications import diff_events, notify_hotspot_events
+from util.constants import AggregateConstants, FanOutConstants, NotificationConstants, SyncConstants
+from util.read_secrets import read_secrets
+from util.time_helper import get_iso_utc_time
+
+_config: Optional[dict] = None
+log = logging.getLogger(__name__)
+
+
+def configure(config: dict):
+    """! Use config instead of secrets.json for the sync job settings and the default HOTSPOT_ADDRESS.
+    @param config secrets/config dictionary
+    @return None
+    """
+    global _config
+    _config = config
+
+def _get_config() -> dict:
+    """! Internal getter for the config set by configure(), secrets.json until then.
+    @return dict
+    """
+    return read_secrets() if _config is None else _config
+
+
+async def tracked_hotspots() -> List[Tuple[str, Optional[str]]]:
+    """! All hotspots that are kept in sync: the registered ones plus the configured HOTSPOT_ADDRESS.
+    @return list of (hotspot address, owner address) tuples
+    """
+    hotspots = await AsyncDBManager.run(get_tracked_hotspots)
+    address = _get_config().get('HOTSPOT_ADDRESS')
+    if address and address not in {hotspot_address for hotspot_address, _ in hotspots}:
+        hotspots.append((address, None))
+    return hotspots
+
+async def get_hotspot_status(hotspot_address: str) -> Optional[str]:
+    """! Current online status of a hotspot.
+    @return 'online' or 'offline', None if it could not be fetched
+    """
+    try:
+        data = (await get_hotspot_data(hotspot_address)).get('data') or {}
+    except Exception as error:
+        log.debug('Could not fetch the status of hotspot %s: %s', hotspot_address, error)
+        return None
+    return (data.get('status') or {}).get('online')
+
+async def sync_hotspot_activity(hotspot_address: str, owner_address: Optional[str] = None,
+                                notify: Optional[Callable[[str, dict], Awaitable]] = None) -> int:
+    """! Fetch the roles of a hotspot newer than its sync state and store them.
+    @param hotspot_address Helium address of the hotspot
+    @param owner_address optional Helium address of the hotspot owner
+    @param notify optional coroutine function called with the hotspot address and its events, see
+    notifications.diff_events(), if anything happened since the last sync
+    @return number of new activities stored
+    """
+    state = await AsyncDBManager.get_sync_state(hotspot_address)
+    old_state = state
+    if state is not None:
+        since, last_hash = state['time'], state['hash']
+    else:
+        hours = int(_get_config().get('SYNC_INITIAL_HOURS', SyncConstants.INITIAL_HOURS))
+        since, last_hash = int(time.time()) - hours * 3600, None
+
+    new_roles = []
+    roles = iter_hotspot_roles(hotspot_address, since=since)
+    try:
+        async for role in roles:
+            # roles come newest first, everything from the last seen one on is stored already
+            if last_hash is not None and role.get('hash') == last_hash:
+                break
+            new_roles.append(role)
+    finally:
+        await roles.aclose()
+
+    if new_roles:
+        state = {'hash': new_roles[0].get('hash'), 'time': new_roles[0].get('time', since)}
+    elif state is None:
+        state = {'hash': None, 'time': since}
+    state['last_updated_at'] = get_iso_utc_time()
+    status = None
+    if notify is not None and str(_get_config().get('NOTIFY_STATUS', NotificationConstants.CHECK_STATUS)).lower() == 'true':
+        status = await get_hotspot_status(hotspot_address)
+    old_status = old_state.get('online') if old_state is not None else None
+    state['online'] = status or old_status
+
+    # insert oldest first so uuids follow the chain order
+    activities = [Activity.from_role(role, hotspot_address, owner_address) for role in reversed(new_roles)]
+    await AsyncDBManager.store_activities(hotspot_address, activities, state)
+    # the first sync fetches history, there is nothing new to tell about yet
+    if notify is not None and old_state is not None:
+        events = diff_events(new_roles, old_status, status)
+        if events:
+            await notify(hotspot_address, events)
+    return len(activities)
+
+async def sync_activity_job(context: ContextTypes.DEFAULT_TYPE):
+    """! JobQueue callback syncing the activity of every tracked hotspot.
+    @return None
+    """
+    async def notify(hotspot_address: str, events: dict):
+        await notify_hotspot_events(context, hotspot_address, events)
+
+    async def sync(hotspot: Tuple[str, Optional[str]]):
+        count = await sync_hotspot_activity(*hotspot, notify=notify)
+        log.debug('Synced %s new activities for hotspot %s.', count, hotspot[0])
+
+    config = _get_config()
+    result = await fan_out(
+        await tracked_hotspots(),
+        sync,
+        concurrency=int(config.get('REFRESH_CONCURRENCY', FanOutConstants.CONCURRENCY)),
+        batch_size=int(config.get('REFRESH_BATCH_SIZE', FanOutConstants.BATCH_SIZE)),
+        timeout=float(config['REFRESH_TIMEOUT']) if 'REFRESH_TIMEOUT' in config else None,
+    )
+    log.info('Activity sync finished: %s', result)
+
+def schedule_activity_sync(application: Application):
+    """! Register the repeating activity sync job on the Application's JobQueue.
+    @param application the Application to schedule the job on
+    @return the scheduled Job, None if the JobQueue is not available
+    """
+    if application.job_queue is None:
+        log.warning('JobQueue is not available, activity sync is disabled.')
+        return None
+    config = _get_config()
+    return application.job_queue.run_repeating(
+        sync_activity_job,
+        interval=float(config.get('SYNC_INTERVAL', SyncConstants.INTERVAL)),
+        first=float(config.get('SYNC_FIRST_RUN_DELAY', SyncConstants.FIRST_RUN_DELAY)),
+        name=SyncConstants.JOB_NAME,
+    )
+
+async def get_stored_hotspot_activity(hotspot_address: Optional[str] = None):
+    """! All synced activity of a hotspot, read from the DB. Falls back to the API for hotspots that were never synced.
+    @param hotspot_address Helium address of the hotspot, the configured one by default
+    @return dict with a 'data' list of roles, newest first
+    """
+    hotspot_address = hotspot_address or _get_config()['HOTSPOT_ADDRESS']
+    if await AsyncDBManager.get_sync_state(hotspot_address) is None:
+        return await get_hotspot_activity(hotspot_address)
+    return {'data': await AsyncDBManager.get_hotspot_activities(hotspot_address)}
+
+async def get_stored_recent_hotspot_activity(hotspot_address: Optional[str] = None, hours: int = 24):
+    """! Synced activity of a hotspot of the last hours, read from the DB. Falls back to the API for hotspots that were never synced.
+    @param hotspot_address Helium address of the hotspot, the configured one by default
+    @param hours size of the window
+    @return dict with a 'data' list of roles, newest first
+    """
+    hotspot_address = hotspot_address or _get_config()['HOTSPOT_ADDRESS']
+    if await AsyncDBManager.get_sync_state(hotspot_address) is None:
+        return await get_recent_hotspot_activity(hotspot_address, hours)
+    since = int(time.time()) - hours * 3600
+    return {'data': await AsyncDBManager.get_hotspot_activities(hotspot_address, since=since)}
+
+async def get_hotspot_summary(hotspot_address: Optional[str] = None):
+    """! Activity counts of a hotspot over the last 24h, 7d and 30d, read from its hourly aggregates.
+    @param hotspot_address Helium address of the hotspot, the configured one by default
+    @return dict with a 'data' list of one dict of counts per window, None if the hotspot has no aggregates
+    """
+    hotspot_address = hotspot_address or _get_config()['HOTSPOT_ADDRESS']
+    summary = await AsyncDBManager.get_activity_summary(hotspot_address)
+    if summary is None:
+        return None
+    return {'data': [dict(counts, window=label) for label, counts in summary.items()]}
+
+async def rebuild_hotspot_aggregates(hotspot_address: str, days: int = AggregateConstants.REBUILD_DAYS) -> int:
+    """! Backfill the hourly aggregates of a hotspot from the roles of the last days fetched from the Helium API.
+    The bucket of the current hour is left to the incremental updates of the activity sync, so roles
+    stored while the history was fetched are not lost. Roles of the backfilled hours that the sync
+    stores later, e.g. in the first sync of the hotspot, are not counted a second time.
+    @param hotspot_address Helium address of the hotspot
+    @param days days of history, at most AggregateConstants.RETENTION_HOURS / 24
+    @return number of roles counted
+    """
+    until = int(time.time())
+    # whole hours only, a partly fetched first bucket would undercount
+    since = (until // AggregateConstants.BUCKET_SECONDS - days * 24) * AggregateConstants.BUCKET_SECONDS
+    activities = []
+    roles = iter_hotspot_roles(hotspot_address, since=since)
+    try:
+        async for role in roles:
+            activities.append((role.get('time', 0), role.get('type'), role.get('role')))
+    finally:
+        await roles.aclose()
+    count = await AsyncDBManager.replace_activity_aggregates(hotspot_address, activities, since, until)
+    log.info('Rebuilt the activity aggregates of hotspot %s from %s roles of %s days.', hotspot_address, count, days)
+    return count
@@ -0,0 +1,220 @@
+import bisect
+import logging
+import operator
+from array import array
+from typing import Any, Dict, Iterable, Optional, Tuple
+import ZODB
+from BTrees.LOBTree import LOBTree
+from BTrees.OOBTree import OOBTree
+
+log = logging.getLogger(__name__)
+from util.constants import AggregateConstants, DbConstants
+
+_COUNTERS = AggregateConstants.COUNTERS
+_TOTAL = _COUNTERS.index('total')
+_REWARDS = _COUNTERS.index('rewards')
+_WITNESSES = _COUNTERS.index('witnesses')
+_BEACONS = _COUNTERS.index('beacons')
+_CHALLENGES = _COUNTERS.index('challenges')
+_DATA = _COUNTERS.index('data')
+
+
+class ActivityAggregates():
+    """! Rolling per-hotspot activity counters. For every hotspot address the 'activity_aggregates' tree
+    holds a LOBTree keyed by hour (epoch time // BUCKET_SECONDS) whose values are arrays with one counter
+    per AggregateConstants.COUNTERS entry, so a summary of the last 30 days reads at most 720 small buckets.
+    Maintained by DBManager inside the same transaction as the activity change. Buckets are only dropped
+    once they are older than RETENTION_HOURS, so the counters outlive activities removed by the retention job.
+    The 'aggregate_horizons' tree holds the first hour after the last backfill of each hotspot; activities
+    stored later that fall before it were counted by the backfill already and are not counted again.
+    """
+
+    @staticmethod
+    def _get_tree(conn: ZODB.Connection.Connection) -> Optional[OOBTree]:
+        """! Internal getter for the aggregates tree, None if it is not installed yet.
+        @return OOBTree of hotspot address to LOBTree
+        """
+        return conn.root().get(DbConstants.TREE_NAME_ACTIVITY_AGGREGATES)
+
+    @staticmethod
+    def hour(epoch_time: int) -> int:
+        """! Bucket of an epoch time.
+        @return hour number
+        """
+        return int(epoch_time) // AggregateConstants.BUCKET_SECONDS
+
+    @staticmethod
+    def classify(type: Optional[str], role: Optional[str]) -> Tuple[int, ...]:
+        """! Counters an activity of the given transaction type and role counts towards.
+        @return tuple of indices into AggregateConstants.COUNTERS
+        """
+        counters = [_TOTAL]
+        type = type or ''
+        if type.startswith('rewards'):
+            counters.append(_REWARDS)
+        elif type.startswith('state_channel_close'):
+            counters.append(_DATA)
+        if role == 'witness':
+            counters.append(_WITNESSES)
+        elif role == 'challengee':
+            counters.append(_BEACONS)
+        elif role == 'challenger':
+            counters.append(_CHALLENGES)
+        return tuple(counters)
+
+    @staticmethod
+    def key(activity: Any) -> Optional[Tuple[str, int, Tuple[int, ...]]]:
+        """! Bucket and counters of an activity, taken before it is changed.
+        @return (hotspot address, hour, counter indices) tuple, None for inactive activities
+        """
+        if not activity.active or activity.hotspot_address is None:
+            return None
+        return activity.hotspot_address, ActivityAggregates.hour(activity.time), ActivityAggregates.classify(activity.type, activity.role)
+
+    @staticmethod
+    def _add(buckets: LOBTree, hour: int, counters: Tuple[int, ...], amount: int):
+        """! Internal method adding amount to counters of one bucket; empty buckets are removed.
+        @return None
+        """
+        bucket = buckets.get(hour)
+        if bucket is None:
+            if amount <= 0:
+                return
+            bucket = array('I', bytes(4 * len(_COUNTERS)))
+        else:
+            # stored values are never changed in place, the BTree would not notice
+            bucket = array('I', bucket)
+        for counter in counters:
+            bucket[counter] = max(0, bucket[counter] + amount)
+        if bucket[_TOTAL]:
+            buckets[hour] = bucket
+        elif hour in buckets:
+            del buckets[hour]
+
+    @staticmethod
+    def _trim(buckets: LOBTree, newest_hour: int):
+        """! Internal method dropping the buckets older than RETENTION_HOURS before newest_hour.
+        @return None
+        """
+        cutoff = newest_hour - AggregateConstants.RETENTION_HOURS
+        for hour in list(buckets.keys(max=cutoff, excludemax=True)):
+            del buckets[hour]
+
+    @staticmethod
+    def add(conn: ZODB.Connection.Connection, key: Optional[Tuple[str, int, Tuple[int, ...]]], amount: int = 1):
+        """! Count an activity into, or with a negative amount out of, the bucket of its hour.
+        @param key bucket of the activity, see key()
+        @param amount 1 for an added activity, -1 for a removed one
+        @return None
+        """
+        tree = ActivityAggregates._get_tree(conn)
+        if tree is None or key is None:
+            return
+        hotspot_address, hour, counters = key
+        buckets = tree.get(hotspot_address)
+        if buckets is None:
+            if amount <= 0:
+                return
+            buckets = tree[hotspot_address] = LOBTree()
+        if amount > 0 and hour not in buckets:
+            # a new bucket, the only time old ones have to be dropped
+            newest = max(hour, buckets.maxKey()) if buckets else hour
+            if hour < newest - AggregateConstants.RETENTION_HOURS:
+                return
+            ActivityAggregates._trim(buckets, newest)
+        ActivityAggregates._add(buckets, hour, counters, amount)
+
+    @staticmethod
+    def add_new(conn: ZODB.Connection.Connection, activity: Any):
+        """! Count a newly stored activity, unless it is older than the last backfill of its hotspot.
+        @param activity Activity record
+        @return None
+        """
+        key = ActivityAggregates.key(activity)
+        if key is None:
+            return
+        horizons = conn.root().get(DbConstants.TREE_NAME_AGGREGATE_HORIZONS)
+        if horizons is not None and key[1] < horizons.get(key[0], key[1]):
+            return
+        ActivityAggregates.add(conn, key)
+
+    @staticmethod
+    def replace(conn: ZODB.Connection.Connection, hotspot_address: str, activities: Iterable[Tuple[int, Optional[str], Optional[str]]],
+                since: int, until: int) -> int:
+        """! Replace the buckets of a hotspot with since <= hour < until by counts of the given activities.
+        The backfilled hours are recorded as counted, see add_new().
+        @param activities iterable of (time, type, role) tuples
+        @param since first hour replaced
+        @param until first hour kept
+        @return number of activities counted
+        """
+        tree = ActivityAggregates._get_tree(conn)
+        if tree is None:
+            return 0
+        buckets = tree.get(hotspot_address)
+        if buckets is None:
+            buckets = tree[hotspot_address] = LOBTree()
+        for hour in list(buckets.keys(min=since, max=until, excludemax=True)):
+            del buckets[hour]
+        counts: Dict[int, array] = {}
+        count = 0
+        for activity_time, type, role in activities:
+            hour = ActivityAggregates.hour(activity_time)
+            if not since <= hour < until:
+                continue
+            bucket = counts.get(hour)
+            if bucket is None:
+                bucket = counts[hour] = array('I', bytes(4 * len(_COUNTERS)))
+            for counter in ActivityAggregates.classify(type, role):
+                bucket[counter] += 1
+            count += 1
+        buckets.update(counts)
+        if buckets:
+            ActivityAggregates._trim(buckets, buckets.maxKey())
+        horizons = conn.root().get(DbConstants.TREE_NAME_AGGREGATE_HORIZONS)
+        if horizons is not None and horizons.get(hotspot_address, 0) < until:
+            horizons[hotspot_address] = until
+        return count
+
+    @staticmethod
+    def summarize(conn: ZODB.Connection.Connection, hotspot_address: str, now: int,
+                  windows: Iterable[Tuple[str, int]] = AggregateConstants.WINDOWS) -> Optional[Dict[str, Dict[str, int]]]:
+        """! Counter sums of a hotspot over windows ending with the hour of now, in one pass over the buckets.
+        @param now epoch time the windows end at
+        @param windows (label, hours) tuples
+        @return dict of window label to dict of counter name to sum, None if the hotspot has no aggregates
+        """
+        tree = ActivityAggregates._get_tree(conn)
+        buckets = tree.get(hotspot_address) if tree is not None else None
+        if buckets is None:
+            return None
+        current = ActivityAggregates.hour(now)
+        windows = list(windows)
+        # the windows share their end, so the buckets are summed per segment between two window starts
+        starts = sorted({current - hours + 1 for _, hours in windows})
+        segments = [[0] * len(_COUNTERS) for _ in starts]
+        for hour, bucket in buckets.items(min=starts[0], max=current):
+            segment = bisect.bisect_right(starts, hour) - 1
+            segments[segment] = list(map(operator.add, segments[segment], bucket))
+        sums = {}
+        for label, hours in windows:
+            first = starts.index(current - hours + 1)
+            sums[label] = dict(zip(_COUNTERS, map(sum, zip(*segments[first:]))))
+        return sums
+
+    @staticmethod
+    def rebuild(conn: ZODB.Connection.Connection):
+        """! Rebuild the aggregates from the activities tree. Changes are committed with the caller's transaction.
+        @return number of activities counted
+        """
+        root = conn.root()
+        root[DbConstants.TREE_NAME_ACTIVITY_AGGREGATES] = OOBTree()
+        # every stored activity is counted below, earlier backfills no longer apply
+        root[DbConstants.TREE_NAME_AGGREGATE_HORIZONS] = OOBTree()
+        count = 0
+        for activity in root[DbConstants.TREE_NAME_ACTIVITIES].values():
+            if activity.active:
+                ActivityAggregates.add(conn, ActivityAggregates.key(activity))
+                count += 1
+        log.info('Built activity aggregates from %s activities.', count)
+        return count
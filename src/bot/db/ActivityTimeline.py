@@ -0,0 +1,116 @@
+import logging
+from typing import Any, Iterator, List, Optional, Tuple
+import ZODB
+from BTrees.LOBTree import LOBTree
+from BTrees.OOBTree import OOBTree
+
+log = logging.getLogger(__name__)
+from util.constants import DbConstants
+
+class ActivityTimeline():
+    """! Time-ordered view of the activities tree. For every hotspot address the 'activity_timeline' tree
+    holds a LOBTree keyed by epoch time whose values are tuples of the uuids of the activities at that time,
+    so time ranges are answered by BTree key-range iteration in O(log n + k).
+    Maintained by DBManager inside the same transaction as the activity change.
+    """
+
+    @staticmethod
+    def _get_tree(conn: ZODB.Connection.Connection) -> Optional[OOBTree]:
+        """! Internal getter for the timeline tree, None if it is not installed yet.
+        @return OOBTree of hotspot address to LOBTree
+        """
+        return conn.root().get(DbConstants.TREE_NAME_ACTIVITY_TIMELINE)
+
+    @staticmethod
+    def key(activity: Any) -> Optional[Tuple[str, int]]:
+        """! Timeline position of an activity, taken before it is changed.
+        @return (hotspot address, time) tuple, None for inactive activities
+        """
+        if not activity.active or activity.hotspot_address is None:
+            return None
+        return activity.hotspot_address, activity.time
+
+    @staticmethod
+    def add(conn: ZODB.Connection.Connection, uuid: str, activity: Any):
+        """! Add an active activity to the timeline of its hotspot.
+        @return None
+        """
+        tree = ActivityTimeline._get_tree(conn)
+        if tree is None or not activity.active or activity.hotspot_address is None:
+            return
+        timeline = tree.get(activity.hotspot_address)
+        if timeline is None:
+            timeline = tree[activity.hotspot_address] = LOBTree()
+        uuids = timeline.get(activity.time, ())
+        if uuid not in uuids:
+            timeline[activity.time] = uuids + (uuid,)
+
+    @staticmethod
+    def remove(conn: ZODB.Connection.Connection, uuid: str, hotspot_address: str, time: int):
+        """! Remove an activity from the timeline of its hotspot.
+        @return None
+        """
+        tree = ActivityTimeline._get_tree(conn)
+        timeline = tree.get(hotspot_address) if tree is not None else None
+        if timeline is None:
+            return
+        uuids = tuple(other for other in timeline.get(time, ()) if other != uuid)
+        if uuids:
+            timeline[time] = uuids
+        elif time in timeline:
+            del timeline[time]
+
+    @staticmethod
+    def iter_range(conn: ZODB.Connection.Connection, hotspot_address: str,
+                   since: Optional[int] = None, until: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """! Lazily iterate the activities of a hotspot with since <= time <= until, oldest first.
+        @return iterator of (time, uuid) tuples
+        """
+        tree = ActivityTimeline._get_tree(conn)
+        timeline = tree.get(hotspot_address) if tree is not None else None
+        if timeline is None:
+            return
+        for time, uuids in timeline.items(min=since, max=until):
+            for uuid in uuids:
+                yield time, uuid
+
+    @staticmethod
+    def get_expired(conn: ZODB.Connection.Connection, hotspot_address: str, horizon: int, limit: int) -> List[Tuple[int, str]]:
+        """! Oldest activities of a hotspot older than the horizon.
+        @param horizon epoch time; activities strictly older are expired
+        @param limit maximum number of activities returned
+        @return list of (time, uuid) tuples, oldest first
+        """
+        expired = []
+        tree = ActivityTimeline._get_tree(conn)
+        timeline = tree.get(hotspot_address) if tree is not None else None
+        if timeline is None:
+            return expired
+        for time, uuids in timeline.items(max=horizon, excludemax=True):
+            expired.extend((time, uuid) for uuid in uuids)
+            if len(expired) >= limit:
+                break
+        return expired
+
+    @staticmethod
+    def iter_hotspot_addresses(conn: ZODB.Connection.Connection) -> Iterator[str]:
+        """! Lazily iterate the addresses of all hotspots with a timeline.
+        @return iterator of hotspot addresses
+        """
+        tree = ActivityTimeline._get_tree(conn)
+        return iter(tree.keys()) if tree is not None else iter(())
+
+    @staticmethod
+    def rebuild(conn: ZODB.Connection.Connection):
+        """! Rebuild the timeline from the activities tree. Changes are committed with the caller's transaction.
+        @return number of activities in the timeline
+        """
+        root = conn.root()
+        root[DbConstants.TREE_NAME_ACTIVITY_TIMELINE] = OOBTree()
+        count = 0
+        for uuid, activity in root[DbConstants.TREE_NAME_ACTIVITIES].items():
+            if activity.active:
+                ActivityTimeline.add(conn, uuid, activity)
+                count += 1
+        log.info('Built activity timeline with %s activities.', count)
+        return count
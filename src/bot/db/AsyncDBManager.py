@@ -0,0 +1,165 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+from .DBManager import DBManager
+from util.constants import DbConstants
+from util.read_secrets import read_secrets
+
+class AsyncDBManager():
+    """! Async facade for DBManager. DB work runs in a bounded thread pool, so disk I/O
+    and commits never block the event loop serving Telegram updates. Reads run in parallel,
+    writes go through a single writer thread so they do not conflict with each other.
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _write_executor: Optional[ThreadPoolExecutor] = None
+    _threads: Optional[int] = None
+
+    @staticmethod
+    def configure(config: dict):
+        """! Take the size of the DB thread pool from config instead of secrets.json. Has to be called before the pool is first used.
+        @param config secrets/config dictionary with an optional DB_THREADS key
+        @return None
+        """
+        if AsyncDBManager._executor is not None:
+            raise RuntimeError('The DB thread pool is running already, configure() has to be called before first use.')
+        AsyncDBManager._threads = int(config.get('DB_THREADS', DbConstants.DB_THREADS))
+
+    @staticmethod
+    def get_executor() -> ThreadPoolExecutor:
+        """! Getter for the DB thread pool, created on first use.
+        @return ThreadPoolExecutor
+        """
+        if AsyncDBManager._executor is None:
+            workers = AsyncDBManager._threads
+            if workers is None:
+                workers = int(read_secrets().get('DB_THREADS', DbConstants.DB_THREADS))
+            AsyncDBManager._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zodb')
+            log.info('Started DB thread pool with %s workers.', workers)
+        return AsyncDBManager._executor
+
+    @staticmethod
+    def get_write_executor() -> ThreadPoolExecutor:
+        """! Getter for the single-threaded DB writer, created on first use.
+        @return ThreadPoolExecutor
+        """
+        if AsyncDBManager._write_executor is None:
+            AsyncDBManager._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='zodb-writer')
+        return AsyncDBManager._write_executor
+
+    @staticmethod
+    def shutdown():
+        """! Wait for pending DB work, stop the thread pool and report leaked connections.
+        @return None
+        """
+        if AsyncDBManager._write_executor is not None:
+            AsyncDBManager._write_executor.shutdown(wait=True)
+            AsyncDBManager._write_executor = None
+        if AsyncDBManager._executor is not None:
+            AsyncDBManager._executor.shutdown(wait=True)
+            AsyncDBManager._executor = None
+        DBManager.check_connection_leaks()
+
+    @staticmethod
+    async def run(func: Callable, *args, **kwargs) -> Any:
+        """! Run a blocking, read-only DB function in the DB thread pool.
+        @param func function to be called, it must open its own connection scope
+        @return result of func
+        """
+        loop = asyncio.get_running_loop()
+        # the context carries the log correlation id into the DB thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(AsyncDBManager.get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+    @staticmethod
+    async def run_write(func: Callable, *args, **kwargs) -> Any:
+        """! Run a blocking DB function that commits changes in the DB writer thread.
+        @param func function to be called, it must open its own connection scope
+        @return result of func
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(AsyncDBManager.get_write_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+    ###############################################
+    # Async counterparts of DBManager methods.    #
+    ###############################################
+
+    @staticmethod
+    async def get_record(tree_name: str, uuid: str):
+        return await AsyncDBManager.run(DBManager.get_record, tree_name, uuid)
+
+    @staticmethod
+    async def find_records(tree_name: str, **attributes) -> List[Any]:
+        return await AsyncDBManager.run(DBManager.find_records, tree_name, **attributes)
+
+    @staticmethod
+    async def insert_record(tree_name: str, uuid: str, object: Any):
+        return await AsyncDBManager.run_write(DBManager.insert_record, tree_name, uuid, object)
+
+    @staticmethod
+    async def update_record(tree_name: str, uuid: str, object: Any):
+        return await AsyncDBManager.run_write(DBManager.update_record, tree_name, uuid, object)
+
+    @staticmethod
+    async def delete_record(tree_name: str, uuid: str):
+        return await AsyncDBManager.run_write(DBManager.delete_record, tree_name, uuid)
+
+    @staticmethod
+    async def insert_many(tree_name: str, records: List[Tuple[str, Any]], **kwargs) -> int:
+        return await AsyncDBManager.run_write(DBManager.insert_many, tree_name, records, **kwargs)
+
+    @staticmethod
+    async def upsert_many(tree_name: str, records: List[Tuple[str, Any]], **kwargs) -> Tuple[int, int]:
+        return await AsyncDBManager.run_write(DBManager.upsert_many, tree_name, records, **kwargs)
+
+    @staticmethod
+    async def deactivate_many(tree_name: str, uuids: List[str], **kwargs) -> int:
+        return await AsyncDBManager.run_write(DBManager.deactivate_many, tree_name, uuids, **kwargs)
+
+    @staticmethod
+    async def get_sync_state(hotspot_address: str) -> Optional[dict]:
+        return await AsyncDBManager.run(DBManager.get_sync_state, hotspot_address)
+
+    @staticmethod
+    async def store_activities(hotspot_address: str, activities: List[Any], sync_state: dict):
+        return await AsyncDBManager.run_write(DBManager.store_activities, hotspot_address, activities, sync_state)
+
+    @staticmethod
+    async def get_hotspot_activities(hotspot_address: str, since: Optional[int] = None, until: Optional[int] = None) -> List[dict]:
+        return await AsyncDBManager.run(DBManager.get_hotspot_activities, hotspot_address, since, until)
+
+    @staticmethod
+    async def get_activity_summary(hotspot_address: str, now: Optional[int] = None) -> Optional[Dict[str, Dict[str, int]]]:
+        return await AsyncDBManager.run(DBManager.get_activity_summary, hotspot_address, now)
+
+    @staticmethod
+    async def replace_activity_aggregates(hotspot_address: str, activities: List[Tuple[int, Optional[str], Optional[str]]],
+                                          since: int, until: int) -> int:
+        return await AsyncDBManager.run_write(DBManager.replace_activity_aggregates, hotspot_address, activities, since, until)
+
+    @staticmethod
+    async def prune_activities(horizon: int, **kwargs) -> int:
+        return await AsyncDBManager.run_write(DBManager.prune_activities, horizon, **kwargs)
+
+    @staticmethod
+    async def reap_inactive(tree_name: str, grace_period: float, **kwargs) -> Tuple[int, int]:
+        return await AsyncDBManager.run_write(DBManager.reap_inactive, tree_name, grace_period, **kwargs)
+
+    @staticmethod
+    async def get_last_pack() -> Optional[dict]:
+        return await AsyncDBManager.run(DBManager.get_last_pack)
+
+    @staticmethod
+    async def set_last_pack(pack_time: int, size: int):
+        return await AsyncDBManager.run_write(DBManager.set_last_pack, pack_time, size)
+
+    @staticmethod
+    async def pack(days: float = 0) -> dict:
+        # packing runs on the read pool, so it does not hold up the writer thread
+        return await AsyncDBManager.run(DBManager.pack, days)
@@ -0,0 +1,198 @@
+import json
+import os
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+import ZODB
+from BTrees.OOBTree import OOBTree, OOTreeSet
+
+log = logging.getLogger(__name__)
+from .db import __location__
+
+class DBIndexManager():
+    """! Secondary indexes over the record trees. Each index is an OOBTree stored at the DB root that maps
+    an attribute value to an OOTreeSet of the uuids of the active records having that value.
+    Indexes are maintained by DBManager inside the same transaction as the record change.
+    """
+
+    _definitions: Optional[List[dict]] = None
+
+    @staticmethod
+    def get_definitions() -> List[dict]:
+        """! Getter for the index definitions from the indexes JSON file.
+        @return list of dicts with 'name', 'tree' and 'attribute' keys
+        """
+        if DBIndexManager._definitions is None:
+            with open(os.path.join(__location__, 'indexes.json'), 'r') as f:
+                DBIndexManager._definitions = json.load(f)['indexes']
+        return DBIndexManager._definitions
+
+    @staticmethod
+    def get_tree_indexes(tree_name: str) -> List[dict]:
+        """! Getter for the definitions of all indexes over a tree.
+        @param tree_name name of the indexed OOBTree tree
+        @return list of index definitions
+        """
+        return [index for index in DBIndexManager.get_definitions() if index['tree'] == tree_name]
+
+    @staticmethod
+    def get_index_name(tree_name: str, attribute: str) -> Optional[str]:
+        """! Getter for the name of the index over tree_name.attribute.
+        @return index name, None if the attribute is not indexed
+        """
+        for index in DBIndexManager.get_tree_indexes(tree_name):
+            if index['attribute'] == attribute:
+                return index['name']
+        return None
+
+    ###############################################
+    # Index maintenance.                          #
+    ###############################################
+
+    @staticmethod
+    def snapshot(tree_name: str, record: Any) -> Dict[str, Any]:
+        """! Indexed attribute values of a record, taken before it is changed.
+        @return dict of attribute name to value, empty for inactive records
+        """
+        if not getattr(record, 'active', True):
+            return {}
+        return {index['attribute']: getattr(record, index['attribute'], None) for index in DBIndexManager.get_tree_indexes(tree_name)}
+
+    @staticmethod
+    def add(conn: ZODB.Connection.Connection, tree_name: str, uuid: str, record: Any):
+        """! Add an active record to all indexes over its tree.
+        @return None
+        """
+        DBIndexManager._add_values(conn, tree_name, uuid, DBIndexManager.snapshot(tree_name, record))
+
+    @staticmethod
+    def remove(conn: ZODB.Connection.Connection, tree_name: str, uuid: str, values: Dict[str, Any]):
+        """! Remove a record from all indexes over its tree.
+        @param values indexed attribute values of the record, see snapshot()
+        @return None
+        """
+        root = conn.root()
+        for index in DBIndexManager.get_tree_indexes(tree_name):
+            value = values.get(index['attribute'])
+            tree = root.get(index['name'])
+            if value is None or tree is None:
+                continue
+            uuids = tree.get(value)
+            if uuids is not None and uuid in uuids:
+                uuids.remove(uuid)
+                if not uuids:
+                    del tree[value]
+
+    @staticmethod
+    def reindex(conn: ZODB.Connection.Connection, tree_name: str, uuid: str, old_values: Dict[str, Any], record: Any):
+        """! Move a changed record to the index entries of its new attribute values.
+        @param old_values indexed attribute values before the change, see snapshot()
+        @return None
+        """
+        new_values = DBIndexManager.snapshot(tree_name, record)
+        if new_values != old_values:
+            DBIndexManager.remove(conn, tree_name, uuid, old_values)
+            DBIndexManager._add_values(conn, tree_name, uuid, new_values)
+
+    @staticmethod
+    def _add_values(conn: ZODB.Connection.Connection, tree_name: str, uuid: str, values: Dict[str, Any]):
+        """! Internal method adding uuid under the given attribute values.
+        @return None
+        """
+        root = conn.root()
+        for index in DBIndexManager.get_tree_indexes(tree_name):
+            value = values.get(index['attribute'])
+            tree = root.get(index['name'])
+            if value is None or tree is None:
+                continue
+            uuids = tree.get(value)
+            if uuids is None:
+                uuids = tree[value] = OOTreeSet()
+            uuids.insert(uuid)
+
+    ###############################################
+    # Queries.                                    #
+    ###############################################
+
+    @staticmethod
+    def iter_uuids(conn: ZODB.Connection.Connection, tree_name: str, attribute: str, value: Any) -> Iterator[str]:
+        """! Lazily iterate the uuids of active records with tree_name.attribute == value.
+        Falls back to a scan of the tree if the attribute is not indexed or the index is not installed yet.
+        @return iterator of uuids
+        """
+        name = DBIndexManager.get_index_name(tree_name, attribute)
+        index = conn.root().get(name) if name else None
+        if index is None:
+            log.debug('No index for %s.%s, scanning the tree.', tree_name, attribute)
+            return (
+                uuid for uuid, record in conn.root()[tree_name].items()
+                if record.active and getattr(record, attribute, None) == value
+            )
+        uuids = index.get(value)
+        return iter(uuids) if uuids is not None else iter(())
+
+    ###############################################
+    # Install, rebuild and verify methods.        #
+    ###############################################
+
+    @staticmethod
+    def ensure_indexes(conn: ZODB.Connection.Connection) -> List[str]:
+        """! Build all indexes that are not installed yet. Changes are committed with the caller's transaction.
+        @return names of the indexes built
+        """
+        missing = [index['name'] for index in DBIndexManager.get_definitions() if index['name'] not in conn.root()]
+        if missing:
+            DBIndexManager.rebuild_indexes(conn, missing)
+        return missing
+
+    @staticmethod
+    def rebuild_indexes(conn: ZODB.Connection.Connection, names: Optional[List[str]] = None):
+        """! Rebuild indexes from scratch by scanning their trees. Changes are committed with the caller's transaction.
+        @param names names of the indexes to rebuild, all by default
+        @return None
+        """
+        root = conn.root()
+        for index in DBIndexManager.get_definitions():
+            if names is not None and index['name'] not in names:
+                continue
+            tree = OOBTree()
+            for uuid, record in root.get(index['tree'], OOBTree()).items():
+                value = getattr(record, index['attribute'], None)
+                if not record.active or value is None:
+                    continue
+                uuids = tree.get(value)
+                if uuids is None:
+                    uuids = tree[value] = OOTreeSet()
+                uuids.insert(uuid)
+            root[index['name']] = tree
+            log.info('Built index %s with %s keys.', index['name'], len(tree))
+
+    @staticmethod
+    def verify_indexes(conn: ZODB.Connection.Connection) -> Dict[str, dict]:
+        """! Compare all indexes against their trees.
+        @return dict of index name to counts of 'missing' (active records not indexed) and 'stale'
+        (indexed uuids that are unknown, inactive or filed under the wrong value) entries
+        """
+        root = conn.root()
+        report = {}
+        for index in DBIndexManager.get_definitions():
+            tree = root.get(index['tree'], OOBTree())
+            index_tree = root.get(index['name'])
+            if index_tree is None:
+                report[index['name']] = {'installed': False, 'missing': len(tree), 'stale': 0}
+                continue
+            missing = stale = 0
+            for uuid, record in tree.items():
+                value = getattr(record, index['attribute'], None)
+                if record.active and value is not None:
+                    uuids = index_tree.get(value)
+                    if uuids is None or uuid not in uuids:
+                        missing += 1
+            for value, uuids in index_tree.items():
+                for uuid in uuids:
+                    record = tree.get(uuid)
+                    if record is None or not record.active or getattr(record, index['attribute'], None) != value:
+                        stale += 1
+            report[index['name']] = {'installed': True, 'missing': missing, 'stale': stale}
+            if missing or stale:
+                log.warning('Index %s is out of sync: %s missing, %s stale entries.', index['name'], missing, stale)
+        return report
@@ -1,120 +1,774 @@
+import copy
 import json
 import os
 import logging
-from typing import Any, Optional
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from zope.generations.generations import generations_key
 import ZODB
+import transaction
 from BTrees.OOBTree import OOBTree
+from ZODB.POSException import ConflictError
 
 log = logging.getLogger(__name__)
-from .db import db, __location__
-from util.constants import DbConstants
+from .db import get_db, close_db, __location__
+from .DBIndexManager import DBIndexManager
+from .ActivityTimeline import ActivityTimeline
+from .ActivityAggregates import ActivityAggregates
+from bot import metrics
+from util.constants import DbConstants, MaintenanceConstants
 
 class DBManager():
-    
+
+    _connection_lock = threading.Lock()
+    _connection_stats = {'open': 0, 'peak': 0, 'opened': 0}
+
     def init_db() -> None:
         """! Initialization method for the DB. This method inserts all OOBTree objects at the root of the ZODB database.
         @return None
         """
         DBManager._create_all_trees()
-    
+
     @staticmethod
     def get_db_ref():
         """! Getter method for the DB reference.
         @return ZODB.DB object
         """
-        return db
+        return get_db()
+
+    @staticmethod
+    def close_db():
+        """! Close the DB, it is opened again on next use.
+        @return None
+        """
+        close_db()
 
     @staticmethod
-    def get_current_db_generation(conn: Optional[ZODB.connection] = None):
+    def get_current_db_generation(conn: Optional[ZODB.Connection.Connection] = None):
         """! Getter method for the DB upgrade generation.
         @param conn optional DB connection
         @return int
         """
-        if not conn:
-            conn = db.open()
-        return conn.root()[generations_key][DbConstants.DB_APP_NAME] 
+        if conn is not None:
+            return conn.root()[generations_key][DbConstants.DB_APP_NAME]
+        with DBManager.connection() as conn:
+            return conn.root()[generations_key][DbConstants.DB_APP_NAME]
+
+    ###############################################
+    # Connection scopes.                          #
+    ###############################################
+
+    @staticmethod
+    @contextmanager
+    def connection() -> Iterator[ZODB.Connection.Connection]:
+        """! Read-only connection scope. The connection is taken from the DB pool and returned to it on exit,
+        any changes made through it are discarded.
+        @return context manager yielding a ZODB connection
+        """
+        transaction_manager = transaction.TransactionManager()
+        conn = DBManager._open(transaction_manager)
+        try:
+            yield conn
+        finally:
+            transaction_manager.abort()
+            DBManager._close(conn)
+
+    @staticmethod
+    @contextmanager
+    def unit_of_work() -> Iterator[ZODB.Connection.Connection]:
+        """! Transactional connection scope. Changes are committed on a clean exit and aborted on an exception;
+        the connection is returned to the DB pool either way.
+        @return context manager yielding a ZODB connection
+        """
+        transaction_manager = transaction.TransactionManager()
+        conn = DBManager._open(transaction_manager)
+        try:
+            with transaction_manager:
+                yield conn
+            if metrics.ENABLED:
+                metrics.DB_COMMITS.inc()
+        finally:
+            DBManager._close(conn)
+
+    @staticmethod
+    def transact(func: Callable, *args, retries: int = DbConstants.CONFLICT_RETRIES, **kwargs) -> Any:
+        """! Run func(connection, *args, **kwargs) in a unit of work, retrying it on ConflictError.
+        @param func function doing the work, it has to be safe to call again after an abort
+        @param retries number of retries after a conflict
+        @return result of func
+        """
+        if metrics.ENABLED:
+            started = time.perf_counter()
+            try:
+                return DBManager._transact(func, args, kwargs, retries)
+            finally:
+                metrics.DB_TRANSACTION_SECONDS.observe(time.perf_counter() - started, getattr(func, '__name__', 'unknown'))
+        return DBManager._transact(func, args, kwargs, retries)
+
+    @staticmethod
+    def _transact(func: Callable, args: tuple, kwargs: dict, retries: int) -> Any:
+        """! Internal method with the retry loop of transact().
+        @return result of func
+        """
+        for attempt in range(retries + 1):
+            try:
+                with DBManager.unit_of_work() as connection:
+                    return func(connection, *args, **kwargs)
+            except ConflictError:
+                if metrics.ENABLED:
+                    metrics.DB_CONFLICTS.inc(getattr(func, '__name__', 'unknown'))
+                if attempt == retries:
+                    raise
+                log.debug('Conflict in %s, retrying (%s/%s).', getattr(func, '__name__', func), attempt + 1, retries)
+                # jittered backoff, so competing writers do not collide again right away
+                time.sleep(random.uniform(0, DbConstants.CONFLICT_BACKOFF * (attempt + 1)))
+
+    @staticmethod
+    def _open(transaction_manager: transaction.TransactionManager) -> ZODB.Connection.Connection:
+        """! Internal method that opens a pooled connection and counts it as open.
+        @return ZODB connection
+        """
+        conn = get_db().open(transaction_manager=transaction_manager)
+        with DBManager._connection_lock:
+            stats = DBManager._connection_stats
+            stats['open'] += 1
+            stats['opened'] += 1
+            stats['peak'] = max(stats['peak'], stats['open'])
+        return conn
+
+    @staticmethod
+    def _close(conn: ZODB.Connection.Connection):
+        """! Internal method that returns a connection to the pool and counts it as closed.
+        @return None
+        """
+        if metrics.ENABLED:
+            loads, stores = conn.getTransferCounts(True)
+            metrics.ZODB_LOADS.inc(amount=loads)
+            metrics.ZODB_STORES.inc(amount=stores)
+        conn.close()
+        with DBManager._connection_lock:
+            DBManager._connection_stats['open'] -= 1
+
+    @staticmethod
+    def get_connection_stats() -> dict:
+        """! Counters of connections opened through the connection scopes.
+        @return dict with 'open', 'peak' and 'opened' counts
+        """
+        with DBManager._connection_lock:
+            return dict(DBManager._connection_stats)
+
+    @staticmethod
+    def check_connection_leaks() -> int:
+        """! Log a warning for every connection of the DB pool that is still open.
+        @return number of connections still open through the connection scopes
+        """
+        open_connections = DBManager.get_connection_stats()['open']
+        if open_connections:
+            log.warning('%s DB connections are still open.', open_connections)
+            for info in get_db().connectionDebugInfo():
+                if info['opened']:
+                    log.warning('Open DB connection: %s', info)
+        return open_connections
+
+    @staticmethod
+    def _detach(record: Any) -> Any:
+        """! Internal method returning a copy of a persistent record that is not bound to any connection,
+        so it stays readable after its connection scope ended.
+        @return detached copy of the record, None if record is None
+        """
+        return copy.copy(record) if record is not None else None
+
+    @staticmethod
+    def _apply_state(record: Any, object: Any):
+        """! Internal method copying the state of object onto the stored record.
+        @return None
+        """
+        if record is not object:
+            record._p_activate()
+            record.__setstate__(object.__getstate__())
+            record._p_changed = True
+
+    @staticmethod
+    def _savepoint_every(connection: ZODB.Connection.Connection, count: int, chunk_size: Optional[int]):
+        """! Internal method taking a savepoint after every chunk_size changes of a large batch.
+        Changes so far are written to temporary storage and the object cache is trimmed,
+        so memory stays bounded while the batch is still committed as a single transaction.
+        @return None
+        """
+        if chunk_size and count % chunk_size == 0:
+            connection.transaction_manager.savepoint(optimistic=True)
+            connection.cacheGC()
+
+    @staticmethod
+    def _snapshot(tree_name: str, record: Any) -> Tuple[dict, Optional[tuple], Optional[tuple]]:
+        """! Internal method capturing the indexed state of a record before it is changed.
+        @return tuple of (secondary index values, activity timeline key, activity aggregates key)
+        """
+        if tree_name != DbConstants.TREE_NAME_ACTIVITIES:
+            return DBIndexManager.snapshot(tree_name, record), None, None
+        return DBIndexManager.snapshot(tree_name, record), ActivityTimeline.key(record), ActivityAggregates.key(record)
+
+    @staticmethod
+    def _on_insert(connection: ZODB.Connection.Connection, tree_name: str, uuid: str, record: Any):
+        """! Internal method adding a new record to the secondary indexes, the activity timeline and aggregates.
+        @return None
+        """
+        DBIndexManager.add(connection, tree_name, uuid, record)
+        if tree_name == DbConstants.TREE_NAME_ACTIVITIES:
+            ActivityTimeline.add(connection, uuid, record)
+            ActivityAggregates.add_new(connection, record)
+
+    @staticmethod
+    def _on_update(connection: ZODB.Connection.Connection, tree_name: str, uuid: str, snapshot: tuple, record: Any):
+        """! Internal method moving a changed record within the secondary indexes, the activity timeline and aggregates.
+        @param snapshot indexed state of the record before the change, see _snapshot()
+        @return None
+        """
+        index_values, timeline_key, aggregates_key = snapshot
+        DBIndexManager.reindex(connection, tree_name, uuid, index_values, record)
+        if tree_name != DbConstants.TREE_NAME_ACTIVITIES:
+            return
+        if ActivityTimeline.key(record) != timeline_key:
+            if timeline_key is not None:
+                ActivityTimeline.remove(connection, uuid, *timeline_key)
+            ActivityTimeline.add(connection, uuid, record)
+        if ActivityAggregates.key(record) != aggregates_key:
+            ActivityAggregates.add(connection, aggregates_key, -1)
+            ActivityAggregates.add(connection, ActivityAggregates.key(record))
+
+    @staticmethod
+    def _on_remove(connection: ZODB.Connection.Connection, tree_name: str, uuid: str, snapshot: tuple):
+        """! Internal method removing a record from the secondary indexes and the activity timeline.
+        The activity aggregates are kept, they cover activities removed by the retention policy as well.
+        @param snapshot indexed state of the record, see _snapshot()
+        @return None
+        """
+        index_values, timeline_key, _ = snapshot
+        DBIndexManager.remove(connection, tree_name, uuid, index_values)
+        if timeline_key is not None:
+            ActivityTimeline.remove(connection, uuid, *timeline_key)
+
+    @staticmethod
+    def _deactivate(connection: ZODB.Connection.Connection, tree_name: str, uuid: str, record: Any):
+        """! Internal method marking a record as active = False and stamping the time it was deactivated,
+        so the reaper can remove it once the grace period is over. A deleted activity is no longer counted
+        in the activity aggregates.
+        @return None
+        """
+        snapshot = DBManager._snapshot(tree_name, record)
+        DBManager._on_remove(connection, tree_name, uuid, snapshot)
+        ActivityAggregates.add(connection, snapshot[2], -1)
+        record.active = False
+        record.deactivated_at = int(time.time())
+
+    @staticmethod
+    def _adopt(record: Any, connection: ZODB.Connection.Connection) -> Any:
+        """! Internal method returning a new record ready to be added through connection. A record that already
+        got an oid, e.g. in an attempt aborted on a conflict, is replaced by a fresh copy, because it would
+        otherwise be treated as stored already.
+        @return record or a copy of it
+        """
+        if record._p_oid is not None:
+            return copy.copy(record)
+        return record
 
-    
     ###############################################
     # Get, Insert, Update and Delete methods.     #
     ###############################################
 
     @staticmethod
-    def get_record(tree_name: str, uuid: str, conn: Optional[ZODB.connection] = None):
+    def get_record(tree_name: str, uuid: str, conn: Optional[ZODB.Connection.Connection] = None):
         """! Get method for records in the DB.
         @param tree_name name of the OOBTree tree for the record
         @param uuid unique id of the record
-        @return 1 if record found, 0 if not found 
+        @param conn optional DB connection; without one a detached copy of the record is returned
+        @return the record, None if not found
         """
-        if not conn:
-            conn = db.open()
-        return conn.root()[tree_name].get(uuid)
-            
+        if conn is not None:
+            return conn.root()[tree_name].get(uuid)
+        with DBManager.connection() as conn:
+            return DBManager._detach(conn.root()[tree_name].get(uuid))
+
+    @staticmethod
+    def find_records(tree_name: str, **attributes) -> List[Any]:
+        """! Scan a tree for active records whose attributes equal the given values.
+        @param tree_name name of the OOBTree tree to be scanned
+        @param attributes attribute names and values the records have to match
+        @return list of detached copies of the matching records
+        """
+        with DBManager.connection() as connection:
+            return [
+                DBManager._detach(record) for record in connection.root()[tree_name].values()
+                if record.active and all(getattr(record, name, None) == value for name, value in attributes.items())
+            ]
+
     @staticmethod
     def insert_record(tree_name: str, uuid: str, object: Any):
         """! Insert method for records into DB.
         @param tree_name name of the OOBTree tree for the record to be inserted into
         @param uuid unique id of the record for later reference
-        @param object data for the record 
+        @param object data for the record
         @return 1 if the item was added, or 0 otherwise
         """
-        with db.transaction() as connection:
-            connection.root()[tree_name].insert(uuid, object)
-    
+        def insert(connection):
+            record = DBManager._adopt(object, connection)
+            inserted = connection.root()[tree_name].insert(uuid, record)
+            if inserted:
+                DBManager._on_insert(connection, tree_name, uuid, record)
+            return inserted
+        return DBManager.transact(insert)
+
     @staticmethod
     def update_record(tree_name: str, uuid: str, object: Any):
-        """! Update method for records in the DB.
+        """! Update method for records in the DB. The state of object is copied onto the stored record,
+        so object may be a detached copy returned by the getters.
         @param tree_name name of the OOBTree tree for the record
         @param uuid unique id of the record
-        @param object data for the record 
+        @param object data for the record
         @return 1 if record added, 0 if not updated or not found
         """
+        def update(connection):
+            record = connection.root()[tree_name].get(uuid)
+            if record is None:
+                return 0
+            snapshot = DBManager._snapshot(tree_name, record)
+            DBManager._apply_state(record, object)
+            DBManager._on_update(connection, tree_name, uuid, snapshot, record)
+            return 1
         if(DBManager.tree_exists(tree_name)):
-            with db.transaction() as connection: 
-                if(connection.root()[tree_name].get(uuid) == 0):
-                    return 0
-                else:
-                    connection.root()[tree_name][uuid] = object
-                    return 1
+            return DBManager.transact(update)
         else:
-            print("this happens")
+            log.warning('Cannot update record %s, tree %s does not exist.', uuid, tree_name)
             return 0
     @staticmethod
     def delete_record(tree_name: str, uuid: str):
         """! Delete method marks record as active = False and thereby ready for later deletion from DB.
         @param tree_name name of the OOBTree tree for the record to be inserted into
-        @param uuid unique id of the record 
+        @param uuid unique id of the record
+        @return None
+        """
+        def delete(connection):
+            record = connection.root()[tree_name].get(uuid)
+            if record is None or not record.active:
+                # deleting again must not restart the reap grace period
+                return
+            DBManager._deactivate(connection, tree_name, uuid, record)
+        DBManager.transact(delete)
+
+    ###############################################
+    # Index queries.                              #
+    ###############################################
+    # The iterators are lazy and bound to the given connection,
+    # so they have to be consumed inside its scope.
+
+    @staticmethod
+    def iter_records_by(conn: ZODB.Connection.Connection, tree_name: str, attribute: str, value: Any) -> Iterator[Any]:
+        """! Lazily iterate the active records with tree_name.attribute == value through its secondary index.
+        @param conn DB connection the records are loaded through
+        @param tree_name name of the OOBTree tree of the records
+        @param attribute indexed attribute name
+        @param value attribute value to look up
+        @return iterator of records
+        """
+        tree = conn.root()[tree_name]
+        for uuid in DBIndexManager.iter_uuids(conn, tree_name, attribute, value):
+            record = tree.get(uuid)
+            if record is not None:
+                yield record
+
+    @staticmethod
+    def find_records_by(tree_name: str, attribute: str, value: Any) -> List[Any]:
+        """! Index lookup of the active records with tree_name.attribute == value.
+        @return list of detached copies of the records
+        """
+        with DBManager.connection() as connection:
+            return [DBManager._detach(record) for record in DBManager.iter_records_by(connection, tree_name, attribute, value)]
+
+    @staticmethod
+    def iter_user_owners(conn: ZODB.Connection.Connection, telegram_user_id: int) -> Iterator[Any]:
+        """! Lazily iterate the Owner records registered by a Telegram user.
+        @return iterator of Owner records
+        """
+        return DBManager.iter_records_by(conn, DbConstants.TREE_NAME_OWNERS, 'telegram_user_id', telegram_user_id)
+
+    @staticmethod
+    def iter_owner_hotspots(conn: ZODB.Connection.Connection, owner_address: str) -> Iterator[Any]:
+        """! Lazily iterate the Hotspot records of an owner address.
+        @return iterator of Hotspot records
+        """
+        return DBManager.iter_records_by(conn, DbConstants.TREE_NAME_HOTSPOTS, 'owner_address', owner_address)
+
+    @staticmethod
+    def iter_user_subscriptions(conn: ZODB.Connection.Connection, telegram_user_id: int) -> Iterator[Any]:
+        """! Lazily iterate the Subscription records of the hotspots a Telegram user tracks.
+        @return iterator of Subscription records
+        """
+        return DBManager.iter_records_by(conn, DbConstants.TREE_NAME_SUBSCRIPTIONS, 'telegram_user_id', telegram_user_id)
+
+    @staticmethod
+    def iter_hotspot_subscriptions(conn: ZODB.Connection.Connection, hotspot_address: str) -> Iterator[Any]:
+        """! Lazily iterate the Subscription records of the users tracking a hotspot address.
+        @return iterator of Subscription records
+        """
+        return DBManager.iter_records_by(conn, DbConstants.TREE_NAME_SUBSCRIPTIONS, 'hotspot_address', hotspot_address)
+
+    @staticmethod
+    def iter_hotspot_activities(conn: ZODB.Connection.Connection, hotspot_address: str) -> Iterator[Any]:
+        """! Lazily iterate the Activity records of a hotspot address.
+        @return iterator of Activity records
+        """
+        return DBManager.iter_records_by(conn, DbConstants.TREE_NAME_ACTIVITIES, 'hotspot_address', hotspot_address)
+
+    ###############################################
+    # Bulk methods.                               #
+    ###############################################
+    # Each bulk method applies all records in a single transaction
+    # (one commit instead of one per record) and retries it on conflicts.
+
+    @staticmethod
+    def insert_many(tree_name: str, records: Iterable[Tuple[str, Any]], chunk_size: Optional[int] = DbConstants.BULK_CHUNK_SIZE,
+                    retries: int = DbConstants.CONFLICT_RETRIES) -> int:
+        """! Insert many records in one transaction. Records whose uuid exists already are skipped.
+        @param tree_name name of the OOBTree tree for the records to be inserted into
+        @param records (uuid, object) pairs
+        @param chunk_size number of records between savepoints, None for no savepoints
+        @param retries number of retries after a conflict
+        @return number of records inserted
+        """
+        records = list(records)
+
+        def insert(connection):
+            tree = connection.root()[tree_name]
+            inserted = 0
+            for count, (uuid, object) in enumerate(records, 1):
+                record = DBManager._adopt(object, connection)
+                if tree.insert(uuid, record):
+                    DBManager._on_insert(connection, tree_name, uuid, record)
+                    inserted += 1
+                DBManager._savepoint_every(connection, count, chunk_size)
+            return inserted
+        return DBManager.transact(insert, retries=retries)
+
+    @staticmethod
+    def upsert_many(tree_name: str, records: Iterable[Tuple[str, Any]], chunk_size: Optional[int] = DbConstants.BULK_CHUNK_SIZE,
+                    retries: int = DbConstants.CONFLICT_RETRIES) -> Tuple[int, int]:
+        """! Insert new records and update existing ones in one transaction.
+        @param tree_name name of the OOBTree tree for the records
+        @param records (uuid, object) pairs
+        @param chunk_size number of records between savepoints, None for no savepoints
+        @param retries number of retries after a conflict
+        @return tuple of (inserted, updated) counts
+        """
+        records = list(records)
+
+        def upsert(connection):
+            tree = connection.root()[tree_name]
+            inserted = updated = 0
+            for count, (uuid, object) in enumerate(records, 1):
+                record = tree.get(uuid)
+                if record is None:
+                    record = tree[uuid] = DBManager._adopt(object, connection)
+                    DBManager._on_insert(connection, tree_name, uuid, record)
+                    inserted += 1
+                else:
+                    snapshot = DBManager._snapshot(tree_name, record)
+                    DBManager._apply_state(record, object)
+                    DBManager._on_update(connection, tree_name, uuid, snapshot, record)
+                    updated += 1
+                DBManager._savepoint_every(connection, count, chunk_size)
+            return inserted, updated
+        return DBManager.transact(upsert, retries=retries)
+
+    @staticmethod
+    def deactivate_many(tree_name: str, uuids: Iterable[str], chunk_size: Optional[int] = DbConstants.BULK_CHUNK_SIZE,
+                        retries: int = DbConstants.CONFLICT_RETRIES) -> int:
+        """! Bulk counterpart of delete_record; marks records as active = False in one transaction.
+        @param tree_name name of the OOBTree tree for the records
+        @param uuids unique ids of the records, unknown ones are skipped
+        @param chunk_size number of records between savepoints, None for no savepoints
+        @param retries number of retries after a conflict
+        @return number of records deactivated
+        """
+        uuids = list(uuids)
+
+        def deactivate(connection):
+            tree = connection.root()[tree_name]
+            deactivated = 0
+            for count, uuid in enumerate(uuids, 1):
+                record = tree.get(uuid)
+                if record is not None and record.active:
+                    DBManager._deactivate(connection, tree_name, uuid, record)
+                    deactivated += 1
+                DBManager._savepoint_every(connection, count, chunk_size)
+            return deactivated
+        return DBManager.transact(deactivate, retries=retries)
+
+    ###############################################
+    # Activity sync methods.                      #
+    ###############################################
+
+    @staticmethod
+    def get_sync_state(hotspot_address: str) -> Optional[dict]:
+        """! Getter for the last synced activity of a hotspot.
+        @param hotspot_address Helium address of the hotspot
+        @return dict with 'hash', 'time' and 'last_updated_at' keys, None if the hotspot was never synced
+        """
+        with DBManager.connection() as connection:
+            tree = connection.root().get(DbConstants.TREE_NAME_SYNC_STATE)
+            if tree is None:
+                return None
+            state = tree.get(hotspot_address)
+            return dict(state) if state is not None else None
+
+    @staticmethod
+    def store_activities(hotspot_address: str, activities: List[Any], sync_state: dict):
+        """! Insert new activities of a hotspot and advance its sync state in one transaction.
+        @param hotspot_address Helium address of the hotspot
+        @param activities Activity objects to be inserted
+        @param sync_state new sync state of the hotspot
         @return None
         """
-        with db.transaction() as connection:
-            connection.root()[tree_name].get(uuid).active = False
-                
+        def store(connection):
+            sync_tree = DBManager._create_tree(DbConstants.TREE_NAME_SYNC_STATE, connection)
+            activities_tree = connection.root()[DbConstants.TREE_NAME_ACTIVITIES]
+            for count, activity in enumerate(activities, 1):
+                record = DBManager._adopt(activity, connection)
+                if activities_tree.insert(str(record.uuid), record):
+                    DBManager._on_insert(connection, DbConstants.TREE_NAME_ACTIVITIES, str(record.uuid), record)
+                DBManager._savepoint_every(connection, count, DbConstants.BULK_CHUNK_SIZE)
+            sync_tree[hotspot_address] = dict(sync_state)
+        DBManager.transact(store)
+
+    @staticmethod
+    def get_hotspot_activities(hotspot_address: str, since: Optional[int] = None, until: Optional[int] = None) -> List[dict]:
+        """! Getter for the stored activities of a hotspot with since <= time <= until, newest first.
+        @param hotspot_address Helium address of the hotspot
+        @param since optional epoch time; older activities are skipped
+        @param until optional epoch time; newer activities are skipped
+        @return list of activity dicts
+        """
+        with DBManager.connection() as connection:
+            result = [activity.to_dict() for activity in DBManager.iter_activities_between(connection, hotspot_address, since, until)]
+        result.reverse()
+        return result
+
+    @staticmethod
+    def iter_activities_between(conn: ZODB.Connection.Connection, hotspot_address: str,
+                                since: Optional[int] = None, until: Optional[int] = None) -> Iterator[Any]:
+        """! Lazily iterate the activities of a hotspot with since <= time <= until, oldest first,
+        by key-range iteration over the activity timeline.
+        @return iterator of Activity records
+        """
+        if not DBManager.tree_exists(DbConstants.TREE_NAME_ACTIVITY_TIMELINE, conn):
+            # timeline not installed yet, fall back to the hotspot index
+            activities = sorted(DBManager.iter_hotspot_activities(conn, hotspot_address), key=lambda activity: activity.time)
+            return (activity for activity in activities
+                    if (since is None or activity.time >= since) and (until is None or activity.time <= until))
+        tree = conn.root()[DbConstants.TREE_NAME_ACTIVITIES]
+        return (tree[uuid] for _, uuid in ActivityTimeline.iter_range(conn, hotspot_address, since, until))
+
+    @staticmethod
+    def get_activity_summary(hotspot_address: str, now: Optional[int] = None) -> Optional[Dict[str, Dict[str, int]]]:
+        """! Getter for the activity counters of a hotspot over the AggregateConstants.WINDOWS, read from its hourly aggregates.
+        @param hotspot_address Helium address of the hotspot
+        @param now optional epoch time the windows end at, the current time by default
+        @return dict of window label to dict of counter name to count, None if the hotspot has no aggregates
+        """
+        with DBManager.connection() as connection:
+            return ActivityAggregates.summarize(connection, hotspot_address, int(time.time()) if now is None else now)
+
+    @staticmethod
+    def replace_activity_aggregates(hotspot_address: str, activities: List[Tuple[int, Optional[str], Optional[str]]],
+                                    since: int, until: int) -> int:
+        """! Replace the hourly aggregates of a hotspot between two epoch times, e.g. with a backfill from the Helium API.
+        @param hotspot_address Helium address of the hotspot
+        @param activities list of (time, type, role) tuples
+        @param since epoch time; the buckets from its hour on are replaced
+        @param until epoch time; the buckets from its hour on are kept
+        @return number of activities counted
+        """
+        def replace(connection):
+            DBManager._create_tree(DbConstants.TREE_NAME_ACTIVITY_AGGREGATES, connection)
+            DBManager._create_tree(DbConstants.TREE_NAME_AGGREGATE_HORIZONS, connection)
+            return ActivityAggregates.replace(connection, hotspot_address, activities,
+                                              ActivityAggregates.hour(since), ActivityAggregates.hour(until))
+        return DBManager.transact(replace)
+
+    ###############################################
+    # Retention and maintenance methods.          #
+    ###############################################
+
+    @staticmethod
+    def _purge(connection: ZODB.Connection.Connection, tree_name: str, uuid: str) -> bool:
+        """! Internal method physically removing a record from its tree, indexes and timeline.
+        @return True if the record existed
+        """
+        tree = connection.root()[tree_name]
+        record = tree.get(uuid)
+        if record is None:
+            return False
+        DBManager._on_remove(connection, tree_name, uuid, DBManager._snapshot(tree_name, record))
+        del tree[uuid]
+        return True
+
+    @staticmethod
+    def prune_activities(horizon: int, batch_size: int = DbConstants.BULK_CHUNK_SIZE) -> int:
+        """! Retention policy; physically removes all activities older than the horizon.
+        Works through the timeline of each hotspot oldest first, one transaction per batch.
+        @param horizon epoch time; activities strictly older are removed
+        @param batch_size maximum number of activities removed per transaction
+        @return number of activities removed
+        """
+        def prune_batch(connection, hotspot_address):
+            expired = ActivityTimeline.get_expired(connection, hotspot_address, horizon, batch_size)
+            for activity_time, uuid in expired:
+                DBManager._purge(connection, DbConstants.TREE_NAME_ACTIVITIES, uuid)
+                # also drops timeline entries whose activity is gone already
+                ActivityTimeline.remove(connection, uuid, hotspot_address, activity_time)
+            return len(expired)
+
+        with DBManager.connection() as connection:
+            hotspot_addresses = list(ActivityTimeline.iter_hotspot_addresses(connection))
+        removed = 0
+        for hotspot_address in hotspot_addresses:
+            while True:
+                count = DBManager.transact(prune_batch, hotspot_address)
+                removed += count
+                if count < batch_size:
+                    break
+        if removed:
+            log.info('Removed %s activities older than %s.', removed, horizon)
+        return removed
+
+    @staticmethod
+    def reap_inactive(tree_name: str, grace_period: float, batch_size: int = DbConstants.BULK_CHUNK_SIZE) -> Tuple[int, int]:
+        """! Physically removes the records of a tree that were deactivated more than grace_period seconds ago,
+        one transaction per batch. Records deactivated before deactivated_at was tracked are stamped with the
+        current time instead, so they get their grace period too.
+        @param tree_name name of the OOBTree tree to reap
+        @param grace_period seconds a deactivated record is kept
+        @param batch_size maximum number of records changed per transaction
+        @return tuple of (records removed, records stamped)
+        """
+        now = int(time.time())
+        cutoff = now - grace_period
+        with DBManager.connection() as connection:
+            candidates = []
+            for count, (uuid, record) in enumerate(connection.root()[tree_name].items(), 1):
+                if not record.active:
+                    candidates.append(uuid)
+                if count % DbConstants.BULK_CHUNK_SIZE == 0:
+                    connection.cacheGC()
+
+        def reap_batch(connection, uuids):
+            tree = connection.root()[tree_name]
+            removed = stamped = 0
+            for uuid in uuids:
+                record = tree.get(uuid)
+                # the record may have changed since the scan
+                if record is None or record.active:
+                    continue
+                if record.deactivated_at is None:
+                    record.deactivated_at = now
+                    stamped += 1
+                elif record.deactivated_at <= cutoff:
+                    DBManager._purge(connection, tree_name, uuid)
+                    removed += 1
+            return removed, stamped
+
+        removed = stamped = 0
+        for offset in range(0, len(candidates), batch_size):
+            batch_removed, batch_stamped = DBManager.transact(reap_batch, candidates[offset:offset + batch_size])
+            removed += batch_removed
+            stamped += batch_stamped
+        if removed or stamped:
+            log.info('Reaped %s inactive records from %s, stamped %s.', removed, tree_name, stamped)
+        return removed, stamped
+
+    @staticmethod
+    def get_storage_size() -> int:
+        """! Getter for the size of the storage.
+        @return size in bytes
+        """
+        return get_db().getSize()
+
+    @staticmethod
+    def pack(days: float = 0) -> dict:
+        """! Pack the storage, dropping old object revisions and unreachable objects. Blocks while packing,
+        but DB reads and writes can go on in other threads meanwhile.
+        @param days object revisions younger than this many days are kept
+        @return dict with 'size_before', 'size_after', 'reclaimed' bytes and 'seconds' the pack took
+        """
+        size_before = get_db().getSize()
+        started = time.perf_counter()
+        get_db().pack(days=days)
+        seconds = time.perf_counter() - started
+        size_after = get_db().getSize()
+        report = {'size_before': size_before, 'size_after': size_after,
+                  'reclaimed': size_before - size_after, 'seconds': round(seconds, 3)}
+        log.info('Packed the DB in %.2fs, reclaimed %s bytes (%s -> %s).', seconds, report['reclaimed'], size_before, size_after)
+        return report
+
+    @staticmethod
+    def get_last_pack() -> Optional[dict]:
+        """! Getter for the time and storage size of the last pack.
+        @return dict with 'time' and 'size' keys, None if no pack was recorded yet
+        """
+        with DBManager.connection() as connection:
+            tree = connection.root().get(DbConstants.TREE_NAME_MAINTENANCE)
+            if tree is None:
+                return None
+            state = tree.get(MaintenanceConstants.LAST_PACK_KEY)
+            return dict(state) if state is not None else None
+
+    @staticmethod
+    def set_last_pack(pack_time: int, size: int):
+        """! Record the time and storage size of the last pack, so they survive restarts.
+        @param pack_time epoch time of the pack
+        @param size storage size in bytes after the pack
+        @return None
+        """
+        def store(connection):
+            tree = DBManager._create_tree(DbConstants.TREE_NAME_MAINTENANCE, connection)
+            tree[MaintenanceConstants.LAST_PACK_KEY] = {'time': int(pack_time), 'size': size}
+        DBManager.transact(store)
+
     ###############################################
     # Initalization methods for trees.            #
-    ###############################################     
-    
+    ###############################################
+
     @staticmethod
-    def tree_exists(tree_name: str):
+    def tree_exists(tree_name: str, conn: Optional[ZODB.Connection.Connection] = None):
         """! Method that checks if given tree name exists in the DB.
         @param tree_name name of the OOBTree tree to be checked
+        @param conn optional DB connection
         @return boolean
         """
-        with db.transaction() as connection: 
+        if conn is not None:
+            return tree_name in conn.root()
+        with DBManager.connection() as connection:
             return tree_name in connection.root()
 
     @staticmethod
-    def _create_tree(tree_name: str):
+    def _create_tree(tree_name: str, conn: Optional[ZODB.Connection.Connection] = None):
         """! Internal method for creating a tree with tree_name.
         @param tree_name name of the OOBTree tree to be created
+        @param conn optional DB connection; the tree is committed with the caller's transaction
         @return OOBTree inserted into DB named after tree_name parameter
         """
-        if not DBManager.tree_exists(tree_name):    
-            with db.transaction() as connection: 
+        if conn is not None:
+            if tree_name not in conn.root():
+                conn.root()[tree_name] = OOBTree()
+                log.info('Created %s tree in the DB.', tree_name)
+            return conn.root()[tree_name]
+        if not DBManager.tree_exists(tree_name):
+            with DBManager.unit_of_work() as connection:
                 connection.root()[tree_name] = OOBTree()
                 log.info('Created %s tree in the DB.', tree_name)
-                return connection.root()[tree_name]    
-    
+
     @staticmethod
     def _create_all_trees():
         """! Internal method for creating trees from trees JSON file.
@@ -123,55 +777,44 @@ class DBManager():
         with open(os.path.join(__location__, 'trees.json'), 'r') as f:
             trees = json.load(f)
         # loop through tree names in json and create OOBTrees for each of them
-        for tree in trees['trees']: 
+        for tree in trees['trees']:
             DBManager._create_tree(tree['name'])
         log.info('Finished tree structure creation in the DB.')
-    
+
     ###############################################
     # Shortcut getter methods for trees.          #
     ###############################################
-    
-  
+    # The trees are bound to the given connection, so they have to be
+    # used inside its DBManager.connection() or unit_of_work() scope.
+
     @staticmethod
-    def get_users_tree():
+    def get_users_tree(conn: ZODB.Connection.Connection):
         """! Getter for 'users' tree.
+        @param conn DB connection the tree is loaded through
         @return OOBTree named 'users'
-        """ 
-        if DBManager.tree_exists('users'):    
-            with db.transaction() as connection: 
-                return connection.root.users
-        else:
-            return DBManager._create_tree('users')
+        """
+        return DBManager._create_tree(DbConstants.TREE_NAME_USERS, conn)
 
     @staticmethod
-    def get_owners_tree():
+    def get_owners_tree(conn: ZODB.Connection.Connection):
         """! Getter for 'owners' tree.
+        @param conn DB connection the tree is loaded through
         @return OOBTree named 'owners'
-        """   
-        if DBManager.tree_exists('owners'):    
-            with db.transaction() as connection: 
-                return connection.root.owners
-        else:
-            return DBManager._create_tree('owners')
-      
+        """
+        return DBManager._create_tree(DbConstants.TREE_NAME_OWNERS, conn)
+
     @staticmethod
-    def get_hotspots_tree():
+    def get_hotspots_tree(conn: ZODB.Connection.Connection):
         """! Getter for 'hotspots' tree.
+        @param conn DB connection the tree is loaded through
         @return OOBTree named 'hotspots'
-        """  
-        if DBManager.tree_exists('hotspots'):    
-            with db.transaction() as connection: 
-                return connection.root.hotspots
-        else:
-            return DBManager._create_tree('hotspots')
-    
+        """
+        return DBManager._create_tree(DbConstants.TREE_NAME_HOTSPOTS, conn)
+
     @staticmethod
-    def get_activities_tree():
+    def get_activities_tree(conn: ZODB.Connection.Connection):
         """! Getter for 'activities' tree.
+        @param conn DB connection the tree is loaded through
         @return OOBTree named 'activities'
         """
-        if DBManager.tree_exists('activities'):    
-            with db.transaction() as connection: 
-                return connection.root.activities
-        else:
-            return DBManager._create_tree('activities')
+        return DBManager._create_tree(DbConstants.TREE_NAME_ACTIVITIES, conn)
@@ -0,0 +1,187 @@
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+import ZODB
+
+log = logging.getLogger(__name__)
+from .DBManager import DBManager
+from util.constants import DbConstants, MigrationConstants
+from util.read_secrets import read_secrets
+
+
+class Migration():
+    """! A schema evolve step. Plain steps run func(connection) in the evolve transaction of zope.generations.
+    Chunked steps call visit(connection, tree_name, key, record) for every record of their trees in key order,
+    committing after every chunk; prepare(connection) runs once, in the transaction that starts the step.
+    """
+
+    def __init__(self, generation: int, name: str, func: Optional[Callable] = None, trees: Iterable[str] = (),
+                 visit: Optional[Callable] = None, prepare: Optional[Callable] = None):
+        self.generation = generation
+        self.name = name
+        self.func = func
+        self.trees = list(trees)
+        self.visit = visit
+        self.prepare = prepare
+
+    @property
+    def chunked(self) -> bool:
+        return self.visit is not None
+
+
+class DBMigrationManager():
+    """! Registry and runner of the schema evolve steps, called by DBUpgradeSchemaManager.evolve().
+    Chunked steps keep their progress in the 'migrations' tree, keyed by generation, so an upgrade that was
+    interrupted resumes after the last committed chunk the next time the DB is opened. Between chunks the
+    object caches are minimized, so memory stays bounded on trees of any size.
+    """
+
+    _migrations: Dict[int, Migration] = {}
+
+    @staticmethod
+    def register(generation: int, name: str) -> Callable:
+        """! Decorator registering func(connection) as the plain evolve step to generation.
+        @return decorator
+        """
+        def decorator(func):
+            DBMigrationManager._add(Migration(generation, name, func=func))
+            return func
+        return decorator
+
+    @staticmethod
+    def register_chunked(generation: int, name: str, trees: Iterable[str], prepare: Optional[Callable] = None) -> Callable:
+        """! Decorator registering visit(connection, tree_name, key, record) as the chunked evolve step to generation.
+        @param trees names of the trees walked, in this order
+        @param prepare optional prepare(connection), run once before the first chunk
+        @return decorator
+        """
+        def decorator(visit):
+            DBMigrationManager._add(Migration(generation, name, trees=trees, visit=visit, prepare=prepare))
+            return visit
+        return decorator
+
+    @staticmethod
+    def _add(migration: Migration):
+        """! Internal method adding a step to the registry.
+        @return None
+        """
+        if migration.generation in DBMigrationManager._migrations:
+            raise ValueError('Generation {} is registered already.'.format(migration.generation))
+        DBMigrationManager._migrations[migration.generation] = migration
+
+    @staticmethod
+    def get_migration(generation: int) -> Optional[Migration]:
+        """! Getter for the step evolving to generation.
+        @return Migration, None if there is none
+        """
+        return DBMigrationManager._migrations.get(generation)
+
+    @staticmethod
+    def get_progress(generation: int, conn: Optional[ZODB.Connection.Connection] = None) -> Optional[dict]:
+        """! Getter for the checkpoint of a chunked step.
+        @return dict with 'name', 'tree', 'key', 'count', 'done', 'started_at' and 'finished_at' keys, None if it never ran
+        """
+        if conn is None:
+            with DBManager.connection() as connection:
+                return DBMigrationManager.get_progress(generation, connection)
+        tree = conn.root().get(DbConstants.TREE_NAME_MIGRATIONS)
+        progress = tree.get(generation) if tree is not None else None
+        return dict(progress) if progress is not None else None
+
+    @staticmethod
+    def run(context: Any, generation: int, chunk_size: Optional[int] = None):
+        """! Run the step evolving to generation.
+        @param context zope.generations context with the connection of the evolve transaction
+        @param chunk_size records per commit of chunked steps, MIGRATION_CHUNK_SIZE by default
+        @return None
+        """
+        migration = DBMigrationManager.get_migration(generation)
+        if migration is None:
+            raise ValueError('Given generation does not exist!')
+        if not migration.chunked:
+            migration.func(context.connection)
+            return
+        if chunk_size is None:
+            chunk_size = int(read_secrets().get('MIGRATION_CHUNK_SIZE', MigrationConstants.CHUNK_SIZE))
+        # chunks commit through their own connections, the evolve transaction only records the new generation
+        DBMigrationManager._run_chunked(migration, chunk_size)
+
+    @staticmethod
+    def _start(conn: ZODB.Connection.Connection, migration: Migration) -> dict:
+        """! Internal method creating the checkpoint of a chunked step and preparing it, unless it was started before.
+        @return checkpoint dict
+        """
+        tree = DBManager._create_tree(DbConstants.TREE_NAME_MIGRATIONS, conn)
+        progress = tree.get(migration.generation)
+        if progress is None:
+            if migration.prepare is not None:
+                migration.prepare(conn)
+            progress = tree[migration.generation] = {
+                'name': migration.name, 'tree': 0, 'key': None, 'count': 0, 'done': False,
+                'started_at': int(time.time()), 'finished_at': None,
+            }
+        return dict(progress)
+
+    @staticmethod
+    def _chunk(conn: ZODB.Connection.Connection, migration: Migration, chunk_size: int) -> dict:
+        """! Internal method visiting the next chunk_size records after the checkpoint and advancing it.
+        @return updated checkpoint dict
+        """
+        root = conn.root()
+        progress = dict(root[DbConstants.TREE_NAME_MIGRATIONS][migration.generation])
+        visited = 0
+        while visited < chunk_size and progress['tree'] < len(migration.trees):
+            tree_name = migration.trees[progress['tree']]
+            tree = root.get(tree_name)
+            if tree is None:
+                items = iter(())
+            elif progress['key'] is None:
+                items = iter(tree.items())
+            else:
+                items = iter(tree.items(min=progress['key'], excludemin=True))
+            for key, record in items:
+                migration.visit(conn, tree_name, key, record)
+                progress['key'] = key
+                visited += 1
+                if visited == chunk_size:
+                    break
+            else:
+                # tree finished, continue with the next one
+                progress['tree'] += 1
+                progress['key'] = None
+        progress['count'] += visited
+        if progress['tree'] >= len(migration.trees):
+            progress['done'] = True
+            progress['finished_at'] = int(time.time())
+        root[DbConstants.TREE_NAME_MIGRATIONS][migration.generation] = progress
+        return progress
+
+    @staticmethod
+    def _run_chunked(migration: Migration, chunk_size: int):
+        """! Internal method running a chunked step from its checkpoint to the end, one transaction per chunk.
+        @return None
+        """
+        progress = DBManager.transact(DBMigrationManager._start, migration)
+        if progress['done']:
+            log.info('Migration %s (generation %s) finished already.', migration.name, migration.generation)
+            return
+        if progress['count']:
+            log.info('Resuming migration %s (generation %s) after %s records, at %s.', migration.name,
+                     migration.generation, progress['count'], migration.trees[progress['tree']])
+        else:
+            log.info('Starting migration %s (generation %s) over %s.', migration.name, migration.generation,
+                     ', '.join(migration.trees))
+        first_count = progress['count']
+        started = last_log = time.monotonic()
+        while not progress['done']:
+            progress = DBManager.transact(DBMigrationManager._chunk, migration, chunk_size)
+            # the visited records are committed, drop them from memory
+            DBManager.get_db_ref().cacheMinimize()
+            now = time.monotonic()
+            if now - last_log >= MigrationConstants.LOG_INTERVAL and not progress['done']:
+                last_log = now
+                log.info('Migration %s: %s records, %.0f records/s, at %s.', migration.name, progress['count'],
+                         (progress['count'] - first_count) / (now - started), migration.trees[progress['tree']])
+        elapsed = time.monotonic() - started
+        log.info('Finished migration %s (generation %s): %s records in %.1fs, %.0f records/s.', migration.name,
+                 migration.generation, progress['count'], elapsed, (progress['count'] - first_count) / max(elapsed, 1e-9))
@@ -6,22 +6,20 @@ from zope.interface import implementer
 
 @implementer(IInstallableSchemaManager)
 class DBUpgradeSchemaManager(object):
-    minimum_generation = 1
-    generation = 1
-    
+    minimum_generation = 6
+    generation = 6
+
     def install(self, context):
-        from .DBManager import DBManager    
+        from .DBManager import DBManager
+        from .DBIndexManager import DBIndexManager
         # preload db here
         DBManager.init_db()
+        DBManager.transact(DBIndexManager.ensure_indexes)
         # root = context.connection.root()
         # end preload db
-    
-    def evolve(self, context, generation):
-        root = context.connection.root()
 
-        if generation == 1:
-            pass
-        elif generation == 2:
-            pass
-        else:
-            raise ValueError('Given generation does not exist!')
+    def evolve(self, context, generation):
+        # the steps are registered in migrations.py
+        from . import migrations
+        from .DBMigrationManager import DBMigrationManager
+        DBMigrationManager.run(context, generation)
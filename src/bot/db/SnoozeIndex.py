@@ -0,0 +1,96 @@
+import logging
+from typing import Iterable, List, Optional, Set
+import ZODB
+from BTrees.OOBTree import OOTreeSet
+
+log = logging.getLogger(__name__)
+from util.constants import DbConstants
+
+class SnoozeIndex():
+    """! Notification snoozes of Telegram users. The 'snoozes' tree maps a telegram user id to the epoch time
+    its snooze ends, and the 'snooze_expiry' tree maps that time to an OOTreeSet of the user ids snoozed until then.
+    Checking whether a user is muted is a single O(log n) lookup, and expired snoozes are found by
+    key-range iteration over the expiry times, oldest first.
+    """
+
+    @staticmethod
+    def _get_trees(conn: ZODB.Connection.Connection):
+        """! Internal getter for the snooze trees, (None, None) if they are not installed yet.
+        @return tuple of (snoozes OOBTree, snooze_expiry OOBTree)
+        """
+        root = conn.root()
+        return root.get(DbConstants.TREE_NAME_SNOOZES), root.get(DbConstants.TREE_NAME_SNOOZE_EXPIRY)
+
+    @staticmethod
+    def snooze(conn: ZODB.Connection.Connection, telegram_user_id: int, until: int):
+        """! Mute the notifications of a user until the given time, replacing an earlier snooze.
+        Changes are committed with the caller's transaction.
+        @param until epoch time the snooze ends
+        @return None
+        """
+        SnoozeIndex.unsnooze(conn, telegram_user_id)
+        snoozes, expiry = SnoozeIndex._get_trees(conn)
+        snoozes[telegram_user_id] = until
+        users = expiry.get(until)
+        if users is None:
+            users = expiry[until] = OOTreeSet()
+        users.insert(telegram_user_id)
+
+    @staticmethod
+    def unsnooze(conn: ZODB.Connection.Connection, telegram_user_id: int) -> bool:
+        """! End the snooze of a user. Changes are committed with the caller's transaction.
+        @return True if the user was snoozed
+        """
+        snoozes, expiry = SnoozeIndex._get_trees(conn)
+        until = snoozes.get(telegram_user_id) if snoozes is not None else None
+        if until is None:
+            return False
+        del snoozes[telegram_user_id]
+        users = expiry.get(until)
+        if users is not None and telegram_user_id in users:
+            users.remove(telegram_user_id)
+            if not users:
+                del expiry[until]
+        return True
+
+    @staticmethod
+    def get_until(conn: ZODB.Connection.Connection, telegram_user_id: int, now: int) -> Optional[int]:
+        """! Getter for the end of the snooze of a user.
+        @param now current epoch time
+        @return epoch time the snooze ends, None if the user is not snoozed
+        """
+        snoozes, _ = SnoozeIndex._get_trees(conn)
+        until = snoozes.get(telegram_user_id) if snoozes is not None else None
+        return until if until is not None and until > now else None
+
+    @staticmethod
+    def muted(conn: ZODB.Connection.Connection, telegram_user_ids: Iterable[int], now: int) -> Set[int]:
+        """! The users among telegram_user_ids whose snooze has not ended yet; O(log n) per user.
+        @param now current epoch time
+        @return set of telegram user ids
+        """
+        return {user_id for user_id in telegram_user_ids if SnoozeIndex.get_until(conn, user_id, now) is not None}
+
+    @staticmethod
+    def expire(conn: ZODB.Connection.Connection, now: int, limit: int = DbConstants.BULK_CHUNK_SIZE) -> List[int]:
+        """! Remove snoozes that ended, oldest first. Changes are committed with the caller's transaction.
+        @param now current epoch time
+        @param limit maximum number of snoozes removed
+        @return telegram user ids whose snooze was removed
+        """
+        snoozes, expiry = SnoozeIndex._get_trees(conn)
+        expired = []
+        if expiry is None:
+            return expired
+        for until in list(expiry.keys(max=now)):
+            users = list(expiry[until])
+            for user_id in users:
+                if snoozes.get(user_id) == until:
+                    del snoozes[user_id]
+            del expiry[until]
+            expired.extend(users)
+            if len(expired) >= limit:
+                break
+        if expired:
+            log.info('Removed %s expired snoozes.', len(expired))
+        return expired
@@ -1,15 +1,119 @@
 import logging
-import json
 import os
-import ZODB, ZODB.FileStorage, zc.zlibstorage
+import threading
+from typing import Optional
+import ZODB, ZODB.FileStorage, ZODB.MappingStorage, zc.zlibstorage
+
+from util.constants import StorageConstants
+from util.read_secrets import read_secrets
 
 log = logging.getLogger(__name__)
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
-zstorage = ZODB.FileStorage.FileStorage('dataz.fs')
-
-try:
-    db = ZODB.DB(zstorage)
-except:
-    zstorage.close()
-    zstorage = zc.zlibstorage.ZlibStorage(ZODB.FileStorage.FileStorage('dataz.fs'))
-    db = ZODB.DB(zstorage)
\ No newline at end of file
+
+_db_lock = threading.Lock()
+_db: Optional[ZODB.DB] = None
+_overrides = {}
+
+
+def get_settings() -> dict:
+    """! Getter for the storage and cache settings; secrets.json keys, overridden by configure().
+    @return dict with 'storage', 'path', 'zeo_address', 'cache_size', 'cache_size_bytes' and 'pool_size' keys
+    """
+    secrets = read_secrets()
+    settings = {
+        'storage': secrets.get('DB_STORAGE', StorageConstants.STORAGE),
+        'path': secrets.get('DB_PATH', StorageConstants.PATH),
+        'zeo_address': secrets.get('DB_ZEO_ADDRESS', StorageConstants.ZEO_ADDRESS),
+        'cache_size': int(secrets.get('DB_CACHE_SIZE', StorageConstants.CACHE_SIZE)),
+        'cache_size_bytes': int(secrets.get('DB_CACHE_SIZE_BYTES', StorageConstants.CACHE_SIZE_BYTES)),
+        'pool_size': int(secrets.get('DB_POOL_SIZE', StorageConstants.POOL_SIZE)),
+    }
+    settings.update(_overrides)
+    return settings
+
+def configure(**settings):
+    """! Override storage and cache settings, e.g. configure(storage='memory') in benchmarks.
+    Has to be called before the DB is first used.
+    @param settings keys as returned by get_settings()
+    @return None
+    """
+    with _db_lock:
+        if _db is not None:
+            raise RuntimeError('The DB is open already, configure() has to be called before first use.')
+        _overrides.update(settings)
+
+def _parse_zeo_address(address: str):
+    """! Internal function turning 'host:port' into a tuple; anything else is used as a unix socket path.
+    @return address as accepted by ZEO.client()
+    """
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+def _open_storage(settings: dict):
+    """! Internal function opening the configured storage.
+    @return ZODB storage
+    """
+    kind = settings['storage']
+    if kind == StorageConstants.STORAGE_FILE:
+        return ZODB.FileStorage.FileStorage(settings['path'])
+    if kind == StorageConstants.STORAGE_ZLIB:
+        return zc.zlibstorage.ZlibStorage(ZODB.FileStorage.FileStorage(settings['path']))
+    if kind == StorageConstants.STORAGE_MEMORY:
+        return ZODB.MappingStorage.MappingStorage()
+    if kind == StorageConstants.STORAGE_ZEO:
+        # optional dependency, only needed for client/server storage
+        import ZEO
+        return ZEO.client(_parse_zeo_address(settings['zeo_address']))
+    raise ValueError('Unknown DB_STORAGE {!r}, expected one of {}.'.format(kind, StorageConstants.STORAGES))
+
+def _open_db(settings: dict) -> ZODB.DB:
+    """! Internal function opening the DB on the configured storage.
+    @return ZODB.DB object
+    """
+    storage = _open_storage(settings)
+    try:
+        db = ZODB.DB(storage, cache_size=settings['cache_size'], cache_size_bytes=settings['cache_size_bytes'],
+                     pool_size=settings['pool_size'])
+    except Exception:
+        storage.close()
+        if settings['storage'] != StorageConstants.STORAGE_FILE:
+            raise
+        # files written by earlier versions may be zlib-compressed
+        log.warning('Could not open %s as plain FileStorage, retrying as zlib-compressed storage.', settings['path'])
+        settings['storage'] = StorageConstants.STORAGE_ZLIB
+        return _open_db(settings)
+    location = {StorageConstants.STORAGE_ZEO: settings['zeo_address'],
+                StorageConstants.STORAGE_MEMORY: 'in memory'}.get(settings['storage'], settings['path'])
+    log.info('Opened DB on %s storage (%s): cache_size=%s objects, cache_size_bytes=%s, pool_size=%s, %s objects stored.',
+             settings['storage'], location, settings['cache_size'], settings['cache_size_bytes'], settings['pool_size'], db.objectCount())
+    return db
+
+def get_db() -> ZODB.DB:
+    """! Getter for the DB, opened on first use.
+    @return ZODB.DB object
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = _open_db(get_settings())
+    return _db
+
+def is_db_open() -> bool:
+    """! Whether the DB was opened by get_db() and not closed since.
+    @return bool
+    """
+    return _db is not None
+
+def close_db():
+    """! Close the DB if it was opened; the next get_db() opens it again.
+    @return None
+    """
+    global _db
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
+            log.info('Closed DB.')
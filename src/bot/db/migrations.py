@@ -0,0 +1,75 @@
+from typing import Any
+import ZODB
+from BTrees.OOBTree import OOBTree
+
+from .DBManager import DBManager
+from .DBMigrationManager import DBMigrationManager
+from .DBIndexManager import DBIndexManager
+from .ActivityAggregates import ActivityAggregates
+from .ActivityTimeline import ActivityTimeline
+from .model.BaseModel import BaseModel
+from .model.Subscription import Subscription
+from util.constants import DbConstants
+
+# The evolve steps of DBUpgradeSchemaManager, one per generation. Steps over whole trees are chunked;
+# what they rebuild is reset in prepare(), which runs once even when the step is resumed.
+
+
+@DBMigrationManager.register(1, 'initial')
+def evolve_initial(conn: ZODB.Connection.Connection):
+    pass
+
+def _create_missing_indexes(conn: ZODB.Connection.Connection):
+    root = conn.root()
+    for index in DBIndexManager.get_definitions():
+        if index['name'] not in root:
+            root[index['name']] = OOBTree()
+
+@DBMigrationManager.register_chunked(2, 'secondary_indexes',
+                                     trees=sorted({index['tree'] for index in DBIndexManager.get_definitions()}),
+                                     prepare=_create_missing_indexes)
+def evolve_secondary_indexes(conn: ZODB.Connection.Connection, tree_name: str, key: str, record: Any):
+    DBIndexManager.add(conn, tree_name, key, record)
+
+def _reset_timeline(conn: ZODB.Connection.Connection):
+    conn.root()[DbConstants.TREE_NAME_ACTIVITY_TIMELINE] = OOBTree()
+
+@DBMigrationManager.register_chunked(3, 'activity_timeline', trees=[DbConstants.TREE_NAME_ACTIVITIES],
+                                     prepare=_reset_timeline)
+def evolve_activity_timeline(conn: ZODB.Connection.Connection, tree_name: str, key: str, activity: Any):
+    ActivityTimeline.add(conn, key, activity)
+
+def _reset_aggregates(conn: ZODB.Connection.Connection):
+    conn.root()[DbConstants.TREE_NAME_ACTIVITY_AGGREGATES] = OOBTree()
+    conn.root()[DbConstants.TREE_NAME_AGGREGATE_HORIZONS] = OOBTree()
+
+@DBMigrationManager.register_chunked(4, 'activity_aggregates', trees=[DbConstants.TREE_NAME_ACTIVITIES],
+                                     prepare=_reset_aggregates)
+def evolve_activity_aggregates(conn: ZODB.Connection.Connection, tree_name: str, key: str, activity: Any):
+    ActivityAggregates.add(conn, ActivityAggregates.key(activity))
+
+@DBMigrationManager.register_chunked(5, 'compact_records', trees=DbConstants.MODEL_TREES)
+def evolve_compact_records(conn: ZODB.Connection.Connection, tree_name: str, key: str, record: Any):
+    # int uuids, epoch timestamps, no per-record tree names
+    BaseModel.compact(record)
+
+def _create_subscriptions(conn: ZODB.Connection.Connection):
+    if DbConstants.TREE_NAME_SUBSCRIPTIONS not in conn.root():
+        conn.root()[DbConstants.TREE_NAME_SUBSCRIPTIONS] = OOBTree()
+    _create_missing_indexes(conn)
+
+@DBMigrationManager.register_chunked(6, 'hotspot_subscriptions', trees=[DbConstants.TREE_NAME_OWNERS],
+                                     prepare=_create_subscriptions)
+def evolve_hotspot_subscriptions(conn: ZODB.Connection.Connection, tree_name: str, key: str, owner: Any):
+    # users tracked all hotspots of the owners they were linked to, keep them subscribed to those
+    if not owner.active:
+        return
+    subscribed = {subscription.hotspot_address for subscription in DBManager.iter_user_subscriptions(conn, owner.telegram_user_id)}
+    subscriptions = conn.root()[DbConstants.TREE_NAME_SUBSCRIPTIONS]
+    for hotspot in DBManager.iter_owner_hotspots(conn, owner.helium_address):
+        if hotspot.hotspot_address in subscribed:
+            continue
+        subscription = Subscription(hotspot.hotspot_address, owner.telegram_user_id)
+        subscriptions[str(subscription.uuid)] = subscription
+        DBManager._on_insert(conn, DbConstants.TREE_NAME_SUBSCRIPTIONS, str(subscription.uuid), subscription)
+        subscribed.add(hotspot.hotspot_address)
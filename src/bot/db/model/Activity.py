@@ -1,14 +1,46 @@
 from .BaseModel import BaseModel
-from src.util.constants import DbConstants
+from util.constants import DbConstants
 
 class Activity(BaseModel):
-    def __init__(self, fk_owner_address: str, fk_hotspot_address: str) -> None:
-        super().__init__(DbConstants.TREE_NAME_ACTIVITIES)
+    tree_name = DbConstants.TREE_NAME_ACTIVITIES
+
+    def __init__(self, fk_owner_address: str, fk_hotspot_address: str, transaction_hash: str = None,
+                 time: int = 0, height: int = 0, type: str = None, role: str = None) -> None:
+        super().__init__()
         self.owner_address = fk_owner_address
         self.hotspot_address = fk_hotspot_address
+        self.transaction_hash = transaction_hash
+        self.time = time
+        self.height = height
+        self.type = type
+        self.role = role
+
+    @classmethod
+    def from_role(cls, role: dict, hotspot_address: str, owner_address: str = None):
+        '''! Build an Activity from an entry of the Helium /hotspots/{address}/roles response.
+        '''
+        return cls(owner_address, hotspot_address,
+                   transaction_hash=role.get('hash'),
+                   time=role.get('time', 0),
+                   height=role.get('height', 0),
+                   type=role.get('type'),
+                   role=role.get('role'))
+
+    def to_dict(self) -> dict:
+        '''! Plain dict view of the activity in the shape of a Helium role entry.
+        '''
+        return {
+            'hash': self.transaction_hash,
+            'time': self.time,
+            'height': self.height,
+            'type': self.type,
+            'role': self.role,
+        }
 
     def __hash__(self) -> int:
-        return hash(self.uuid, self.owner_address, self.hotspot_address)
-    
+        return hash(self.transaction_hash)
+
     def __eq__(self, __o: object) -> bool:
-        return isinstance(__o, self.__class__) and self.helium_address == __o.helium_address
\ No newline at end of file
+        # a hotspot takes part in a transaction once
+        return (isinstance(__o, self.__class__) and self.transaction_hash == __o.transaction_hash
+                and self.hotspot_address == __o.hotspot_address)
@@ -1,21 +1,97 @@
+import sys
 import persistent
-import uuid
-from src.util.time_helper import get_iso_utc_time
-from src.bot.db.DBManager import DBManager
+from typing import Optional
+from uuid import UUID, uuid4
+from util.time_helper import get_epoch_utc_time, iso_to_epoch
+from bot.db.DBManager import DBManager
+
+# attributes that held ISO-8601 strings before they were stored as epoch seconds
+_TIME_ATTRIBUTES = ('last_updated_at', 'last_active_at')
+# address strings shared by many records, interned so every loaded record refers to one copy
+_INTERNED_ATTRIBUTES = ('owner_address', 'hotspot_address', 'helium_address')
+
 class BaseModel(persistent.Persistent):
-    def __init__(self, tree_name):
-        self.active = True
-        self.uuid = uuid.uuid4()
-        self.last_updated_at = get_iso_utc_time()
-        self.tree_name = tree_name
+    '''
+    Base class of the stored records. The state is kept small, because it is pickled for every record:
+    the uuid is stored as an int, timestamps as epoch seconds, the tree name is a class attribute and
+    attributes at their class default are not stored at all.
+    '''
+    # name of the tree the records of a subclass are stored in
+    tree_name: Optional[str] = None
+    active = True
+    # epoch time of the deactivation, records stored before it was tracked fall back to None
+    deactivated_at = None
+
+    def __init__(self):
+        self.uid = uuid4().int
+        self.last_updated_at = get_epoch_utc_time()
+
+    @property
+    def uuid(self) -> UUID:
+        '''! The uuid of the record; str(record.uuid) is its key in the tree.
+        '''
+        return UUID(int=self.uid)
 
     def __repr__(self):
         return '{}-{}'.format(self.__class__.__name__, self.uuid)
     
     def __str__(self):
         return '{}-{}'.format(self.__class__.__name__, self.uuid)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # active is only stored while it is False, True is the class default
+        if state.get('active', False) is True:
+            state = dict(state)
+            del state['active']
+        return state
+
+    def __setstate__(self, state):
+        compact = BaseModel.compact_state(state)
+        super().__setstate__(compact)
+        if compact is not state:
+            # stored in the old format, see compact()
+            self._v_compacted = True
+
+    @staticmethod
+    def compact_state(state: dict) -> dict:
+        '''! Convert the state of a record stored before the compact format; address strings are interned.
+        @param state pickled state of the record
+        @return the compact state, state itself if it was compact already
+        '''
+        for name in _INTERNED_ATTRIBUTES:
+            value = state.get(name)
+            if type(value) is str:
+                state[name] = sys.intern(value)
+        if 'uuid' not in state and 'tree_name' not in state and not any(type(state.get(name)) is str for name in _TIME_ATTRIBUTES):
+            return state
+        state = dict(state)
+        legacy_uuid = state.pop('uuid', None)
+        if legacy_uuid is not None:
+            state['uid'] = legacy_uuid.int
+        state.pop('tree_name', None)
+        for name in _TIME_ATTRIBUTES:
+            if type(state.get(name)) is str:
+                state[name] = iso_to_epoch(state[name])
+        if state.get('active') is True:
+            del state['active']
+        if 'deactivated_at' in state and state['deactivated_at'] is None:
+            del state['deactivated_at']
+        return state
+
+    @staticmethod
+    def compact(record: 'BaseModel') -> bool:
+        '''! Mark a record stored in the old format as changed, so it is written in the compact format on commit.
+        @return True if the record was stored in the old format
+        '''
+        record._p_activate()
+        if not getattr(record, '_v_compacted', False):
+            return False
+        del record._v_compacted
+        record._p_changed = True
+        return True
     
     def update(self):
         '''! This method updates/refreshes DB record for the object.
         '''
-        DBManager.update_record(self.tree_name, str(self.uuid), self)
\ No newline at end of file
+        DBManager.update_record(self.tree_name, str(self.uuid), self)
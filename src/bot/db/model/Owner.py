@@ -1,19 +1,23 @@
 from typing import List
 from .BaseModel import BaseModel
-from src.util.constants import DbConstants
+from util.constants import DbConstants
 
 class Owner(BaseModel):
     '''
     Hotspot owner class
     '''
+    tree_name = DbConstants.TREE_NAME_OWNERS
+
     def __init__(self, helium_address, fk_user_id) -> None:
         # owner id is the helium user address 
-        super().__init__(DbConstants.TREE_NAME_OWNERS)
+        super().__init__()
         self.helium_address = helium_address
         self.telegram_user_id = fk_user_id
 
     def __hash__(self) -> int:
-        return hash(self.helium_address, self.telegram_user_id)
+        return hash(self.helium_address)
     
     def __eq__(self, __o: object) -> bool:
-        return isinstance(__o, self.__class__) and self.helium_address == __o.helium_address
+        # an owner is tracked once per user
+        return (isinstance(__o, self.__class__) and self.helium_address == __o.helium_address
+                and self.telegram_user_id == __o.telegram_user_id)
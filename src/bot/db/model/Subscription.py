@@ -0,0 +1,20 @@
+from .BaseModel import BaseModel
+from util.constants import DbConstants
+
+class Subscription(BaseModel):
+    '''
+    A hotspot tracked by a Telegram user, one record per user and hotspot address
+    '''
+    tree_name = DbConstants.TREE_NAME_SUBSCRIPTIONS
+
+    def __init__(self, hotspot_address: str, fk_user_id: int) -> None:
+        super().__init__()
+        self.hotspot_address = hotspot_address
+        self.telegram_user_id = fk_user_id
+
+    def __hash__(self) -> int:
+        return hash(self.hotspot_address)
+
+    def __eq__(self, __o: object) -> bool:
+        return (isinstance(__o, self.__class__) and self.hotspot_address == __o.hotspot_address
+                and self.telegram_user_id == __o.telegram_user_id)
@@ -0,0 +1,93 @@
+"""! @brief Bounded-concurrency fan-out of async work over many items."""
+##
+# @file fanout.py
+# @package bot
+# @brief Bounded-concurrency fan-out of async work over many items.
+#
+# @section description_fanout Description
+# A fixed number of worker tasks pull items from a shared iterator, so at most
+# `concurrency` items are in flight and a slow item only holds up its own
+# worker. Progress is reported after every `batch_size` finished items.
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from util.constants import FanOutConstants
+
+log = logging.getLogger(__name__)
+
+
+class FanOutResult():
+    """! Running totals of a fan-out, passed to the progress callback and returned at the end."""
+
+    def __init__(self, total: Optional[int] = None):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.elapsed = 0.0
+
+    @property
+    def done(self) -> int:
+        return self.succeeded + self.failed
+
+    def __repr__(self):
+        return 'FanOutResult(done={}/{}, succeeded={}, failed={}, timed_out={}, elapsed={:.3f}s)'.format(
+            self.done, self.total if self.total is not None else '?',
+            self.succeeded, self.failed, self.timed_out, self.elapsed)
+
+
+def log_progress(result: FanOutResult):
+    """! Default progress callback logging the running totals.
+    @return None
+    """
+    log.info('Fan-out progress: %s', result)
+
+async def fan_out(items: Iterable[Any],
+                  worker: Callable[[Any], Awaitable[Any]],
+                  concurrency: int = FanOutConstants.CONCURRENCY,
+                  batch_size: int = FanOutConstants.BATCH_SIZE,
+                  timeout: Optional[float] = None,
+                  progress: Optional[Callable[[FanOutResult], None]] = log_progress) -> FanOutResult:
+    """! Run worker over all items with at most concurrency of them in flight.
+    @param items items to process, consumed lazily
+    @param worker coroutine function called once per item
+    @param concurrency maximum number of items processed at the same time
+    @param batch_size number of finished items between progress reports
+    @param timeout optional per-item timeout in seconds
+    @param progress optional callback receiving the running FanOutResult
+    @return FanOutResult
+    """
+    total = len(items) if hasattr(items, '__len__') else None
+    result = FanOutResult(total)
+    iterator = iter(items)
+    started = time.perf_counter()
+    batch_size = max(1, batch_size)
+
+    async def run():
+        # next() never awaits, so workers can safely share the iterator
+        for item in iterator:
+            try:
+                if timeout:
+                    await asyncio.wait_for(worker(item), timeout)
+                else:
+                    await worker(item)
+                result.succeeded += 1
+            except asyncio.TimeoutError:
+                result.failed += 1
+                result.timed_out += 1
+                log.warning('Fan-out item %s timed out after %ss.', item, timeout)
+            except Exception:
+                result.failed += 1
+                log.exception('Fan-out item %s failed.', item)
+            if progress is not None and result.done % batch_size == 0:
+                result.elapsed = time.perf_counter() - started
+                progress(result)
+
+    await asyncio.gather(*(run() for _ in range(max(1, concurrency))))
+    result.elapsed = time.perf_counter() - started
+    if progress is not None and result.done % batch_size != 0:
+        progress(result)
+    return result
@@ -1,40 +1,35 @@
-from email.message import Message
-from setuptools import Command
-from telegram.ext import filters, CommandHandler, MessageHandler
+from telegram import Update
+from telegram.ext import filters, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler
 from telegram.ext import ContextTypes
 
 from .actions import *
 from .ui_actions import *
 from util.constants import UiLabels
-from .ui_actions import ui_start, ui_end, ui_snooze, ui_settings 
+from .ui_items import menu_router
+from util.logger import set_correlation_id
 
-start_command_handler = CommandHandler('start', ui_start)
+async def set_update_correlation_id(update: Update, context: ContextTypes):
+    '''
+    Tag all log records of an update with its id; registered in group -1 so it runs first.
+    '''
+    set_correlation_id('u{}'.format(update.update_id))
+
+correlation_id_handler = TypeHandler(Update, set_update_correlation_id)
+
+start_command_handler = CommandHandler('start', menu_router.handle_start)
 echo_command_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), echo)
 bc_stats_command_handler = CommandHandler('bc_stats', send_blockchain_stats)
 tk_supply_command_handler = CommandHandler('tk_supply', send_token_supply)
 hotspot_data_command_handler = CommandHandler('hs_data', send_hotspot_data)
 hotspot_all_activity_command_handler = CommandHandler('hs_activity_all', send_all_hotspot_activity)
 hotspot_recent_activity_command_handler = CommandHandler('hs_activity_recent', send_recent_hotspot_activity)
+hotspot_summary_command_handler = CommandHandler('hs_summary', send_hotspot_summary)
+hotspot_summary_rebuild_command_handler = CommandHandler('hs_summary_rebuild', rebuild_hotspot_summary)
+add_owner_command_handler = CommandHandler('add_owner', add_user_owner)
+add_hotspot_command_handler = CommandHandler('add_hotspot', add_user_hotspot)
+my_hotspots_command_handler = CommandHandler('my_hotspots', send_user_hotspots)
+snooze_command_handler = CommandHandler('snooze', snooze_user_notifications)
+unsnooze_command_handler = CommandHandler('unsnooze', resume_user_notifications)
 
-async def ui_message_processor(update: Update, context: ContextTypes):
-    
-    received = update.message.text
-    if UiLabels.UI_LABEL_OPTION_START in received:
-        # start invoked
-        await ui_start(update, context)
-    elif UiLabels.UI_LABEL_OPTION_END in received:
-        # end invoked 
-        await ui_end(update, context)
-        pass
-    elif UiLabels.UI_LABEL_OPTION_SNOOZE in received:
-        # snooze options
-        await ui_snooze(update, context)
-        pass
-    elif UiLabels.UI_LABEL_OPTION_SETTINGS in received:
-        # settings main menu 
-        await ui_settings(update, context)
-        pass
-    pass
-
-ui_message_handler = MessageHandler(filters.TEXT, ui_message_processor)
-
+ui_message_handler = MessageHandler(filters.Text(menu_router.labels), menu_router.handle_message)
+ui_callback_handler = CallbackQueryHandler(menu_router.handle_callback)
@@ -0,0 +1,331 @@
+"""! @brief Shared HTTP client for the Helium API."""
+##
+# @file helium_client.py
+# @package bot
+# @brief Shared HTTP client for the Helium API.
+#
+# @section description_helium_client Description
+# Wraps a single long-lived aiohttp.ClientSession with a pooled keep-alive
+# connector, so consecutive Helium API calls reuse TCP+TLS connections.
+# Every request is bounded in time:
+# - per-route connect and read timeouts,
+# - jittered exponential retries of timeouts, connection errors, 429 and 5xx,
+# - a token bucket that is paused for the Retry-After time of a 429,
+# - a circuit breaker that fails requests fast while the API keeps failing.
+#
+# @section notes_helium_client Notes
+# - One client is created per Application in the post-init hook and closed on shutdown.
+# - Failed requests raise HeliumAPIError; the ResponseCache serves the last
+#   known good response of cached routes instead.
+
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+
+from bot import metrics
+from bot.token_bucket import TokenBucket
+from util.constants import HttpConstants
+
+log = logging.getLogger(__name__)
+
+
+class HeliumAPIError(Exception):
+    """! A Helium API request failed."""
+
+    def __init__(self, route: str, status: Optional[int] = None, message: str = '', retry_after: Optional[float] = None):
+        """! HeliumAPIError constructor.
+        @param route route name of the request
+        @param status HTTP status code, None if there was no response
+        @param retry_after seconds the API asked to wait, for 429 responses
+        """
+        super().__init__('Helium API request to {} failed: {}'.format(route, message or status))
+        self.route = route
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """! Whether the request may succeed when repeated: no response, 429 or a 5xx status."""
+        return self.status is None or self.status in HttpConstants.RETRY_STATUSES
+
+
+class CircuitOpenError(HeliumAPIError):
+    """! Request not sent because the circuit breaker is open."""
+
+    def __init__(self, route: str):
+        super().__init__(route, message='circuit breaker is open')
+
+    @property
+    def retryable(self) -> bool:
+        return False
+
+
+class CircuitBreaker():
+    """! Opens after threshold consecutive failed requests, retries included. While open requests fail fast;
+    after reset_timeout seconds one trial request is let through (half-open) and closes the breaker again
+    if it succeeds. A trial request that never reports back is replaced after another reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold: int = HttpConstants.BREAKER_THRESHOLD, reset_timeout: float = HttpConstants.BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """! Whether a request may be sent now; moves an open breaker to half-open after reset_timeout.
+        @return bool
+        """
+        if self.state == CircuitBreaker.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # let exactly one trial request through per reset_timeout
+            self.state = CircuitBreaker.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self):
+        """! The API answered; close the breaker.
+        @return None
+        """
+        if self.state != CircuitBreaker.CLOSED:
+            log.info('Helium API recovered, closing the circuit breaker.')
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        """! The API failed; open the breaker after threshold consecutive failures or a failed trial request.
+        @return None
+        """
+        self.failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN or (self.state == CircuitBreaker.CLOSED and self.failures >= self.threshold):
+            log.warning('Helium API failed %s times in a row, opening the circuit breaker for %ss.', self.failures, self.reset_timeout)
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
+            self.opened += 1
+
+
+def _parse_retry_after(value: Optional[str]) -> float:
+    """! Seconds of a Retry-After header given in seconds or as an HTTP date.
+    @return float, HttpConstants.DEFAULT_RETRY_AFTER if the header is missing or invalid
+    """
+    if not value:
+        return HttpConstants.DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return HttpConstants.DEFAULT_RETRY_AFTER
+
+
+class HeliumClient():
+    """! Long-lived HTTP client with keep-alive connection pooling, per-host limits and DNS caching."""
+
+    def __init__(self,
+                 headers: Optional[dict] = None,
+                 limit: int = HttpConstants.CONNECTION_LIMIT,
+                 limit_per_host: int = HttpConstants.CONNECTION_LIMIT_PER_HOST,
+                 dns_cache_ttl: int = HttpConstants.DNS_CACHE_TTL,
+                 keepalive_timeout: float = HttpConstants.KEEPALIVE_TIMEOUT,
+                 total_timeout: float = HttpConstants.TOTAL_TIMEOUT,
+                 connect_timeout: float = HttpConstants.CONNECT_TIMEOUT,
+                 read_timeout: float = HttpConstants.READ_TIMEOUT,
+                 route_timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+                 retries: int = HttpConstants.RETRIES,
+                 retry_backoff: float = HttpConstants.RETRY_BACKOFF,
+                 rate: float = HttpConstants.RATE,
+                 burst: float = HttpConstants.BURST,
+                 max_wait: float = HttpConstants.MAX_WAIT,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.headers = headers or {}
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            connect=connect_timeout,
+            sock_read=read_timeout
+        )
+        routes = dict(HttpConstants.ROUTE_TIMEOUTS if route_timeouts is None else route_timeouts)
+        self.route_timeouts = {
+            route: aiohttp.ClientTimeout(total=total_timeout, connect=connect, sock_read=read)
+            for route, (connect, read) in routes.items()
+        }
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or CircuitBreaker()
+        self.retried = 0
+        self.rate_limited = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def from_config(cls, config: dict, headers: Optional[dict] = None):
+        """! Build a client from the secrets/config dictionary, falling back to HttpConstants defaults.
+        @param config dictionary with optional HTTP_* keys
+        @param headers default headers sent with every request
+        @return HeliumClient
+        """
+        return cls(
+            headers=headers,
+            limit=int(config.get('HTTP_CONNECTION_LIMIT', HttpConstants.CONNECTION_LIMIT)),
+            limit_per_host=int(config.get('HTTP_CONNECTION_LIMIT_PER_HOST', HttpConstants.CONNECTION_LIMIT_PER_HOST)),
+            dns_cache_ttl=int(config.get('HTTP_DNS_CACHE_TTL', HttpConstants.DNS_CACHE_TTL)),
+            keepalive_timeout=float(config.get('HTTP_KEEPALIVE_TIMEOUT', HttpConstants.KEEPALIVE_TIMEOUT)),
+            total_timeout=float(config.get('HTTP_TOTAL_TIMEOUT', HttpConstants.TOTAL_TIMEOUT)),
+            connect_timeout=float(config.get('HTTP_CONNECT_TIMEOUT', HttpConstants.CONNECT_TIMEOUT)),
+            read_timeout=float(config.get('HTTP_READ_TIMEOUT', HttpConstants.READ_TIMEOUT)),
+            route_timeouts=dict(HttpConstants.ROUTE_TIMEOUTS, **config.get('HTTP_ROUTE_TIMEOUTS', {})),
+            retries=int(config.get('HTTP_RETRIES', HttpConstants.RETRIES)),
+            retry_backoff=float(config.get('HTTP_RETRY_BACKOFF', HttpConstants.RETRY_BACKOFF)),
+            rate=float(config.get('HTTP_RATE', HttpConstants.RATE)),
+            burst=float(config.get('HTTP_BURST', HttpConstants.BURST)),
+            max_wait=float(config.get('HTTP_MAX_WAIT', HttpConstants.MAX_WAIT)),
+            breaker=CircuitBreaker(
+                threshold=int(config.get('HTTP_BREAKER_THRESHOLD', HttpConstants.BREAKER_THRESHOLD)),
+                reset_timeout=float(config.get('HTTP_BREAKER_RESET_TIMEOUT', HttpConstants.BREAKER_RESET_TIMEOUT)),
+            ),
+        )
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    async def start(self):
+        """! Create the underlying session. Must be called from within the running event loop.
+        @return None
+        """
+        if not self.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=self.timeout,
+        )
+        log.info('Started Helium HTTP client (limit=%s, limit_per_host=%s, dns_cache_ttl=%ss).',
+                 self.limit, self.limit_per_host, self.dns_cache_ttl)
+
+    async def close(self):
+        """! Close the session and release all pooled connections.
+        @return None
+        """
+        if not self.closed:
+            await self._session.close()
+            log.info('Closed Helium HTTP client.')
+        self._session = None
+
+    async def get_json(self, url: str, params: Optional[dict] = None, route: str = HttpConstants.ROUTE_OTHER):
+        """! Issue a GET request over the pooled session and decode the JSON body, retrying failures
+        that may be transient with jittered exponential backoff.
+        @param url absolute request URL
+        @param params optional query parameters
+        @param route route name, selects the timeouts and is counted under in the metrics
+        @return decoded JSON response
+        @exception HeliumAPIError if the request failed, CircuitOpenError if it was not sent
+        """
+        if self.closed:
+            await self.start()
+        for attempt in range(self.retries + 1):
+            await self._acquire(route)
+            if attempt == 0:
+                blocked = not self.breaker.allow()
+            else:
+                # a retry stops as well if other requests opened the breaker during its backoff
+                blocked = self.breaker.state == CircuitBreaker.OPEN
+            if blocked:
+                raise CircuitOpenError(route)
+            try:
+                result = await self._get(url, params, route)
+            except HeliumAPIError as error:
+                if not error.retryable or error.status == 429:
+                    # the API answered, e.g. 404 for an unknown address; 429 is handled by the bucket
+                    self.breaker.record_success()
+                    if not error.retryable:
+                        raise
+                if attempt == self.retries or (error.retry_after or 0) > self.max_wait:
+                    if error.status != 429:
+                        self.breaker.record_failure()
+                    raise
+                # full jitter, but never sooner than the API asked for
+                backoff = random.uniform(0, min(HttpConstants.RETRY_BACKOFF_MAX, self.retry_backoff * 2 ** attempt))
+                self.retried += 1
+                log.debug('Retrying %s in %.2fs after: %s', route, max(backoff, error.retry_after or 0), error)
+                await asyncio.sleep(max(backoff, error.retry_after or 0))
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def _acquire(self, route: str):
+        """! Internal method that waits for a token of the bucket, failing fast if that takes longer than max_wait.
+        @return None
+        """
+        wait = self.bucket.take()
+        while wait > 0:
+            if wait > self.max_wait:
+                raise HeliumAPIError(route, 429, 'rate limited for another {:.1f}s'.format(wait))
+            await asyncio.sleep(wait)
+            wait = self.bucket.take()
+
+    async def _get(self, url: str, params: Optional[dict], route: str):
+        """! Internal method sending one request.
+        @return decoded JSON response
+        """
+        timeout = self.route_timeouts.get(route, self.timeout)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with self._session.get(url, params=params, timeout=timeout) as resp:
+                status = resp.status
+                if resp.status == 429:
+                    retry_after = _parse_retry_after(resp.headers.get('Retry-After'))
+                    self.bucket.pause(retry_after)
+                    self.rate_limited += 1
+                    log.warning('Helium API rate limit hit, pausing requests for %.1fs.', retry_after)
+                    raise HeliumAPIError(route, 429, retry_after=retry_after)
+                if resp.status >= 400:
+                    raise HeliumAPIError(route, resp.status)
+                try:
+                    return await resp.json()
+                except (aiohttp.ContentTypeError, ValueError) as e:
+                    # an error page of a proxy in front of the API
+                    raise HeliumAPIError(route, None, 'invalid JSON response ({})'.format(resp.status)) from e
+        except asyncio.TimeoutError as e:
+            raise HeliumAPIError(route, None, 'timed out') from e
+        except aiohttp.ClientError as e:
+            raise HeliumAPIError(route, None, str(e) or type(e).__name__) from e
+        finally:
+            if metrics.ENABLED:
+                metrics.HELIUM_RESPONSES.inc(route, status)
+                metrics.HELIUM_SECONDS.observe(time.perf_counter() - started, route)
+
+    def stats(self) -> dict:
+        """! Retry, rate limit and circuit breaker counters.
+        @return dict
+        """
+        return {'retried': self.retried, 'rate_limited': self.rate_limited,
+                'breaker_state': self.breaker.state, 'breaker_opened': self.breaker.opened}
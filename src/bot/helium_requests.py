@@ -1,43 +1,168 @@
-from asyncore import read
-import aiohttp
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+from urllib.parse import urlencode
 
+from bot.helium_client import HeliumClient
+from bot.response_cache import ResponseCache
 from util.read_secrets import read_secrets
-from util.request_formatter import get_human_readable_text
-
-SECRETS = read_secrets()
-BASE_URL = 'https://api.helium.io'
-API_URL = BASE_URL + '/' + '{api_version}' + '/' + '{route}'
+from util.constants import CacheConstants, HttpConstants
 
 header = {
     'User-Agent': '1.20.3 (linux-gnu)'
 }
 
+_config: Optional[dict] = None
+_client: Optional[HeliumClient] = None
+_cache: Optional[ResponseCache] = None
 
-hotspot_activity = {
+def configure(config: dict):
     '''
-    Last 24h of hotspot activity.
+    Use config instead of secrets.json for the API URL, the default hotspot
+    and the response cache, e.g. the per-worker config passed to init_bot().
+    Replaces the response cache.
     '''
-    'transactions': [],
-    'witnessed': [],
-    'last_updated_at': ''
-}
+    global _config, _cache
+    _config = config
+    _cache = ResponseCache.from_config(config)
+
+def get_config() -> dict:
+    '''
+    Return the config set by configure(), secrets.json until then.
+    '''
+    return read_secrets() if _config is None else _config
+
+def api_url(route: str, api_version: str = 'v1') -> str:
+    '''
+    Full URL of a Helium API route.
+    '''
+    return '{}/{}/{}'.format(get_config().get('HELIUM_API_URL', HttpConstants.API_URL), api_version, route)
+
+def set_client(client: Optional[HeliumClient]):
+    '''
+    Register the shared client used by all requests in this module.
+    '''
+    global _client
+    _client = client
 
-async def get_request(URL, par = None):
-    async with aiohttp.ClientSession(headers=header) as session:
-        async with session.get(URL) as resp:
-            return await resp.json()
+def get_client() -> HeliumClient:
+    '''
+    Return the shared client, creating a default one if none was registered.
+    '''
+    global _client
+    if _client is None:
+        _client = HeliumClient.from_config(get_config(), headers=header)
+    return _client
+
+def get_cache() -> ResponseCache:
+    '''
+    Return the response cache shared by all requests in this module,
+    creating it on first use if configure() was not called.
+    '''
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache.from_config(get_config())
+    return _cache
+
+def get_cache_stats() -> dict:
+    '''
+    Cache hit/miss/coalesced counters, used for tuning the per-route TTLs.
+    '''
+    return get_cache().stats()
+
+async def get_request(URL, par = None, ttl: float = 0, route: str = HttpConstants.ROUTE_OTHER):
+    '''
+    GET a Helium API URL. With a positive ttl the response is cached and
+    concurrent requests for the same URL share one upstream call. The route
+    names the request in the metrics.
+    '''
+    if ttl <= 0:
+        return await get_client().get_json(URL, params=par, route=route)
+    key = URL + '?' + urlencode(sorted(par.items())) if par else URL
+    return await get_cache().get(key, ttl, lambda: get_client().get_json(URL, params=par, route=route))
 
 async def get_bc_stats():
-    return await get_request(API_URL.format(api_version='v1', route='stats'))
+    return await get_request(api_url('stats'),
+                             ttl=get_cache().ttl_for(CacheConstants.ROUTE_STATS), route=CacheConstants.ROUTE_STATS)
 
 async def get_token_supply():
-    return await get_request(API_URL.format(api_version='v1', route='stats/token_supply'))
+    return await get_request(api_url('stats/token_supply'),
+                             ttl=get_cache().ttl_for(CacheConstants.ROUTE_TOKEN_SUPPLY), route=CacheConstants.ROUTE_TOKEN_SUPPLY)
 
-async def get_hotspot_data():
-    return await get_request(API_URL.format(api_version='v1', route='hotspots/'+SECRETS['HOTSPOT_ADDRESS']))
+async def get_hotspot_data(address: Optional[str] = None):
+    address = address or get_config()['HOTSPOT_ADDRESS']
+    return await get_request(api_url('hotspots/'+address),
+                             ttl=get_cache().ttl_for(CacheConstants.ROUTE_HOTSPOT), route=CacheConstants.ROUTE_HOTSPOT)
 
-async def get_hotspot_activity():
-    return await get_request(API_URL.format(api_version='v1', route='hotspots/'+SECRETS['HOTSPOT_ADDRESS']+'/roles'))
+async def iter_account_hotspots(owner_address: str) -> AsyncIterator[dict]:
+    '''
+    Yield all hotspots owned by an account, following the API cursor pages.
+    '''
+    url = api_url('accounts/'+owner_address+'/hotspots')
+    params = None
+    while True:
+        resp = await get_request(url, par=params, route=HttpConstants.ROUTE_ACCOUNT_HOTSPOTS)
+        for hotspot in resp.get('data', []):
+            yield hotspot
+        cursor = resp.get('cursor')
+        if not cursor:
+            return
+        params = {'cursor': cursor}
+
+async def iter_hotspot_role_pages(address: Optional[str] = None, min_time: Optional[int] = None) -> AsyncIterator[List[dict]]:
+    '''
+    Lazily follow the cursor pages of /hotspots/{address}/roles, newest first.
+    The next page is only requested once the caller asks for it.
+    '''
+    address = address or get_config()['HOTSPOT_ADDRESS']
+    url = api_url('hotspots/'+address+'/roles')
+    params = None
+    if min_time is not None:
+        params = {'min_time': datetime.fromtimestamp(min_time, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+    while True:
+        resp = await get_request(url, par=params, route=HttpConstants.ROUTE_ROLES)
+        page = resp.get('data', [])
+        # the API may return an empty page that still carries a cursor
+        if page:
+            yield page
+        cursor = resp.get('cursor')
+        if not cursor:
+            return
+        params = {'cursor': cursor}
 
-async def get_recent_hotspot_activity():
-    return await get_request(API_URL.format(api_version='v1', route='hotspots/'+SECRETS['HOTSPOT_ADDRESS']+'/roles'))
+async def iter_hotspot_roles(address: Optional[str] = None, since: Optional[int] = None) -> AsyncIterator[dict]:
+    '''
+    Yield hotspot roles one by one, newest first. With since (epoch seconds)
+    iteration stops at the first role older than the boundary.
+    '''
+    pages = iter_hotspot_role_pages(address, min_time=since)
+    try:
+        async for page in pages:
+            for role in page:
+                if since is not None and role.get('time', 0) < since:
+                    return
+                yield role
+    finally:
+        await pages.aclose()
+
+async def get_hotspot_activity(address: Optional[str] = None, limit: Optional[int] = None):
+    '''
+    All hotspot roles, or the newest limit of them.
+    '''
+    roles = []
+    stream = iter_hotspot_roles(address)
+    try:
+        async for role in stream:
+            roles.append(role)
+            if limit is not None and len(roles) >= limit:
+                break
+    finally:
+        await stream.aclose()
+    return {'data': roles}
+
+async def get_recent_hotspot_activity(address: Optional[str] = None, hours: int = 24):
+    '''
+    Hotspot roles of the last hours (24h by default).
+    '''
+    since = int(time.time()) - hours * 3600
+    return {'data': [role async for role in iter_hotspot_roles(address, since=since)]}
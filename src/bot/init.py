@@ -9,6 +9,14 @@
 #
 # @section notes_init_bot Notes
 # - Bot is initialized using unique Telegram Bot ID.
+# - init_bot() only builds the Application. The DB, the Helium HTTP client,
+#   the send queue, the metrics server and the scheduled jobs are started
+#   by the post-init hook, each recorded as a startup phase.
+# - With BOT_MODE workers, main.py runs the front process of bot.workers
+#   instead, and every worker process builds its Application here.
+# - No module reads its settings at import; init_bot() passes its config to
+#   the configure() function of every subsystem, so each worker runs with
+#   the config built for it by bot.workers.worker_config().
 #
 # @section todo_init_bot TODO
 # - None.
@@ -19,28 +27,136 @@
 #
 # Copyright (c) 2022 Svetozar Stojanovic.  All rights reserved.
 
-from telegram.ext import ApplicationBuilder, CallbackQueryHandler
+import functools
+import logging
+import secrets
+from typing import Optional
+
+from telegram.ext import Application, ApplicationBuilder, CallbackQueryHandler
 
 from zope.generations.interfaces import ISchemaManager
 from zope.generations.generations import evolveMinimumSubscriber
 from zope.component import provideUtility
 from bot.db.DBManager import DBManager
+from bot.db.AsyncDBManager import AsyncDBManager
 
 from bot.db.db_events import DatabaseOpenedEventStub
 from bot.handlers import *
+from bot.actions import handle_error
 from util.read_secrets import read_secrets
 from bot.db.DBUpgradeSchemaManager import DBUpgradeSchemaManager
+from bot.helium_client import HeliumClient
+from bot import activity_sync, helium_requests, maintenance, notifications
+from bot.activity_sync import schedule_activity_sync
+from bot.maintenance import schedule_maintenance
+from bot.send_queue import SendQueue
+from bot import metrics
+from util import startup_profile
+
+from util.constants import BotModeConstants, DbConstants, HttpConstants, MetricsConstants, SendQueueConstants
+log = logging.getLogger(__name__)
+
+
+def open_database():
+    """! Open the DB and install or evolve its schema. Blocking, the post-init hook runs it in the DB writer thread.
+    @return None
+    """
+    db_schema_manager = register_db_schema_manager()
+    with DBManager.connection() as conn:
+        db_schema_manager.install(conn)
+
+def _preload_job_triggers(application: Application):
+    """! Register APScheduler's trigger classes with the JobQueue's scheduler. APScheduler 3 otherwise resolves
+    them through pkg_resources entry points on the first scheduled job, which takes 100-250 ms at startup.
+    @return None
+    """
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.date import DateTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+    trigger_classes = getattr(application.job_queue.scheduler, '_trigger_classes', None)
+    if isinstance(trigger_classes, dict):
+        trigger_classes.setdefault('cron', CronTrigger)
+        trigger_classes.setdefault('date', DateTrigger)
+        trigger_classes.setdefault('interval', IntervalTrigger)
 
-from util.constants import DbConstants
-SECRETS = read_secrets()
+def configure_subsystems(config: dict):
+    """! Hand the config to every subsystem that reads settings, so a worker runs with its own config
+    instead of secrets.json.
+    @param config secrets/config dictionary the Application is built with
+    @return None
+    """
+    AsyncDBManager.configure(config)
+    helium_requests.configure(config)
+    activity_sync.configure(config)
+    maintenance.configure(config)
+    notifications.configure(config)
+    metrics.configure(config)
 
+async def _post_init(application: Application, config: dict, schedule_jobs: bool = True):
+    """! Post-init hook; opens the DB, creates the shared Helium HTTP client and the send queue for this Application,
+    starts the metrics server if metrics are enabled and schedules the background jobs.
+    @param application the Application being started
+    @param config secrets/config dictionary the Application was built with
+    @param schedule_jobs False to leave the activity sync and maintenance jobs to another process
+    @return None
+    """
+    with startup_profile.phase('db'):
+        await AsyncDBManager.run_write(open_database)
+    with startup_profile.phase('http'):
+        client = HeliumClient.from_config(config, headers=helium_requests.header)
+        await client.start()
+        application.bot_data[HttpConstants.CLIENT_DATA_KEY] = client
+        helium_requests.set_client(client)
+    with startup_profile.phase('send_queue'):
+        send_queue = SendQueue.from_config(application.bot, config)
+        await send_queue.start()
+        application.bot_data[SendQueueConstants.DATA_KEY] = send_queue
+    with startup_profile.phase('metrics'):
+        application.bot_data[MetricsConstants.DATA_KEY] = await metrics.start_server(config)
+    with startup_profile.phase('scheduler'):
+        if application.job_queue is not None:
+            _preload_job_triggers(application)
+        if schedule_jobs:
+            schedule_activity_sync(application)
+            schedule_maintenance(application)
+    log.info('Startup finished in %s', startup_profile.summary())
 
-def init_bot():
-    """! Initializes the Telegram Bot and message handlers.
+async def _post_shutdown(application: Application):
+    """! Post-shutdown hook; drains the send queue, closes the shared Helium HTTP client and stops the metrics server.
+    @param application the Application being stopped
+    @return None
+    """
+    send_queue = application.bot_data.pop(SendQueueConstants.DATA_KEY, None)
+    if send_queue is not None:
+        await send_queue.stop()
+    client = application.bot_data.pop(HttpConstants.CLIENT_DATA_KEY, None)
+    if client is not None:
+        await client.close()
+    helium_requests.set_client(None)
+    await metrics.stop_server(application.bot_data.pop(MetricsConstants.DATA_KEY, None))
+    log.info('Helium response cache stats: %s', helium_requests.get_cache_stats())
+    AsyncDBManager.shutdown()
+    log.info('DB connection stats: %s', DBManager.get_connection_stats())
+    DBManager.close_db()
 
+def init_bot(config: Optional[dict] = None, schedule_jobs: bool = True):
+    """! Application factory; builds the Telegram Bot with its message handlers without opening the DB or
+    any connection, those are started by the post-init hook.
+    @param config secrets/config dictionary, secrets.json by default
+    @param schedule_jobs False to build a worker that does not run the background jobs
     @return An initialized Telegram Bot.
     """
-    application = ApplicationBuilder().token(SECRETS['BOT_TOKEN']).build()
+    config = read_secrets() if config is None else config
+    configure_subsystems(config)
+    application = (
+        ApplicationBuilder()
+        .token(config['BOT_TOKEN'])
+        .base_url(config.get('TELEGRAM_API_URL', BotModeConstants.TELEGRAM_API_URL) + '/bot')
+        .concurrent_updates(int(config.get('CONCURRENT_UPDATES', BotModeConstants.CONCURRENT_UPDATES)))
+        .post_init(functools.partial(_post_init, config=config, schedule_jobs=schedule_jobs))
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
     application.add_handlers(
         handlers=(
             # command handlers
@@ -51,14 +167,64 @@ def init_bot():
             hotspot_data_command_handler,
             hotspot_all_activity_command_handler,
             hotspot_recent_activity_command_handler,
+            hotspot_summary_command_handler,
+            hotspot_summary_rebuild_command_handler,
+            add_owner_command_handler,
+            add_hotspot_command_handler,
+            my_hotspots_command_handler,
+            snooze_command_handler,
+            unsnooze_command_handler,
 
             # message handlers
             ui_message_handler,
+
+            # callback query handlers
+            ui_callback_handler,
         )
     )
+    application.add_handler(correlation_id_handler, group=-1)
+    application.add_error_handler(handle_error)
 
     return application
 
+def get_webhook_settings(config: dict) -> dict:
+    """! Webhook server settings from the secrets/config dictionary, falling back to BotModeConstants defaults.
+    Without a configured WEBHOOK_SECRET_TOKEN a random one is generated, Telegram then sends it with every update.
+    @param config dictionary with WEBHOOK_URL and optional WEBHOOK_* keys
+    @return keyword arguments for Application.run_webhook() and Updater.start_webhook()
+    """
+    url_path = config.get('WEBHOOK_URL_PATH', BotModeConstants.WEBHOOK_URL_PATH).strip('/')
+    if 'WEBHOOK_URL' not in config:
+        raise ValueError('WEBHOOK_URL has to be set in webhook mode.')
+    return {
+        'listen': config.get('WEBHOOK_LISTEN', BotModeConstants.WEBHOOK_LISTEN),
+        'port': int(config.get('WEBHOOK_PORT', BotModeConstants.WEBHOOK_PORT)),
+        'url_path': url_path,
+        'webhook_url': '{}/{}'.format(config['WEBHOOK_URL'].rstrip('/'), url_path),
+        'secret_token': config.get('WEBHOOK_SECRET_TOKEN') or secrets.token_urlsafe(32),
+        'max_connections': int(config.get('WEBHOOK_MAX_CONNECTIONS', BotModeConstants.WEBHOOK_MAX_CONNECTIONS)),
+    }
+
+def run_bot(application: Application, config: Optional[dict] = None):
+    """! Runs the Application until it is stopped, receiving updates by long polling or, with BOT_MODE webhook,
+    through PTB's webhook server.
+    @param application the Application to run
+    @param config secrets/config dictionary, secrets.json by default
+    @return None
+    """
+    config = read_secrets() if config is None else config
+    mode = config.get('BOT_MODE', BotModeConstants.MODE)
+    if mode == BotModeConstants.WEBHOOK:
+        settings = get_webhook_settings(config)
+        log.info('Starting in webhook mode on %s:%s/%s, max_connections=%s.', settings['listen'], settings['port'],
+                 settings['url_path'], settings['max_connections'])
+        application.run_webhook(**settings)
+    elif mode == BotModeConstants.POLLING:
+        log.info('Starting in polling mode.')
+        application.run_polling()
+    else:
+        raise ValueError('Unknown BOT_MODE {!r}, expected polling or webhook.'.format(mode))
+
 def register_db_schema_manager():
     db_schema_manager = DBUpgradeSchemaManager()
     provideUtility(db_schema_manager, ISchemaManager, name=DbConstants.DB_APP_NAME)
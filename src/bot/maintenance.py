@@ -0,0 +1,133 @@
+"""! @brief Background maintenance jobs keeping the database bounded."""
+##
+# @file maintenance.py
+# @package bot
+# @brief Background maintenance jobs keeping the database bounded.
+#
+# @section description_maintenance Description
+# Repeating JobQueue jobs that remove data the bot no longer needs.
+# - Activity retention: activities older than ACTIVITY_RETENTION_DAYS are
+#   removed through the per-hotspot activity timeline, oldest first.
+# - DB maintenance: records deleted (active = False) more than
+#   REAPER_GRACE_DAYS ago are removed in small batches, then the storage is
+#   packed every PACK_INTERVAL seconds or as soon as it grew by
+#   PACK_SIZE_THRESHOLD_MB since the last pack. The time and size of the last
+#   pack are kept in the DB, so restarts do not postpone the next pack.
+#
+# @section notes_maintenance Notes
+# - All DB work runs in the threads of AsyncDBManager, off the event loop.
+
+import logging
+import time
+from typing import Optional
+
+from telegram.ext import Application, ContextTypes
+
+from bot.db.AsyncDBManager import AsyncDBManager
+from bot.db.DBManager import DBManager
+from bot.db.SnoozeIndex import SnoozeIndex
+from util.constants import MaintenanceConstants
+from util.read_secrets import read_secrets
+
+_config: Optional[dict] = None
+log = logging.getLogger(__name__)
+
+def configure(config: dict):
+    """! Use config instead of secrets.json for the retention, reaper and pack settings.
+    @param config secrets/config dictionary
+    @return None
+    """
+    global _config
+    _config = config
+
+def _get_config() -> dict:
+    """! Internal getter for the config set by configure(), secrets.json until then.
+    @return dict
+    """
+    return read_secrets() if _config is None else _config
+
+async def activity_retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """! JobQueue callback removing all activities older than the retention horizon.
+    @param context callback context of the job
+    @return None
+    """
+    days = float(_get_config().get('ACTIVITY_RETENTION_DAYS', MaintenanceConstants.ACTIVITY_RETENTION_DAYS))
+    horizon = int(time.time() - days * 86400)
+    started = time.perf_counter()
+    removed = await AsyncDBManager.prune_activities(horizon)
+    log.info('Activity retention removed %s activities in %.2fs.', removed, time.perf_counter() - started)
+
+async def reap_inactive_records() -> int:
+    """! Remove the records of all reaped trees that were deleted more than the grace period ago.
+    @return number of records removed
+    """
+    config = _get_config()
+    grace_period = float(config.get('REAPER_GRACE_DAYS', MaintenanceConstants.REAPER_GRACE_DAYS)) * 86400
+    batch_size = int(config.get('REAPER_BATCH_SIZE', MaintenanceConstants.REAPER_BATCH_SIZE))
+    removed = 0
+    for tree_name in MaintenanceConstants.REAPER_TREES:
+        tree_removed, _ = await AsyncDBManager.reap_inactive(tree_name, grace_period, batch_size=batch_size)
+        removed += tree_removed
+    return removed
+
+async def pack_if_due(force: bool = False):
+    """! Pack the storage if PACK_INTERVAL passed or it grew by PACK_SIZE_THRESHOLD_MB since the last pack.
+    A DB without a recorded pack only records the current time and size on the first call.
+    @param force pack regardless of interval and size
+    @return pack report, see DBManager.pack(), None if no pack was due
+    """
+    now = time.time()
+    size = await AsyncDBManager.run(DBManager.get_storage_size)
+    last_pack = await AsyncDBManager.get_last_pack()
+    if last_pack is None and not force:
+        await AsyncDBManager.set_last_pack(now, size)
+        return None
+    config = _get_config()
+    interval = float(config.get('PACK_INTERVAL', MaintenanceConstants.PACK_INTERVAL))
+    threshold = float(config.get('PACK_SIZE_THRESHOLD_MB', MaintenanceConstants.PACK_SIZE_THRESHOLD_MB)) * 1024 * 1024
+    due = force or now - last_pack['time'] >= interval or size - last_pack['size'] >= threshold
+    if not due:
+        return None
+    report = await AsyncDBManager.pack(float(config.get('PACK_KEEP_DAYS', MaintenanceConstants.PACK_KEEP_DAYS)))
+    # recording the pack grows the storage a little, which the next threshold check tolerates
+    await AsyncDBManager.set_last_pack(time.time(), report['size_after'])
+    return report
+
+async def db_maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """! JobQueue callback removing ended snoozes, reaping deleted records and packing the storage when due.
+    @param context callback context of the job
+    @return None
+    """
+    started = time.perf_counter()
+    await AsyncDBManager.run_write(DBManager.transact, SnoozeIndex.expire, int(time.time()))
+    removed = await reap_inactive_records()
+    report = await pack_if_due()
+    if report is None:
+        log.info('DB maintenance removed %s records in %.2fs, no pack due.', removed, time.perf_counter() - started)
+    else:
+        log.info('DB maintenance removed %s records and reclaimed %s bytes in %.2fs (pack took %.2fs).',
+                 removed, report['reclaimed'], time.perf_counter() - started, report['seconds'])
+
+def schedule_maintenance(application: Application):
+    """! Register the repeating maintenance jobs on the Application's JobQueue.
+    @param application the Application to schedule the jobs on
+    @return list of the scheduled Jobs, empty if the JobQueue is not available
+    """
+    if application.job_queue is None:
+        log.warning('JobQueue is not available, maintenance is disabled.')
+        return []
+    config = _get_config()
+    return [
+        application.job_queue.run_repeating(
+            activity_retention_job,
+            interval=float(config.get('RETENTION_INTERVAL', MaintenanceConstants.RETENTION_INTERVAL)),
+            first=float(config.get('RETENTION_FIRST_RUN_DELAY', MaintenanceConstants.RETENTION_FIRST_RUN_DELAY)),
+            name=MaintenanceConstants.RETENTION_JOB_NAME,
+        ),
+        application.job_queue.run_repeating(
+            db_maintenance_job,
+            interval=float(config.get('MAINTENANCE_INTERVAL', MaintenanceConstants.MAINTENANCE_INTERVAL)),
+            first=float(config.get('MAINTENANCE_FIRST_RUN_DELAY', MaintenanceConstants.MAINTENANCE_FIRST_RUN_DELAY)),
+            name=MaintenanceConstants.MAINTENANCE_JOB_NAME,
+        ),
+    ]
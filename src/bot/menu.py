@@ -0,0 +1,168 @@
+"""! @brief Declarative menu router for reply and inline keyboards."""
+##
+# @file menu.py
+# @package bot
+# @brief Declarative menu router for reply and inline keyboards.
+#
+# @section description_menu Description
+# Menus are declared as a tree of Menu objects made of Button rows. The
+# router builds every keyboard markup once, maps button labels and callback
+# data to their buttons, and keeps the menu each user is in.
+# - Reply keyboard buttons are dispatched by an exact-match lookup of the
+#   message text in the user's current menu, falling back to all labels so
+#   buttons of an outdated keyboard still work.
+# - Inline keyboard buttons are dispatched by their callback data.
+#
+# @section notes_menu Notes
+# - Menu state is held in a bounded LRU; a user the LRU forgot starts over in
+#   the root menu.
+
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, Update)
+from telegram.ext import ContextTypes
+
+from bot import metrics
+from bot.send_queue import send_message
+from util.constants import MenuConstants
+
+log = logging.getLogger(__name__)
+
+Action = Callable[..., Awaitable]
+
+
+class Button():
+    """! A menu button that runs an action, opens a menu, or both."""
+
+    def __init__(self, label: str, action: Optional[Action] = None, menu: Optional[str] = None,
+                 callback_data: Optional[str] = None, inline: Optional[str] = None):
+        """! Button constructor.
+        @param label text of the button
+        @param action coroutine function called with (update, context)
+        @param menu name of the menu opened after the action
+        @param callback_data callback data of the button in an inline keyboard
+        @param inline name of an inline menu passed to the action as reply_markup
+        """
+        self.label = label
+        self.action = action
+        self.menu = menu
+        self.callback_data = callback_data
+        self.inline = inline
+
+
+class Menu():
+    """! A named menu; rows of buttons shown as a reply keyboard, or as an inline keyboard if inline is True."""
+
+    def __init__(self, name: str, title: str, rows: List[List[Button]], inline: bool = False):
+        self.name = name
+        self.title = title
+        self.rows = rows
+        self.inline = inline
+
+
+class MenuRouter():
+    """! Dispatches button presses of a menu tree to their actions."""
+
+    def __init__(self, menus: List[Menu], root: str, state_size: int = MenuConstants.STATE_SIZE):
+        self.menus: Dict[str, Menu] = {menu.name: menu for menu in menus}
+        self.root = root
+        self.state_size = state_size
+        self._state: 'OrderedDict[int, str]' = OrderedDict()
+        self._keyboards = {}
+        self._buttons: Dict[str, Dict[str, Button]] = {}
+        self._labels: Dict[str, Button] = {}
+        self._callbacks: Dict[str, Button] = {}
+        for menu in menus:
+            if menu.inline:
+                self._keyboards[menu.name] = InlineKeyboardMarkup([
+                    [InlineKeyboardButton(button.label, callback_data=button.callback_data) for button in row]
+                    for row in menu.rows
+                ])
+                self._callbacks.update({button.callback_data: button for row in menu.rows for button in row})
+            else:
+                self._keyboards[menu.name] = ReplyKeyboardMarkup([[KeyboardButton(button.label) for button in row]
+                                                                  for row in menu.rows], resize_keyboard=True)
+                self._buttons[menu.name] = {button.label: button for row in menu.rows for button in row}
+                for label, button in self._buttons[menu.name].items():
+                    self._labels.setdefault(label, button)
+
+    @property
+    def labels(self) -> List[str]:
+        """! Labels of all reply keyboard buttons, e.g. for a filters.Text filter."""
+        return list(self._labels)
+
+    def keyboard(self, name: str):
+        """! Getter for the prebuilt markup of a menu.
+        @return ReplyKeyboardMarkup or InlineKeyboardMarkup
+        """
+        return self._keyboards[name]
+
+    def get_menu(self, user_id: int) -> str:
+        """! Getter for the name of the menu a user is in.
+        @return menu name, the root menu for unknown users
+        """
+        name = self._state.get(user_id)
+        if name is None:
+            return self.root
+        self._state.move_to_end(user_id)
+        return name
+
+    def set_menu(self, user_id: int, name: str):
+        """! Setter for the menu a user is in; forgets the least recently active user beyond state_size users.
+        @return None
+        """
+        self._state[user_id] = name
+        self._state.move_to_end(user_id)
+        if len(self._state) > self.state_size:
+            self._state.popitem(last=False)
+
+    async def open_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, name: str):
+        """! Move the user to a menu and send its title with its keyboard.
+        @return None
+        """
+        self.set_menu(update.effective_user.id, name)
+        menu = self.menus[name]
+        await send_message(context, update.effective_chat.id, menu.title, reply_markup=self._keyboards[name])
+
+    async def _press(self, update: Update, context: ContextTypes.DEFAULT_TYPE, button: Button):
+        if button.action is not None:
+            if button.inline is not None:
+                await button.action(update, context, reply_markup=self._keyboards[button.inline])
+            else:
+                await button.action(update, context)
+        if button.menu is not None:
+            await self.open_menu(update, context, button.menu)
+
+    @metrics.handler
+    async def handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """! Command callback opening the root menu.
+        @return None
+        """
+        await self.open_menu(update, context, self.root)
+
+    @metrics.handler
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """! Message callback dispatching a reply keyboard button by its label.
+        @return None
+        """
+        label = update.message.text
+        button = self._buttons[self.get_menu(update.effective_user.id)].get(label) or self._labels.get(label)
+        if button is None:
+            log.debug('No menu button labeled %r.', label)
+            return
+        await self._press(update, context, button)
+
+    @metrics.handler
+    async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """! CallbackQuery callback dispatching an inline keyboard button by its callback data.
+        @return None
+        """
+        query = update.callback_query
+        await query.answer()
+        button = self._callbacks.get(query.data)
+        if button is None:
+            log.debug('No inline button with callback data %r.', query.data)
+            return
+        await self._press(update, context, button)
@@ -0,0 +1,245 @@
+"""! @brief Counters and latency histograms, served in the Prometheus text format."""
+##
+# @file metrics.py
+# @package bot
+# @brief Counters and latency histograms, served in the Prometheus text format.
+#
+# @section description_metrics Description
+# A small in-process metrics registry covering the command and menu handlers,
+# the Helium API routes, DB transactions and the ZODB object cache. With
+# METRICS_ENABLED set, the metrics are served from a local aiohttp endpoint
+# in the Prometheus text exposition format.
+#
+# @section notes_metrics Notes
+# - Metrics are enabled by configure(), which init_bot() calls with its
+#   config. While they are disabled, every call site is skipped behind a
+#   single check of ENABLED.
+# - Metrics are updated from the event loop and from the DB threads, so
+#   every metric guards its values with a lock.
+
+import bisect
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from util.constants import MetricsConstants
+
+log = logging.getLogger(__name__)
+
+ENABLED = False
+
+
+def configure(config: dict):
+    """! Enable or disable the metrics with the METRICS_ENABLED key of config.
+    @param config secrets/config dictionary
+    @return None
+    """
+    global ENABLED
+    ENABLED = str(config.get('METRICS_ENABLED', MetricsConstants.ENABLED)).lower() == 'true'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter():
+    """! Monotonic counter with labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        """! Add amount to the counter of the given label values.
+        @return None
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        """! Getter for the counter of the given label values.
+        @return float
+        """
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield '{}{} {}'.format(self.name, _format_labels(self.labelnames, labels), value)
+
+
+class Histogram():
+    """! Histogram with labels and fixed upper bucket bounds, in seconds by default."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = MetricsConstants.BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        """! Record one observation for the given label values.
+        @return None
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def get_count(self, *labels) -> int:
+        """! Getter for the number of observations of the given label values.
+        @return int
+        """
+        with self._lock:
+            values = self._values.get(labels)
+            return int(values[-1]) if values else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(self.name, _format_labels(self.labelnames, labels, 'le="{}"'.format(bound)), cumulative)
+            yield '{}_bucket{} {}'.format(self.name, _format_labels(self.labelnames, labels, 'le="+Inf"'), int(counts[-1]))
+            yield '{}_sum{} {}'.format(self.name, _format_labels(self.labelnames, labels), counts[-2])
+            yield '{}_count{} {}'.format(self.name, _format_labels(self.labelnames, labels), int(counts[-1]))
+
+
+class GaugeFunc():
+    """! Gauge whose value is read from a function when the metrics are collected."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, func: Callable[[], Optional[float]]):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self) -> Iterable[str]:
+        try:
+            value = self.func()
+        except Exception:
+            log.exception('Reading gauge %s failed.', self.name)
+            return
+        if value is not None:
+            yield '{} {}'.format(self.name, value)
+
+
+REGISTRY: List = []
+
+def register(metric):
+    """! Add a metric to the registry.
+    @return the metric
+    """
+    REGISTRY.append(metric)
+    return metric
+
+def render() -> str:
+    """! All registered metrics in the Prometheus text exposition format.
+    @return str
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+HANDLER_SECONDS = register(Histogram('bot_handler_seconds', 'Duration of command and menu handlers.', ['handler']))
+HANDLER_ERRORS = register(Counter('bot_handler_errors_total', 'Handler calls that raised.', ['handler']))
+HELIUM_SECONDS = register(Histogram('bot_helium_request_seconds', 'Duration of Helium API requests.', ['route']))
+HELIUM_RESPONSES = register(Counter('bot_helium_responses_total', 'Helium API responses by status code, "error" if no response.',
+                                    ['route', 'status']))
+DB_TRANSACTION_SECONDS = register(Histogram('bot_db_transaction_seconds', 'Duration of DBManager.transact calls, retries included.',
+                                            ['function']))
+DB_COMMITS = register(Counter('bot_db_commits_total', 'Committed units of work.'))
+DB_CONFLICTS = register(Counter('bot_db_conflicts_total', 'ConflictErrors raised in DBManager.transact.', ['function']))
+ZODB_LOADS = register(Counter('bot_zodb_object_loads_total', 'Objects loaded from the storage, i.e. object cache misses.'))
+ZODB_STORES = register(Counter('bot_zodb_object_stores_total', 'Objects written to the storage.'))
+
+
+def _zodb_cache_objects() -> Optional[int]:
+    from bot.db.db import get_db, is_db_open
+    return get_db().cacheSize() if is_db_open() else None
+
+register(GaugeFunc('bot_zodb_cache_objects', 'Non-ghost objects in the object caches of all DB connections.', _zodb_cache_objects))
+
+
+def handler(func: Callable) -> Callable:
+    """! Decorator timing a handler coroutine and counting its errors. Handlers are decorated at import, before
+    configure() runs, so whether metrics are enabled is checked on every call.
+    @return coroutine function
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def timed(*args, **kwargs):
+        if not ENABLED:
+            return await func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return timed
+
+
+async def _serve(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={'Content-Type': MetricsConstants.CONTENT_TYPE})
+
+async def start_server(config: dict) -> Optional[web.AppRunner]:
+    """! Serve the metrics on METRICS_LISTEN:METRICS_PORT under /metrics, if metrics are enabled.
+    @param config dictionary with optional METRICS_* keys
+    @return AppRunner to pass to stop_server(), None if metrics are disabled
+    """
+    if not ENABLED:
+        return None
+    listen = config.get('METRICS_LISTEN', MetricsConstants.LISTEN)
+    port = int(config.get('METRICS_PORT', MetricsConstants.PORT))
+    app = web.Application()
+    app.router.add_get(MetricsConstants.PATH, _serve)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    log.info('Serving metrics on http://%s:%s%s', listen, port, MetricsConstants.PATH)
+    return runner
+
+async def stop_server(runner: Optional[web.AppRunner]):
+    """! Stop a metrics server started by start_server().
+    @return None
+    """
+    if runner is not None:
+        await runner.cleanup()
@@ -0,0 +1,148 @@
+"""! @brief Push notifications about new hotspot events."""
+##
+# @file notifications.py
+# @package bot
+# @brief Push notifications about new hotspot events.
+#
+# @section description_notifications Description
+# After every activity sync the new roles of a hotspot and its online status
+# are diffed against the last known state. The resulting events are rendered
+# into one message per hotspot, which is then queued for every user subscribed
+# to the hotspot whose notifications are not snoozed.
+#
+# @section notes_notifications Notes
+# - Snoozes are kept in SnoozeIndex, so muted users are filtered out with one
+#   O(log n) lookup per subscriber instead of a scan over all users.
+# - Notifications are queued with notification priority and never wait for
+#   the send, interactive replies go first.
+
+import logging
+import time
+from typing import Dict, List, Optional
+
+from telegram.ext import ContextTypes
+
+from bot.db.AsyncDBManager import AsyncDBManager
+from bot.db.DBManager import DBManager
+from bot.db.SnoozeIndex import SnoozeIndex
+from bot.send_queue import get_send_queue
+from util.constants import DbConstants, NotificationConstants, SendQueueConstants
+from util.read_secrets import read_secrets
+
+_config: Optional[dict] = None
+log = logging.getLogger(__name__)
+
+
+def configure(config: dict):
+    """! Use config instead of secrets.json for NOTIFY_SNOOZE_HOURS.
+    @param config secrets/config dictionary
+    @return None
+    """
+    global _config
+    _config = config
+
+def _get_config() -> dict:
+    """! Internal getter for the config set by configure(), secrets.json until then.
+    @return dict
+    """
+    return read_secrets() if _config is None else _config
+
+
+def diff_events(new_roles: List[dict], old_status: Optional[str], status: Optional[str]) -> Dict[str, object]:
+    """! Events of a hotspot since its last sync.
+    @param new_roles roles of the hotspot newer than its last sync
+    @param old_status online status at the last sync, None if unknown
+    @param status current online status, None if unknown
+    @return dict of event kind to count, plus a 'status' key if the online status changed; empty if nothing happened
+    """
+    events = {}
+    for role in new_roles:
+        kind = NotificationConstants.ROLE_KINDS.get(role.get('role'))
+        if kind is not None:
+            events[kind] = events.get(kind, 0) + 1
+    if old_status is not None and status is not None and status != old_status:
+        events['status'] = status
+    return events
+
+def render_events(hotspot_name: str, events: Dict[str, object]) -> str:
+    """! Notification text for the events of a hotspot.
+    @param hotspot_name animal name or address of the hotspot
+    @param events see diff_events()
+    @return message text
+    """
+    lines = ['Hotspot {}:'.format(hotspot_name)]
+    if events.get('status') == NotificationConstants.STATUS_OFFLINE:
+        lines.append('- went offline')
+    elif events.get('status') == NotificationConstants.STATUS_ONLINE:
+        lines.append('- is back online')
+    labels = [
+        (NotificationConstants.KIND_REWARD, 'new rewards'),
+        (NotificationConstants.KIND_WITNESS, 'new witnesses'),
+        (NotificationConstants.KIND_BEACON, 'new beacons'),
+    ]
+    for kind, label in labels:
+        if events.get(kind):
+            lines.append('- {} {}'.format(events[kind], label))
+    return '\n'.join(lines)
+
+def get_notification_targets(hotspot_address: str, now: int):
+    """! Users subscribed to a hotspot whose notifications are not snoozed, and the name of the hotspot.
+    @param now current epoch time
+    @return tuple of (sorted list of telegram user ids, hotspot name)
+    """
+    with DBManager.connection() as connection:
+        hotspots = list(DBManager.iter_records_by(connection, DbConstants.TREE_NAME_HOTSPOTS, 'hotspot_address', hotspot_address))
+        user_ids = {subscription.telegram_user_id for subscription in DBManager.iter_hotspot_subscriptions(connection, hotspot_address)}
+        user_ids -= SnoozeIndex.muted(connection, user_ids, now)
+        name = next((hotspot.animal_name for hotspot in hotspots if hotspot.animal_name), hotspot_address)
+        return sorted(user_ids), name
+
+def _log_failed_send(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.debug('Notification was not sent: %s', future.exception())
+
+async def notify_hotspot_events(context: ContextTypes.DEFAULT_TYPE, hotspot_address: str, events: Dict[str, object]) -> int:
+    """! Queue a notification about the events of a hotspot for all of its subscribers.
+    The message is rendered once and shared by all of them.
+    @param context callback context of the sync job
+    @return number of users notified
+    """
+    if not events:
+        return 0
+    user_ids, name = await AsyncDBManager.run(get_notification_targets, hotspot_address, int(time.time()))
+    if not user_ids:
+        return 0
+    text = render_events(name, events)
+    queue = get_send_queue(context)
+    for user_id in user_ids:
+        # private chat ids equal the user ids
+        if queue is not None:
+            queue.submit(user_id, 'send_message', SendQueueConstants.PRIORITY_NOTIFICATION, text=text).add_done_callback(_log_failed_send)
+        else:
+            await context.bot.send_message(chat_id=user_id, text=text)
+    log.debug('Notified %s users about hotspot %s: %s', len(user_ids), hotspot_address, events)
+    return len(user_ids)
+
+async def snooze_notifications(telegram_user_id: int, hours: Optional[float] = None) -> int:
+    """! Mute the notifications of a user for the given number of hours.
+    @param hours length of the snooze, NOTIFY_SNOOZE_HOURS by default
+    @return epoch time the snooze ends
+    """
+    if hours is None:
+        hours = float(_get_config().get('NOTIFY_SNOOZE_HOURS', NotificationConstants.SNOOZE_HOURS))
+    until = int(time.time() + hours * 3600)
+    await AsyncDBManager.run_write(DBManager.transact, SnoozeIndex.snooze, telegram_user_id, until)
+    return until
+
+async def resume_notifications(telegram_user_id: int) -> bool:
+    """! End the snooze of a user.
+    @return True if the user was snoozed
+    """
+    return await AsyncDBManager.run_write(DBManager.transact, SnoozeIndex.unsnooze, telegram_user_id)
+
+def get_snoozed_until(telegram_user_id: int) -> Optional[int]:
+    """! Getter for the end of the snooze of a user.
+    @return epoch time the snooze ends, None if the user is not snoozed
+    """
+    with DBManager.connection() as connection:
+        return SnoozeIndex.get_until(connection, telegram_user_id, int(time.time()))
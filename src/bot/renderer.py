@@ -0,0 +1,237 @@
+"""! @brief Templated MarkdownV2 rendering of Helium API responses."""
+##
+# @file renderer.py
+# @package bot
+# @brief Templated MarkdownV2 rendering of Helium API responses.
+#
+# @section description_renderer Description
+# Every endpoint the bot answers with has a Template, declared once as a list
+# of fields with their escaped labels precomputed. Rendering looks up the
+# fields in the response, escapes the values for MarkdownV2, joins the lines
+# in one pass and splits the result at Telegram's message size limit.
+#
+# @section notes_renderer Notes
+# - Rendered messages are memoized in an LRU keyed by a hash of the payload,
+#   so a response served from the ResponseCache to many users is rendered
+#   only once.
+# - Templates only produce entities within a single line, so splitting at
+#   line breaks never cuts an entity in two.
+
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes
+
+from bot.send_queue import send_message
+from util.constants import RendererConstants
+from util.request_formatter import escape_markdown_v2, split_message
+from util.time_helper import format_utc_time
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return '{:,.2f}'.format(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return '{:,}'.format(value)
+    return str(value)
+
+def _time(value) -> str:
+    return format_utc_time(value) if isinstance(value, (int, float)) else str(value)
+
+
+class Field():
+    """! A value of the response shown on its own line, or as a part of an item line."""
+
+    def __init__(self, label: Optional[str], path: str, fmt: Callable[[Any], str] = str):
+        """! Field constructor.
+        @param label label shown in bold before the value, None for no label
+        @param path dot separated keys of the value in the response data
+        @param fmt converts the value to text before escaping
+        """
+        self.keys = tuple(path.split('.'))
+        self.fmt = fmt
+        self.prefix = '*{}:* '.format(escape_markdown_v2(label)) if label else ''
+
+    def lookup(self, data: dict):
+        """! Value of the field in data.
+        @return the value, _MISSING if any key on the path is absent
+        """
+        for key in self.keys:
+            if not isinstance(data, dict) or data.get(key) is None:
+                return _MISSING
+            data = data[key]
+        return data
+
+    def render(self, data: dict) -> Optional[str]:
+        """! Escaped text of the field, None if the value is missing.
+        @return str or None
+        """
+        value = self.lookup(data)
+        if value is _MISSING:
+            return None
+        return self.prefix + escape_markdown_v2(self.fmt(value))
+
+
+class Template():
+    """! Rendering of the 'data' of one endpoint: a bold title, one line per field and, for list
+    responses, one line per item built from item_fields.
+    """
+
+    def __init__(self, title: str, fields: Sequence[Field] = (), item_fields: Sequence[Field] = (),
+                 empty: str = 'No data.', max_items: int = RendererConstants.MAX_ITEMS):
+        """! Template constructor.
+        @param title title format string; its arguments are passed to render()
+        @param fields fields of a dict response
+        @param item_fields fields of every item of a list response, joined into one line
+        @param empty text shown when there is nothing to show
+        @param max_items items shown of a list response, the rest is summarized
+        """
+        self.title = title
+        self.fields = tuple(fields)
+        self.item_fields = tuple(item_fields)
+        self.empty = escape_markdown_v2(empty)
+        self.max_items = max_items
+
+    def render(self, payload: dict, **args) -> str:
+        """! Render a response.
+        @param payload response with a 'data' dict or list
+        @param args arguments of the title
+        @return MarkdownV2 text
+        """
+        data = payload.get('data') if isinstance(payload, dict) else None
+        lines = ['*{}*'.format(escape_markdown_v2(self.title.format(**args)))]
+        if isinstance(data, list):
+            for item in data[:self.max_items]:
+                lines.append(' · '.join(text for text in (field.render(item) for field in self.item_fields) if text))
+            if len(data) > self.max_items:
+                lines.append(escape_markdown_v2('… and {} more'.format(len(data) - self.max_items)))
+        elif isinstance(data, dict):
+            lines.extend(text for text in (field.render(data) for field in self.fields) if text)
+        if len(lines) == 1:
+            lines.append(self.empty)
+        return '\n'.join(lines)
+
+
+_ACTIVITY_FIELDS = (
+    Field(None, 'time', _time),
+    Field(None, 'role'),
+    Field(None, 'type'),
+    Field('block', 'height', _number),
+)
+
+TEMPLATES: Dict[str, Template] = {
+    RendererConstants.TEMPLATE_STATS: Template('Helium blockchain stats', [
+        Field('Hotspots', 'counts.hotspots', _number),
+        Field('Validators', 'counts.validators', _number),
+        Field('Blocks', 'counts.blocks', _number),
+        Field('Transactions', 'counts.transactions', _number),
+        Field('Avg block time, last hour (s)', 'block_times.last_hour.avg', _number),
+        Field('Avg block time, last day (s)', 'block_times.last_day.avg', _number),
+        Field('Active challenges', 'challenge_counts.active', _number),
+        Field('Token supply', 'token_supply', _number),
+    ]),
+    RendererConstants.TEMPLATE_TOKEN_SUPPLY: Template('Token supply', [
+        Field('HNT', 'token_supply', _number),
+    ]),
+    RendererConstants.TEMPLATE_HOTSPOT: Template('Hotspot', [
+        Field('Name', 'name'),
+        Field('Address', 'address'),
+        Field('Owner', 'owner'),
+        Field('Status', 'status.online'),
+        Field('City', 'geocode.long_city'),
+        Field('Country', 'geocode.long_country'),
+        Field('Reward scale', 'reward_scale', _number),
+        Field('Elevation', 'elevation', _number),
+        Field('Gain', 'gain', _number),
+        Field('Added at block', 'block_added', _number),
+    ]),
+    RendererConstants.TEMPLATE_ACTIVITY: Template('Hotspot activity', item_fields=_ACTIVITY_FIELDS, empty='No activity.'),
+    RendererConstants.TEMPLATE_RECENT_ACTIVITY: Template('Hotspot activity of the last {hours} hours',
+                                                         item_fields=_ACTIVITY_FIELDS, empty='No activity.'),
+    RendererConstants.TEMPLATE_SUMMARY: Template('Hotspot activity summary', item_fields=[
+        Field(None, 'window'),
+        Field('rewards', 'rewards', _number),
+        Field('witnesses', 'witnesses', _number),
+        Field('beacons', 'beacons', _number),
+        Field('challenges', 'challenges', _number),
+        Field('data', 'data', _number),
+        Field('total', 'total', _number),
+    ]),
+}
+
+
+class Renderer():
+    """! Renders responses with the TEMPLATES and memoizes the split messages in an LRU keyed by template,
+    title arguments and payload hash.
+    """
+
+    def __init__(self, templates: Dict[str, Template] = TEMPLATES, max_size: int = RendererConstants.CACHE_SIZE,
+                 limit: int = RendererConstants.MESSAGE_LIMIT):
+        self.templates = templates
+        self.max_size = max_size
+        self.limit = limit
+        self._entries: 'OrderedDict[Tuple[str, bytes], Tuple[str, ...]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def payload_hash(payload, args: dict) -> bytes:
+        """! Stable hash of a payload and the title arguments.
+        @return 16 byte digest
+        """
+        dump = json.dumps([payload, args], sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.blake2b(dump.encode(), digest_size=16).digest()
+
+    def render(self, name: str, payload, **args) -> Tuple[str, ...]:
+        """! Render a response into messages no longer than the message limit.
+        @param name template name, one of RendererConstants.TEMPLATE_*
+        @param payload API response
+        @param args arguments of the template title
+        @return tuple of MarkdownV2 message texts
+        """
+        key = (name, Renderer.payload_hash(payload, args))
+        messages = self._entries.get(key)
+        if messages is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return messages
+        self.misses += 1
+        messages = tuple(split_message(self.templates[name].render(payload, **args), self.limit))
+        self._entries[key] = messages
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return messages
+
+    def stats(self) -> dict:
+        """! Memo cache counters.
+        @return dict with size, hits and misses
+        """
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_renderer = Renderer()
+
+def get_renderer() -> Renderer:
+    """! Getter for the renderer shared by all handlers.
+    @return Renderer
+    """
+    return _renderer
+
+async def send_rendered(context: ContextTypes.DEFAULT_TYPE, chat_id: int, name: str, payload, **args):
+    """! Render a response and send it as one or more MarkdownV2 messages, in order.
+    @param name template name, one of RendererConstants.TEMPLATE_*
+    @param args arguments of the template title
+    @return list of the sent Messages
+    """
+    sent = []
+    for text in _renderer.render(name, payload, **args):
+        sent.append(await send_message(context, chat_id, text, parse_mode=ParseMode.MARKDOWN_V2))
+    return sent
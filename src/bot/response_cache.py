@@ -0,0 +1,156 @@
+"""! @brief Async TTL response cache with single-flight request coalescing."""
+##
+# @file response_cache.py
+# @package bot
+# @brief Async TTL response cache with single-flight request coalescing.
+#
+# @section description_response_cache Description
+# Bounded LRU cache for decoded Helium API responses. Entries expire after a
+# per-route TTL, and concurrent callers asking for the same key while an
+# upstream fetch is running await that one fetch instead of issuing their own.
+# Expired entries are kept for up to max_stale seconds and served as last
+# known good value if the fetch replacing them fails.
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from util.constants import CacheConstants
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache():
+    """! LRU cache with per-entry expiry and in-flight request coalescing."""
+
+    def __init__(self, max_size: int = CacheConstants.MAX_SIZE, route_ttls: Optional[Dict[str, float]] = None,
+                 max_stale: float = CacheConstants.MAX_STALE):
+        self.max_size = max_size
+        self.max_stale = max_stale
+        self.route_ttls = dict(route_ttls or {})
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale_served = 0
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """! Build a cache from the secrets/config dictionary, falling back to CacheConstants defaults.
+        @param config dictionary with optional CACHE_* keys
+        @return ResponseCache
+        """
+        return cls(
+            max_size=int(config.get('CACHE_MAX_SIZE', CacheConstants.MAX_SIZE)),
+            max_stale=float(config.get('CACHE_MAX_STALE', CacheConstants.MAX_STALE)),
+            route_ttls={
+                CacheConstants.ROUTE_STATS: float(config.get('CACHE_TTL_STATS', CacheConstants.TTL_STATS)),
+                CacheConstants.ROUTE_TOKEN_SUPPLY: float(config.get('CACHE_TTL_TOKEN_SUPPLY', CacheConstants.TTL_TOKEN_SUPPLY)),
+                CacheConstants.ROUTE_HOTSPOT: float(config.get('CACHE_TTL_HOTSPOT', CacheConstants.TTL_HOTSPOT)),
+            }
+        )
+
+    def ttl_for(self, route: str) -> float:
+        """! TTL in seconds configured for a route, 0 if the route is not cached.
+        @param route route name, one of the CacheConstants.ROUTE_* values
+        @return float
+        """
+        return self.route_ttls.get(route, 0)
+
+    async def get(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]):
+        """! Return the cached value for key, or fetch it once for all concurrent callers.
+        @param key cache key, usually the full request URL
+        @param ttl seconds the fetched value stays fresh; 0 disables storing it
+        @param fetch coroutine factory performing the upstream request
+        @return cached or freshly fetched value, or the expired value if fetching fails
+        """
+        stale = None
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = time.monotonic()
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry[0] + self.max_stale > now:
+                stale = entry
+            else:
+                del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # the cache owns the fetch, so cancelling any of its callers does not cancel it for the others
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(key, ttl, fetch, stale))
+            task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]], stale: Optional[tuple]):
+        """! Internal method performing the upstream fetch shared by all callers of key.
+        @return fetched value, or the expired value if fetching fails
+        """
+        try:
+            value = await fetch()
+        except Exception as e:
+            if stale is None:
+                raise
+            log.info('Serving a stale response for %s: %s', key, e)
+            self.stale_served += 1
+            return stale[1]
+        if ttl > 0:
+            self._store(key, value, ttl)
+        return value
+
+    def _done(self, key: str, task: asyncio.Future):
+        """! Internal callback dropping a finished fetch from the in-flight requests.
+        @return None
+        """
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # mark as retrieved in case every caller was cancelled
+            task.exception()
+
+    def _store(self, key: str, value: Any, ttl: float):
+        """! Internal method that inserts an entry and evicts least recently used ones above max_size.
+        @return None
+        """
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str):
+        """! Drop a single entry from the cache.
+        @return None
+        """
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """! Drop all entries from the cache. Counters are kept.
+        @return None
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """! Snapshot of cache counters for TTL tuning.
+        @return dict with hits, misses, coalesced, evictions, stale_served, size and hit_ratio
+        """
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'stale_served': self.stale_served,
+            'size': len(self._entries),
+            'inflight': len(self._inflight),
+            'hit_ratio': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,329 @@
+"""! @brief Rate-limit-aware outbound Telegram send queue."""
+##
+# @file send_queue.py
+# @package bot
+# @brief Rate-limit-aware outbound Telegram send queue.
+#
+# @section description_send_queue Description
+# All outgoing Bot API calls go through one queue. Worker tasks take
+# requests in priority order (interactive replies before bulk notifications)
+# and send them once a global token bucket and the token bucket of the
+# target chat allow it, so the bot stays below Telegram's limits of roughly
+# 30 messages per second overall and 1 message per second per chat.
+#
+# @section notes_send_queue Notes
+# - A request whose chat bucket is empty is put back with a delay instead of
+#   blocking a worker, so one busy chat does not hold up the others.
+# - On RetryAfter (HTTP 429) all sending pauses for the given time and the
+#   request is retried.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+
+from bot.token_bucket import TokenBucket
+from util.constants import SendQueueConstants
+
+log = logging.getLogger(__name__)
+
+
+class SendRequest():
+    """! One queued Bot API call."""
+
+    __slots__ = ('chat_id', 'method', 'kwargs', 'priority', 'sequence', 'future', 'enqueued', 'attempts')
+
+    def __init__(self, chat_id: int, method: str, kwargs: dict, priority: int, sequence: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class SendQueue():
+    """! Priority queue of Bot API calls drained by worker tasks within the global and per-chat rate limits."""
+
+    def __init__(self, bot: Bot, global_rate: float = SendQueueConstants.GLOBAL_RATE,
+                 global_burst: float = SendQueueConstants.GLOBAL_BURST, chat_rate: float = SendQueueConstants.CHAT_RATE,
+                 chat_burst: float = SendQueueConstants.CHAT_BURST, workers: int = SendQueueConstants.WORKERS,
+                 max_retries: int = SendQueueConstants.MAX_RETRIES, max_chats: int = SendQueueConstants.MAX_CHATS):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets: 'OrderedDict[int, TokenBucket]' = OrderedDict()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._depths: Dict[int, int] = {}
+        self._busy: Dict[int, SendRequest] = {}
+        self._waiting: Dict[int, list] = {}
+        self._delayed: Dict[SendRequest, asyncio.TimerHandle] = {}
+        self._latencies = deque(maxlen=SendQueueConstants.LATENCY_SAMPLES)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rate_limited = 0
+
+    @classmethod
+    def from_config(cls, bot: Bot, config: dict):
+        """! Build a send queue from the secrets/config dictionary, falling back to SendQueueConstants defaults.
+        @param bot Bot the requests are sent with
+        @param config dictionary with optional SEND_* keys
+        @return SendQueue
+        """
+        return cls(
+            bot,
+            global_rate=float(config.get('SEND_GLOBAL_RATE', SendQueueConstants.GLOBAL_RATE)),
+            global_burst=float(config.get('SEND_GLOBAL_BURST', SendQueueConstants.GLOBAL_BURST)),
+            chat_rate=float(config.get('SEND_CHAT_RATE', SendQueueConstants.CHAT_RATE)),
+            chat_burst=float(config.get('SEND_CHAT_BURST', SendQueueConstants.CHAT_BURST)),
+            workers=int(config.get('SEND_WORKERS', SendQueueConstants.WORKERS)),
+            max_retries=int(config.get('SEND_MAX_RETRIES', SendQueueConstants.MAX_RETRIES)),
+        )
+
+    @property
+    def running(self) -> bool:
+        """! True between start() and stop()."""
+        return bool(self._tasks)
+
+    async def start(self):
+        """! Start the worker tasks; call from within the running event loop.
+        @return None
+        """
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker(), name='send-queue-{}'.format(i)) for i in range(self.workers)]
+        log.info('Send queue started with %s workers.', self.workers)
+
+    async def stop(self, timeout: float = SendQueueConstants.DRAIN_TIMEOUT):
+        """! Wait up to timeout seconds for queued requests to be sent, then cancel the workers.
+        Requests still queued after that fail with asyncio.CancelledError.
+        @return None
+        """
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            log.warning('Send queue did not drain in %ss, dropping %s requests.', timeout, self.stats()['depth'])
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        dropped = []
+        while not self._queue.empty():
+            dropped.append(self._queue.get_nowait()[2])
+        dropped += [entry[2] for waiting in self._waiting.values() for entry in waiting]
+        dropped += list(self._busy.values())
+        for timer in self._delayed.values():
+            timer.cancel()
+        self._delayed.clear()
+        for request in dropped:
+            if not request.future.done():
+                request.future.cancel()
+        self._waiting.clear()
+        self._busy.clear()
+        log.info('Send queue stopped: %s', self.stats())
+
+    async def _drain(self):
+        """! Wait until no request is queued, in progress or waiting to be put back."""
+        while True:
+            await self._queue.join()
+            if not self._delayed:
+                return
+            await asyncio.sleep(0.05)
+
+    def submit(self, chat_id: int, method: str = 'send_message', priority: int = SendQueueConstants.PRIORITY_INTERACTIVE,
+               **kwargs) -> asyncio.Future:
+        """! Queue a Bot API call.
+        @param chat_id target chat, used for the per-chat rate limit and passed on as chat_id
+        @param method name of the Bot method, e.g. 'send_message'
+        @param priority lower values are sent first, see SendQueueConstants.PRIORITY_*
+        @param kwargs further arguments of the Bot method
+        @return future resolving to the result of the call
+        """
+        if not self.running:
+            raise RuntimeError('Send queue is not running.')
+        request = SendRequest(chat_id, method, kwargs, priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        self._put(request)
+        return request.future
+
+    async def send(self, chat_id: int, method: str = 'send_message', priority: int = SendQueueConstants.PRIORITY_INTERACTIVE,
+                   **kwargs) -> Any:
+        """! Queue a Bot API call and wait until it was sent.
+        @return result of the call, e.g. the sent Message
+        """
+        return await self.submit(chat_id, method, priority, **kwargs)
+
+    def _put(self, request: SendRequest):
+        if not self.running:
+            # put back after stop()
+            request.future.cancel()
+            return
+        self._depths[request.priority] = self._depths.get(request.priority, 0) + 1
+        self._queue.put_nowait((request.priority, request.sequence, request))
+
+    def _put_later(self, request: SendRequest, delay: float):
+        """! Put a request back on the queue after delay seconds without occupying a worker meanwhile."""
+        def put():
+            del self._delayed[request]
+            self._put(request)
+        self._delayed[request] = asyncio.get_running_loop().call_later(delay, put)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > self.max_chats:
+                # forget the least recently used chat, its bucket has most likely refilled already
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _release(self, chat_id: int):
+        """! Let the next waiting request of a chat go, after the current one was sent or failed."""
+        del self._busy[chat_id]
+        waiting = self._waiting.get(chat_id)
+        if waiting:
+            # it keeps its sequence number, so it is taken before later requests of the chat
+            self._put(heapq.heappop(waiting)[2])
+            if not waiting:
+                del self._waiting[chat_id]
+
+    async def _worker(self):
+        while True:
+            _, _, request = await self._queue.get()
+            self._depths[request.priority] -= 1
+            try:
+                busy = self._busy.get(request.chat_id)
+                if busy is not None and busy is not request:
+                    # one request per chat at a time keeps the messages of a chat in order
+                    heapq.heappush(self._waiting.setdefault(request.chat_id, []), (request.priority, request.sequence, request))
+                    continue
+                self._busy[request.chat_id] = request
+                done = True
+                try:
+                    done = await self._process(request)
+                finally:
+                    if done:
+                        self._release(request.chat_id)
+            except Exception:
+                log.exception('Unexpected error in the send queue.')
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, request: SendRequest) -> bool:
+        """! Send a request once the rate limits allow it.
+        @return True if the request is finished, False if it was put back to be sent later
+        """
+        if request.future.done():
+            # cancelled by the caller meanwhile
+            return True
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        chat_wait = self._chat_bucket(request.chat_id).take()
+        if chat_wait > 0:
+            self._put_later(request, chat_wait)
+            return False
+        global_wait = self._global_bucket.take()
+        while global_wait > 0:
+            await asyncio.sleep(global_wait)
+            global_wait = self._global_bucket.take()
+
+        request.attempts += 1
+        try:
+            result = await getattr(self.bot, request.method)(chat_id=request.chat_id, **request.kwargs)
+        except RetryAfter as error:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + error.retry_after)
+            log.warning('Flood control hit, pausing sends for %ss.', error.retry_after)
+            return self._retry(request, error, error.retry_after)
+        except (BadRequest, Forbidden) as error:
+            return self._fail(request, error)
+        except TelegramError as error:
+            return self._retry(request, error, SendQueueConstants.RETRY_BACKOFF * request.attempts)
+        except Exception as error:
+            return self._fail(request, error)
+        self.sent += 1
+        self._latencies.append(time.monotonic() - request.enqueued)
+        if not request.future.done():
+            request.future.set_result(result)
+        return True
+
+    def _retry(self, request: SendRequest, error: Exception, delay: float) -> bool:
+        if request.attempts > self.max_retries:
+            return self._fail(request, error)
+        self.retried += 1
+        self._put_later(request, delay)
+        return False
+
+    def _fail(self, request: SendRequest, error: Exception) -> bool:
+        self.failed += 1
+        log.warning('Sending %s to chat %s failed: %s', request.method, request.chat_id, error)
+        if not request.future.done():
+            request.future.set_exception(error)
+        return True
+
+    def stats(self) -> dict:
+        """! Queue depth per priority and send counters; latency is measured from submit() to the sent call.
+        @return dict
+        """
+        latencies = sorted(self._latencies)
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))], 3) if latencies else None
+        return {
+            'depth': sum(self._depths.values()) + len(self._delayed) + sum(len(waiting) for waiting in self._waiting.values()),
+            'depth_by_priority': {priority: depth for priority, depth in sorted(self._depths.items()) if depth},
+            'delayed': len(self._delayed),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'rate_limited': self.rate_limited,
+            'latency_p50': percentile(0.5),
+            'latency_p95': percentile(0.95),
+            'latency_max': round(latencies[-1], 3) if latencies else None,
+        }
+
+
+def get_send_queue(context: ContextTypes.DEFAULT_TYPE) -> Optional[SendQueue]:
+    """! Getter for the send queue of the Application, None if it is not running.
+    @param context callback context of a handler or job
+    @return SendQueue
+    """
+    queue = context.bot_data.get(SendQueueConstants.DATA_KEY)
+    return queue if queue is not None and queue.running else None
+
+async def send_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str,
+                       priority: int = SendQueueConstants.PRIORITY_INTERACTIVE, **kwargs):
+    """! Send a message through the send queue; sends directly if the queue is not running.
+    @param context callback context of a handler or job
+    @param chat_id target chat
+    @param text message text
+    @param priority see SendQueueConstants.PRIORITY_*
+    @param kwargs further arguments of Bot.send_message
+    @return the sent Message
+    """
+    queue = get_send_queue(context)
+    if queue is None:
+        return await context.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+    return await queue.send(chat_id, 'send_message', priority, text=text, **kwargs)
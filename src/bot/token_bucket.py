@@ -0,0 +1,53 @@
+"""! @brief Token bucket rate limiter."""
+##
+# @file token_bucket.py
+# @package bot
+# @brief Token bucket rate limiter.
+#
+# @section description_token_bucket Description
+# Token bucket shared by the Telegram send queue and the Helium API client.
+# It can be paused, e.g. for the Retry-After time of a 429 response.
+
+import time
+
+
+class TokenBucket():
+    """! Token bucket refilled at rate tokens per second up to capacity tokens; a rate of 0 or less never runs out."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """! Seconds until a token is available, 0 if one is available now.
+        @return float
+        """
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.rate <= 0:
+            return 0
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        """! Take a token if one is available.
+        @return 0 if a token was taken, otherwise seconds until one is available
+        """
+        wait = self.delay()
+        if wait == 0 and self.rate > 0:
+            self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float):
+        """! Hand out no tokens for the given number of seconds, e.g. after a Retry-After.
+        @return None
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -0,0 +1,136 @@
+"""! @brief Registration of users, owners and hotspots tracked by the bot."""
+##
+# @file tracking.py
+# @package bot
+# @brief Registration of users, owners and hotspots tracked by the bot.
+#
+# @section description_tracking Description
+# Each Telegram user registers any number of owner accounts and hotspots.
+# Users are linked to the hotspots they track through Subscription records
+# (one per user and hotspot address). Registering an owner account links the
+# user to it with an Owner record and subscribes them to all of its hotspots;
+# Hotspot records exist once per hotspot address.
+
+import logging
+from typing import List, Optional, Tuple
+
+from bot.db.DBManager import DBManager
+from bot.db.AsyncDBManager import AsyncDBManager
+from bot.db.model.Hotspot import Hotspot
+from bot.db.model.Owner import Owner
+from bot.db.model.Subscription import Subscription
+from bot.db.model.User import User
+from bot.helium_requests import get_hotspot_data, iter_account_hotspots
+from util.constants import DbConstants
+
+log = logging.getLogger(__name__)
+
+
+def get_or_create_user(telegram_user_id: int, telegram_username: str) -> User:
+    """! Return the User record of a Telegram user, creating it on first contact.
+    @param telegram_user_id Telegram id of the user
+    @param telegram_username Telegram username of the user
+    @return User
+    """
+    users = DBManager.find_records_by(DbConstants.TREE_NAME_USERS, 'telegram_user_id', telegram_user_id)
+    if users:
+        return users[0]
+    user = User(telegram_user_id, telegram_username)
+    DBManager.insert_record(DbConstants.TREE_NAME_USERS, str(user.uuid), user)
+    log.info('Registered user %s.', telegram_user_id)
+    return user
+
+def add_owner(telegram_user_id: int, owner_address: str) -> bool:
+    """! Link an owner account to a Telegram user.
+    @return True if the link was created, False if it already existed
+    """
+    owners = DBManager.find_records_by(DbConstants.TREE_NAME_OWNERS, 'telegram_user_id', telegram_user_id)
+    if any(owner.helium_address == owner_address for owner in owners):
+        return False
+    owner = Owner(owner_address, telegram_user_id)
+    DBManager.insert_record(DbConstants.TREE_NAME_OWNERS, str(owner.uuid), owner)
+    return True
+
+def add_hotspot(hotspot_address: str, animal_name: str, owner_address: str) -> bool:
+    """! Start tracking a hotspot.
+    @return True if the hotspot was added, False if it was tracked already
+    """
+    if DBManager.find_records_by(DbConstants.TREE_NAME_HOTSPOTS, 'hotspot_address', hotspot_address):
+        return False
+    hotspot = Hotspot(hotspot_address, animal_name, owner_address)
+    DBManager.insert_record(DbConstants.TREE_NAME_HOTSPOTS, str(hotspot.uuid), hotspot)
+    return True
+
+def add_subscription(telegram_user_id: int, hotspot_address: str) -> bool:
+    """! Subscribe a Telegram user to a hotspot.
+    @return True if the subscription was created, False if it already existed
+    """
+    subscriptions = DBManager.find_records_by(DbConstants.TREE_NAME_SUBSCRIPTIONS, 'telegram_user_id', telegram_user_id)
+    if any(subscription.hotspot_address == hotspot_address for subscription in subscriptions):
+        return False
+    subscription = Subscription(hotspot_address, telegram_user_id)
+    DBManager.insert_record(DbConstants.TREE_NAME_SUBSCRIPTIONS, str(subscription.uuid), subscription)
+    return True
+
+def add_account_hotspots(telegram_user_id: int, owner_address: str, hotspots: List[dict]) -> int:
+    """! Start tracking the hotspots of an owner account and subscribe a Telegram user to all of them.
+    @param hotspots hotspot data of the account from the API
+    @return number of hotspots newly tracked
+    """
+    with DBManager.connection() as connection:
+        tracked = {
+            hotspot['address'] for hotspot in hotspots
+            if next(DBManager.iter_records_by(connection, DbConstants.TREE_NAME_HOTSPOTS, 'hotspot_address', hotspot['address']), None)
+        }
+        subscribed = {subscription.hotspot_address for subscription in DBManager.iter_user_subscriptions(connection, telegram_user_id)}
+    new_hotspots = [Hotspot(hotspot['address'], hotspot.get('name'), owner_address) for hotspot in hotspots if hotspot['address'] not in tracked]
+    new_subscriptions = [Subscription(hotspot['address'], telegram_user_id) for hotspot in hotspots if hotspot['address'] not in subscribed]
+    added = DBManager.insert_many(DbConstants.TREE_NAME_HOTSPOTS, [(str(hotspot.uuid), hotspot) for hotspot in new_hotspots])
+    DBManager.insert_many(DbConstants.TREE_NAME_SUBSCRIPTIONS, [(str(subscription.uuid), subscription) for subscription in new_subscriptions])
+    return added
+
+async def register_owner(telegram_user_id: int, telegram_username: str, owner_address: str) -> int:
+    """! Register an owner account for a user and track all of its hotspots.
+    @return number of hotspots newly tracked
+    """
+    await AsyncDBManager.run_write(get_or_create_user, telegram_user_id, telegram_username)
+    await AsyncDBManager.run_write(add_owner, telegram_user_id, owner_address)
+    # keyed by address, so a hotspot listed twice is inserted once
+    hotspots = {hotspot['address']: hotspot async for hotspot in iter_account_hotspots(owner_address)}
+    added = await AsyncDBManager.run_write(add_account_hotspots, telegram_user_id, owner_address, list(hotspots.values()))
+    log.info('User %s registered owner %s with %s new hotspots.', telegram_user_id, owner_address, added)
+    return added
+
+async def register_hotspot(telegram_user_id: int, telegram_username: str, hotspot_address: str) -> Optional[dict]:
+    """! Register a single hotspot for a user. The user is subscribed to this hotspot only, not to the
+    other hotspots of its owner.
+    @return hotspot data from the API, None if the hotspot does not exist
+    """
+    data = (await get_hotspot_data(hotspot_address)).get('data')
+    if not data:
+        return None
+    await AsyncDBManager.run_write(get_or_create_user, telegram_user_id, telegram_username)
+    await AsyncDBManager.run_write(add_hotspot, hotspot_address, data.get('name'), data['owner'])
+    await AsyncDBManager.run_write(add_subscription, telegram_user_id, hotspot_address)
+    return data
+
+def get_user_hotspots(telegram_user_id: int) -> List[Hotspot]:
+    """! All hotspots a Telegram user is subscribed to.
+    @return list of Hotspot records, sorted by hotspot address
+    """
+    with DBManager.connection() as connection:
+        hotspot_addresses = {subscription.hotspot_address for subscription in DBManager.iter_user_subscriptions(connection, telegram_user_id)}
+        return [
+            DBManager._detach(hotspot)
+            for hotspot_address in sorted(hotspot_addresses)
+            for hotspot in DBManager.iter_records_by(connection, DbConstants.TREE_NAME_HOTSPOTS, 'hotspot_address', hotspot_address)
+        ]
+
+def get_tracked_hotspots() -> List[Tuple[str, str]]:
+    """! All tracked hotspots.
+    @return list of (hotspot address, owner address) tuples
+    """
+    return [
+        (hotspot.hotspot_address, hotspot.owner_address)
+        for hotspot in DBManager.find_records(DbConstants.TREE_NAME_HOTSPOTS)
+    ]
@@ -2,48 +2,59 @@ from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 from bot.helium_requests import *
+from bot import metrics
+from bot.send_queue import send_message
+from bot.notifications import snooze_notifications, resume_notifications, get_snoozed_until
+from bot.db.AsyncDBManager import AsyncDBManager
 from util.constants import UiLabels
-from .ui_items import main_menu_keyboard
+from util.time_helper import format_utc_time
 
+@metrics.handler
 async def ui_start(update: Update, context: ContextTypes):
     '''
     Start bot UI action.
     '''
     # await context.bot.send_message(chat_id=update.effective_chat.id, text="I'm a bot, please talk to me!")
     
-    await context.bot.send_message(chat_id=update.message.chat_id,
-                     text = UiLabels.UI_LABEL_STUB,
-                     reply_markup=main_menu_keyboard())
+    await send_message(context, update.effective_chat.id, UiLabels.UI_LABEL_STUB)
 
+@metrics.handler
 async def ui_end(update: Update, context: ContextTypes):
     '''
     End bot UI action.
     '''
     # await context.bot.send_message(chat_id=update.effective_chat.id, text="I'm a bot, please talk to me!")
     
-    await context.bot.send_message(chat_id=update.message.chat_id,
-                     text = UiLabels.UI_LABEL_STUB,
-                     reply_markup=main_menu_keyboard())
+    await send_message(context, update.effective_chat.id, UiLabels.UI_LABEL_STUB)
 
 
-async def ui_snooze(update: Update, context: ContextTypes):
+@metrics.handler
+async def ui_snooze(update: Update, context: ContextTypes, hours: float = None):
     '''
     Snooze notifications UI action.
     '''
-    # await context.bot.send_message(chat_id=update.effective_chat.id, text="I'm a bot, please talk to me!")
-    
-    await context.bot.send_message(chat_id=update.message.chat_id,
-                     text = UiLabels.UI_LABEL_STUB,
-                     reply_markup=main_menu_keyboard())
+    until = await snooze_notifications(update.effective_user.id, hours)
+    text = 'Notifications snoozed until {}.'.format(format_utc_time(until))
+    await send_message(context, update.effective_chat.id, text)
 
 
-async def ui_settings(update: Update, context: ContextTypes):
+@metrics.handler
+async def ui_resume(update: Update, context: ContextTypes):
     '''
-    Settings UI action.
+    Resume notifications UI action.
     '''
-    # await context.bot.send_message(chat_id=update.effective_chat.id, text="I'm a bot, please talk to me!")
-    
-    await context.bot.send_message(chat_id=update.message.chat_id,
-                     text = UiLabels.UI_LABEL_STUB,
-                     reply_markup=main_menu_keyboard())
+    resumed = await resume_notifications(update.effective_user.id)
+    await send_message(context, update.effective_chat.id, 'Notifications resumed.' if resumed else 'Notifications are not snoozed.')
 
+
+@metrics.handler
+async def ui_settings(update: Update, context: ContextTypes, reply_markup=None):
+    '''
+    Notification settings UI action.
+    '''
+    until = await AsyncDBManager.run(get_snoozed_until, update.effective_user.id)
+    if until is None:
+        text = 'Notifications are on.'
+    else:
+        text = 'Notifications are snoozed until {}.'.format(format_utc_time(until))
+    await send_message(context, update.effective_chat.id, text, reply_markup=reply_markup)
@@ -1,26 +1,36 @@
-from telegram import KeyboardButton, ReplyKeyboardMarkup
-from util.constants import UiLabels
+from functools import partial
+from bot.menu import Button, Menu, MenuRouter
+from bot.actions import send_user_hotspots
+from bot.ui_actions import ui_start, ui_end, ui_snooze, ui_resume, ui_settings
+from util.constants import MenuConstants, UiLabels
 
-def main_menu_keyboard():
-    kb = [
-        [KeyboardButton(UiLabels.UI_LABEL_OPTION_START), KeyboardButton(UiLabels.UI_LABEL_OPTION_END)],
-        [KeyboardButton(UiLabels.UI_LABEL_OPTION_SNOOZE), KeyboardButton(UiLabels.UI_LABEL_OPTION_SETTINGS)]
-        ]
-
-    return ReplyKeyboardMarkup(kb)
-
-def snooze_sub_menu_keyboard():
-    kb = [
-        [KeyboardButton(UiLabels.UI_LABEL_OPTION_START), KeyboardButton(UiLabels.UI_LABEL_OPTION_END)],
-        [KeyboardButton(UiLabels.UI_LABEL_OPTION_SNOOZE), KeyboardButton(UiLabels.UI_LABEL_OPTION_SETTINGS)]
-        ]
+# Menu tree of the bot; the keyboards are built once by the router.
+MENUS = [
+    Menu(MenuConstants.MENU_MAIN, UiLabels.UI_LABEL_MAIN_MENU, [
+        [Button(UiLabels.UI_LABEL_OPTION_START, ui_start), Button(UiLabels.UI_LABEL_OPTION_END, ui_end)],
+        [Button(UiLabels.UI_LABEL_OPTION_SNOOZE, menu=MenuConstants.MENU_SNOOZE),
+         Button(UiLabels.UI_LABEL_OPTION_SETTINGS, menu=MenuConstants.MENU_SETTINGS)],
+    ]),
+    Menu(MenuConstants.MENU_SNOOZE, UiLabels.UI_LABEL_SNOOZE_MENU, [
+        [Button(UiLabels.UI_LABEL_OPTION_SNOOZE_1H, partial(ui_snooze, hours=1), menu=MenuConstants.MENU_MAIN),
+         Button(UiLabels.UI_LABEL_OPTION_SNOOZE_8H, partial(ui_snooze, hours=8), menu=MenuConstants.MENU_MAIN)],
+        [Button(UiLabels.UI_LABEL_OPTION_SNOOZE_24H, partial(ui_snooze, hours=24), menu=MenuConstants.MENU_MAIN),
+         Button(UiLabels.UI_LABEL_OPTION_RESUME, ui_resume, menu=MenuConstants.MENU_MAIN)],
+        [Button(UiLabels.UI_LABEL_OPTION_BACK, menu=MenuConstants.MENU_MAIN)],
+    ]),
+    Menu(MenuConstants.MENU_SETTINGS, UiLabels.UI_LABEL_SETTINGS_MENU, [
+        [Button(UiLabels.UI_LABEL_OPTION_NOTIFICATIONS, ui_settings, inline=MenuConstants.MENU_NOTIFICATIONS),
+         Button(UiLabels.UI_LABEL_OPTION_MY_HOTSPOTS, send_user_hotspots)],
+        [Button(UiLabels.UI_LABEL_OPTION_BACK, menu=MenuConstants.MENU_MAIN)],
+    ]),
+    # inline keyboard attached to the notification status
+    Menu(MenuConstants.MENU_NOTIFICATIONS, UiLabels.UI_LABEL_OPTION_NOTIFICATIONS, [
+        [Button(UiLabels.UI_LABEL_OPTION_SNOOZE_8H, partial(ui_snooze, hours=8), callback_data=MenuConstants.CALLBACK_SNOOZE_8H),
+         Button(UiLabels.UI_LABEL_OPTION_RESUME, ui_resume, callback_data=MenuConstants.CALLBACK_RESUME)],
+    ], inline=True),
+]
 
-    return ReplyKeyboardMarkup(kb)
+menu_router = MenuRouter(MENUS, root=MenuConstants.MENU_MAIN)
 
-def settings_sub_menu_keyboard():
-    kb = [
-        [KeyboardButton(UiLabels.UI_LABEL_OPTION_START), KeyboardButton(UiLabels.UI_LABEL_OPTION_END)],
-        [KeyboardButton(UiLabels.UI_LABEL_OPTION_SNOOZE), KeyboardButton(UiLabels.UI_LABEL_OPTION_SETTINGS)]
-        ]
-
-    return ReplyKeyboardMarkup(kb)
+def main_menu_keyboard():
+    return menu_router.keyboard(MenuConstants.MENU_MAIN)
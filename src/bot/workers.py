@@ -0,0 +1,408 @@
+"""! @brief Multi-worker mode: a webhook front process sharding updates across worker processes."""
+##
+# @file workers.py
+# @package bot
+# @brief Multi-worker mode: a webhook front process sharding updates across worker processes.
+#
+# @section description_workers Description
+# With BOT_MODE workers, python main.py runs the front process. It serves the
+# configured DB through a local ZEO storage server, installs or evolves the
+# schema, spawns WORKERS worker processes (python main.py --worker INDEX) and
+# receives Telegram's webhook itself. Every update is forwarded to worker
+# chat_id % WORKERS over a local keep-alive HTTP connection, so all updates of
+# a chat are handled by the same worker and its per-chat send limits stay
+# exact. Workers run the usual Application on the ZEO storage, each with its
+# own ZODB object cache, and the front only answers Telegram once the worker
+# accepted the update, so Telegram redelivers updates a worker missed.
+#
+# @section notes_workers Notes
+# - Writes of different workers can conflict; DBManager.transact() retries
+#   them, and BTrees resolve concurrent changes to different keys themselves.
+# - Only worker 0 runs the activity sync and maintenance jobs.
+# - SEND_GLOBAL_RATE/BURST and HTTP_RATE/BURST are split evenly across the
+#   workers, METRICS_PORT is incremented per worker.
+# - With DB_STORAGE zeo an existing ZEO server is used and none is started.
+# - Worker processes that exit are restarted by the front.
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from definitions import ROOT_DIR
+from util.constants import BotModeConstants, HttpConstants, MetricsConstants, SendQueueConstants, StorageConstants, WorkerConstants
+
+log = logging.getLogger(__name__)
+
+# update types whose chat or sender decides the worker, in the order they are looked up
+_CHAT_KEYS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member',
+              'chat_member', 'chat_join_request')
+_USER_KEYS = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'poll_answer')
+
+
+def get_worker_settings(config: dict) -> dict:
+    """! Worker settings from the secrets/config dictionary, falling back to WorkerConstants defaults.
+    @param config dictionary with optional WORKERS* keys
+    @return dict with 'count', 'listen' and 'base_port' keys
+    """
+    count = int(config.get('WORKERS', WorkerConstants.COUNT))
+    if count < 1:
+        raise ValueError('WORKERS has to be at least 1.')
+    return {
+        'count': count,
+        'listen': config.get('WORKERS_LISTEN', WorkerConstants.LISTEN),
+        'base_port': int(config.get('WORKERS_BASE_PORT', WorkerConstants.BASE_PORT)),
+    }
+
+def worker_config(config: dict, index: int) -> dict:
+    """! Copy of the secrets/config dictionary for worker index, with the global limits split across the workers.
+    @param config secrets/config dictionary of the bot
+    @param index number of the worker, from 0
+    @return dict
+    """
+    count = get_worker_settings(config)['count']
+    config = dict(config)
+    for key, default in (('SEND_GLOBAL_RATE', SendQueueConstants.GLOBAL_RATE),
+                         ('SEND_GLOBAL_BURST', SendQueueConstants.GLOBAL_BURST),
+                         ('HTTP_RATE', HttpConstants.RATE),
+                         ('HTTP_BURST', HttpConstants.BURST)):
+        config[key] = float(config.get(key, default)) / count
+    config['METRICS_PORT'] = int(config.get('METRICS_PORT', MetricsConstants.PORT)) + index
+    return config
+
+def get_zeo_address(config: dict) -> str:
+    """! Address of the ZEO server the workers share.
+    @return 'host:port' or unix socket path
+    """
+    return config.get('DB_ZEO_ADDRESS', StorageConstants.ZEO_ADDRESS)
+
+def configure_db(config: dict):
+    """! Point this process' DB at the shared ZEO server; call before the DB is first used.
+    @return None
+    """
+    from bot.db import db
+    db.configure(storage=StorageConstants.STORAGE_ZEO, zeo_address=get_zeo_address(config))
+
+def get_chat_id(update: dict) -> Optional[int]:
+    """! Chat an update belongs to, or the user that sent it for updates without a chat.
+    @param update Update JSON as sent by Telegram
+    @return chat or user id, None if the update has neither
+    """
+    for key in _CHAT_KEYS:
+        if key in update:
+            return update[key].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        query = update['callback_query']
+        chat_id = query.get('message', {}).get('chat', {}).get('id')
+        return chat_id if chat_id is not None else query.get('from', {}).get('id')
+    for key in _USER_KEYS:
+        if key in update:
+            sender = update[key].get('from') or update[key].get('user') or {}
+            return sender.get('id')
+    return None
+
+def get_shard(update: dict, count: int) -> int:
+    """! Worker an update is handled by; updates without chat or user are spread by their update_id.
+    @param update Update JSON as sent by Telegram
+    @param count number of workers
+    @return worker index
+    """
+    chat_id = get_chat_id(update)
+    return (chat_id if chat_id is not None else update.get('update_id', 0)) % count
+
+
+###############################################
+# ZEO storage server.                         #
+###############################################
+
+def _zeo_storage_config(settings: dict) -> str:
+    """! Internal function with the ZConfig storage section of the configured DB storage.
+    @param settings DB settings as returned by bot.db.db.get_settings()
+    @return str
+    """
+    kind = settings['storage']
+    if kind == StorageConstants.STORAGE_MEMORY:
+        return '<mappingstorage>\n</mappingstorage>\n'
+    file_storage = '<filestorage>\n  path {}\n</filestorage>\n'.format(os.path.abspath(settings['path']))
+    if kind == StorageConstants.STORAGE_FILE:
+        return file_storage
+    if kind == StorageConstants.STORAGE_ZLIB:
+        return '%import zc.zlibstorage\n<zlibstorage>\n{}</zlibstorage>\n'.format(file_storage)
+    raise ValueError('DB_STORAGE {!r} cannot be served by ZEO, expected one of {}.'.format(
+        kind, [StorageConstants.STORAGE_FILE, StorageConstants.STORAGE_ZLIB, StorageConstants.STORAGE_MEMORY]))
+
+def _wait_for_address(address: str, process: subprocess.Popen, timeout: float):
+    """! Internal function waiting until a server accepts connections on address.
+    @return None
+    """
+    host, _, port = address.rpartition(':')
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if host and port.isdigit():
+                socket.create_connection((host, int(port)), timeout=1).close()
+            else:
+                with socket.socket(socket.AF_UNIX) as sock:
+                    sock.connect(address)
+            return
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError('ZEO server exited with status {}.'.format(process.returncode))
+            if time.monotonic() > deadline:
+                raise RuntimeError('ZEO server did not listen on {} within {}s.'.format(address, timeout))
+            time.sleep(0.1)
+
+def start_zeo_server(config: dict) -> Optional[subprocess.Popen]:
+    """! Serve the configured DB storage with a ZEO server on DB_ZEO_ADDRESS, unless DB_STORAGE is zeo already.
+    @param config secrets/config dictionary of the bot
+    @return ZEO server process, None if an existing server is used
+    """
+    from bot.db import db
+    settings = db.get_settings()
+    if settings['storage'] == StorageConstants.STORAGE_ZEO:
+        log.info('Using the ZEO server on %s.', settings['zeo_address'])
+        return None
+    address = get_zeo_address(config)
+    with tempfile.NamedTemporaryFile('w', prefix='zeo-', suffix='.conf', delete=False) as conf:
+        conf.write('<zeo>\n  address {}\n</zeo>\n'.format(address))
+        conf.write(_zeo_storage_config(settings))
+    process = subprocess.Popen([sys.executable, '-m', 'ZEO.runzeo', '-C', conf.name])
+    try:
+        _wait_for_address(address, process, WorkerConstants.START_TIMEOUT)
+    except Exception:
+        _stop_process(process)
+        raise
+    finally:
+        os.unlink(conf.name)
+    log.info('Started ZEO server on %s for the %s storage (pid %s).', address, settings['storage'], process.pid)
+    return process
+
+def _stop_process(process: Optional[subprocess.Popen]):
+    """! Internal function stopping a child process, killing it if it does not exit within STOP_TIMEOUT.
+    @return None
+    """
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(WorkerConstants.STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        log.warning('Process %s did not stop within %ss, killing it.', process.pid, WorkerConstants.STOP_TIMEOUT)
+        process.kill()
+        process.wait()
+
+
+###############################################
+# Front process.                              #
+###############################################
+
+class WorkerFront():
+    """! Webhook receiver of the front process; forwards every update to the worker of its chat and keeps
+    the worker processes running.
+    """
+
+    def __init__(self, config: dict):
+        """! Constructor.
+        @param config secrets/config dictionary of the bot
+        """
+        from bot.init import get_webhook_settings
+        self.config = config
+        self.settings = get_worker_settings(config)
+        self.webhook = get_webhook_settings(config)
+        self.token = secrets.token_urlsafe(32)
+        self.processes: List[Optional[subprocess.Popen]] = [None] * self.settings['count']
+        self.urls = ['http://{}:{}'.format(self.settings['listen'], self.settings['base_port'] + index)
+                     for index in range(self.settings['count'])]
+        self.forwarded = [0] * self.settings['count']
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _spawn(self, index: int):
+        """! Internal method starting worker process index.
+        @return None
+        """
+        env = dict(os.environ, **{WorkerConstants.TOKEN_ENV: self.token})
+        self.processes[index] = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT_DIR, 'main.py'), '--worker', str(index)], env=env)
+        log.info('Started worker %s (pid %s) on %s.', index, self.processes[index].pid, self.urls[index])
+
+    async def _wait_ready(self, index: int):
+        """! Internal method waiting until worker index answers its health check.
+        @return None
+        """
+        deadline = time.monotonic() + WorkerConstants.START_TIMEOUT
+        while True:
+            try:
+                async with self._session.get(self.urls[index] + WorkerConstants.HEALTH_PATH) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if self.processes[index].poll() is not None:
+                raise RuntimeError('Worker {} exited with status {}.'.format(index, self.processes[index].returncode))
+            if time.monotonic() > deadline:
+                raise RuntimeError('Worker {} did not start within {}s.'.format(index, WorkerConstants.START_TIMEOUT))
+            await asyncio.sleep(0.1)
+
+    async def _supervise(self):
+        """! Internal task restarting worker processes that exited.
+        @return None
+        """
+        while True:
+            await asyncio.sleep(WorkerConstants.SUPERVISE_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if process.poll() is not None:
+                    log.error('Worker %s exited with status %s, restarting it.', index, process.returncode)
+                    self._spawn(index)
+
+    async def _receive(self, request: web.Request) -> web.Response:
+        """! Internal webhook handler; checks the secret token and forwards the update to its worker.
+        @return 200 once the worker accepted the update, 503 if it did not
+        """
+        if request.headers.get(WorkerConstants.SECRET_HEADER) != self.webhook['secret_token']:
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        index = get_shard(update, self.settings['count'])
+        try:
+            async with self._session.post(self.urls[index] + WorkerConstants.UPDATE_PATH, data=body,
+                                          headers={WorkerConstants.TOKEN_HEADER: self.token,
+                                                   'Content-Type': 'application/json'}) as response:
+                if response.status != 200:
+                    log.warning('Worker %s rejected update %s with status %s.', index, update.get('update_id'), response.status)
+                    return web.Response(status=503)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Telegram delivers the update again later
+            log.warning('Could not forward update %s to worker %s: %r', update.get('update_id'), index, e)
+            return web.Response(status=503)
+        self.forwarded[index] += 1
+        return web.Response()
+
+    async def serve(self):
+        """! Start the workers and forward webhook updates to them until SIGINT or SIGTERM.
+        @return None
+        """
+        from telegram import Bot
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        connector = aiohttp.TCPConnector(limit=0)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=WorkerConstants.FORWARD_TIMEOUT))
+        runner = None
+        supervisor = None
+        try:
+            for index in range(self.settings['count']):
+                self._spawn(index)
+            await asyncio.gather(*(self._wait_ready(index) for index in range(self.settings['count'])))
+            supervisor = asyncio.create_task(self._supervise(), name='worker-supervisor')
+            app = web.Application()
+            app.router.add_post('/' + self.webhook['url_path'], self._receive)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, self.webhook['listen'], self.webhook['port']).start()
+            base_url = self.config.get('TELEGRAM_API_URL', BotModeConstants.TELEGRAM_API_URL) + '/bot'
+            async with Bot(self.config['BOT_TOKEN'], base_url=base_url) as bot:
+                await bot.set_webhook(self.webhook['webhook_url'], max_connections=self.webhook['max_connections'],
+                                      secret_token=self.webhook['secret_token'])
+            log.info('Forwarding webhook updates from %s:%s/%s to %s workers.', self.webhook['listen'],
+                     self.webhook['port'], self.webhook['url_path'], self.settings['count'])
+            await stopping.wait()
+        finally:
+            if supervisor is not None:
+                supervisor.cancel()
+            if runner is not None:
+                await runner.cleanup()
+            await self._session.close()
+            for process in self.processes:
+                if process is not None and process.poll() is None:
+                    process.terminate()
+            for process in self.processes:
+                await asyncio.to_thread(_stop_process, process)
+            log.info('Updates forwarded per worker: %s', self.forwarded)
+
+def run_front(config: dict):
+    """! Run the front process: start the ZEO server, install the schema, then serve the webhook and the workers.
+    @param config secrets/config dictionary of the bot
+    @return None
+    """
+    from bot.db.DBManager import DBManager
+    from bot.init import open_database
+    zeo_server = start_zeo_server(config)
+    try:
+        # installed once here, so the workers do not race each other to create the trees
+        configure_db(config)
+        open_database()
+        DBManager.close_db()
+        asyncio.run(WorkerFront(config).serve())
+    finally:
+        _stop_process(zeo_server)
+
+
+###############################################
+# Worker process.                             #
+###############################################
+
+async def _serve_worker(application, settings: dict, index: int):
+    """! Internal coroutine running the Application of a worker with updates posted by the front.
+    @return None
+    """
+    from telegram import Update
+    token = os.environ.get(WorkerConstants.TOKEN_ENV)
+    if not token:
+        raise RuntimeError('Workers are started by the front process, {} is not set.'.format(WorkerConstants.TOKEN_ENV))
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    async def receive(request: web.Request) -> web.Response:
+        if request.headers.get(WorkerConstants.TOKEN_HEADER) != token:
+            return web.Response(status=403)
+        await application.update_queue.put(Update.de_json(await request.json(), application.bot))
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text='ok')
+
+    app = web.Application()
+    app.router.add_post(WorkerConstants.UPDATE_PATH, receive)
+    app.router.add_get(WorkerConstants.HEALTH_PATH, health)
+    runner = web.AppRunner(app, access_log=None)
+    # the same steps as Application.run_webhook(), without registering the webhook with Telegram
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, settings['listen'], settings['base_port'] + index).start()
+            log.info('Worker %s is receiving updates on %s:%s.', index, settings['listen'], settings['base_port'] + index)
+            await stopping.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
+    await application.post_shutdown(application)
+
+def run_worker(application, config: dict, index: int):
+    """! Run worker index until the front stops it.
+    @param application Application built by init_bot() from worker_config()
+    @param config worker config dictionary
+    @param index number of the worker, from 0
+    @return None
+    """
+    configure_db(config)
+    asyncio.run(_serve_worker(application, get_worker_settings(config), index))
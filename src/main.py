@@ -19,21 +19,64 @@
 #
 # Copyright (c) 2022 Svetozar Stojanovic.  All rights reserved.
 
+import argparse
+import asyncio
 import os
-from email.mime import application
-from bot.db.DBManager import DBManager
-import util.logger as logger
-from util.read_secrets import read_secrets
-from bot.init import init_bot
-from definitions import LOGS_DIR
-from bot.init import register_db_schema_manager
-SECRETS = read_secrets()
+
+from util import startup_profile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Helium Telegram Bot')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='import and start every subsystem, print the time each took and exit without polling')
+    # set by the front process of BOT_MODE workers when it spawns its workers
+    parser.add_argument('--worker', type=int, metavar='INDEX', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+async def profile_application(application):
+    """! Start and stop the lazily started subsystems without connecting to Telegram.
+    @return None
+    """
+    await application.post_init(application)
+    with startup_profile.phase('shutdown'):
+        await application.post_shutdown(application)
+
+def main():
+    args = parse_args()
+    with startup_profile.phase('config'):
+        from util.read_secrets import read_secrets
+        config = read_secrets()
+    # the bot is imported here, so its import time can be attributed to the subsystems
+    startup_profile.import_subsystems()
+    import util.logger as logger
+    from bot import workers
+    from bot.init import init_bot, run_bot
+    from definitions import LOGS_DIR
+    from util.constants import BotModeConstants, WorkerConstants
+
+    log_name = config['BOT_NAME']
+    if args.worker is not None:
+        log_name += WorkerConstants.LOG_SUFFIX.format(args.worker)
+    with startup_profile.phase('logging'):
+        logger.init_logger(os.path.join(LOGS_DIR, log_name + '.log'), config)
+    if args.worker is not None:
+        config = workers.worker_config(config, args.worker)
+        # the background jobs run once, in the first worker
+        application = init_bot(config, schedule_jobs=args.worker == 0)
+        workers.run_worker(application, config, args.worker)
+        return
+    if config.get('BOT_MODE') == BotModeConstants.WORKERS and not args.profile_startup:
+        workers.run_front(config)
+        return
+    with startup_profile.phase('application'):
+        application = init_bot(config)
+    if args.profile_startup:
+        asyncio.run(profile_application(application))
+        logger.stop_logger()
+        print(startup_profile.report())
+        return
+    run_bot(application, config)
 
 if __name__ == "__main__":
-    filename = SECRETS['BOT_NAME'] + '.log'
-    logger.init_logger(os.path.join(LOGS_DIR, filename))
-    
-    db_schema_manager = register_db_schema_manager()
-    db_schema_manager.install(DBManager.get_db_ref().open())
-    application = init_bot()
-    application.run_polling()
\ No newline at end of file
+    main()
@@ -0,0 +1,165 @@
+"""! @brief Tests of the retries, circuit breaker and stale responses of the Helium API client."""
+##
+# @file test_helium_client.py
+# @package tests
+# @brief Tests of the retries, circuit breaker and stale responses of the Helium API client.
+#
+# @section description_test_helium_client Description
+# Every test serves the local Helium API stub of the benchmarks and injects
+# its failures through the stub's FAULTS settings.
+# Run from the src directory: python -m pytest tests
+
+import asyncio
+import time
+
+import pytest
+
+from benchmarks import stub_helium
+from bot.helium_client import CircuitBreaker, CircuitOpenError, HeliumAPIError, HeliumClient
+from bot.response_cache import ResponseCache
+
+
+class RecordingBreaker(CircuitBreaker):
+    """! CircuitBreaker remembering the state every request outcome was reported in."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reported = []
+
+    def record_success(self):
+        self.reported.append((self.state, 'success'))
+        super().record_success()
+
+    def record_failure(self):
+        self.reported.append((self.state, 'failure'))
+        super().record_failure()
+
+
+def run_with_stub(scenario, client: dict = None, **faults):
+    """! Run scenario(app, stats_url, client) against a stub with the given faults and a fast retrying client.
+    @param client HeliumClient keyword arguments
+    """
+    options = dict({'retry_backoff': 0.01}, **(client or {}))
+
+    async def main():
+        app = stub_helium.make_app(latency=0)
+        app['faults'].update(faults)
+        runner, base_url = await stub_helium.start_stub(app)
+        helium_client = HeliumClient(**options)
+        try:
+            return await scenario(app, base_url + '/v1/stats', helium_client)
+        finally:
+            await helium_client.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_rate_limit_pauses_bucket_and_retries():
+    pauses = []
+
+    async def scenario(app, url, client):
+        pause = client.bucket.pause
+
+        def record_pause(seconds):
+            pauses.append(seconds)
+            # the retry is answered normally
+            app['faults']['rate_limit_rate'] = 0.0
+            pause(seconds)
+        client.bucket.pause = record_pause
+        started = time.monotonic()
+        result = await client.get_json(url)
+        return result, time.monotonic() - started, client.stats(), app['faulted'], app['requests']
+
+    result, elapsed, stats, faulted, requests = run_with_stub(scenario, rate_limit_rate=1.0, retry_after=0.2,
+                                                              client={'retries': 2})
+    assert result['data']['counts']['hotspots'] == 5000
+    assert pauses == [0.2]
+    assert elapsed >= 0.2
+    assert (stats['rate_limited'], stats['retried']) == (1, 1)
+    assert (faulted, requests) == (1, 1)
+    assert stats['breaker_state'] == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    breaker = RecordingBreaker(threshold=3, reset_timeout=0.2)
+
+    async def scenario(app, url, client):
+        for _ in range(3):
+            with pytest.raises(HeliumAPIError) as error:
+                await client.get_json(url)
+            assert not isinstance(error.value, CircuitOpenError)
+            assert error.value.status == 503
+        assert breaker.state == CircuitBreaker.OPEN
+        # open: failing fast without sending the request
+        with pytest.raises(CircuitOpenError):
+            await client.get_json(url)
+        assert app['faulted'] == 3
+
+        # a failed trial request opens the breaker again
+        await asyncio.sleep(0.25)
+        with pytest.raises(HeliumAPIError):
+            await client.get_json(url)
+        assert breaker.reported[-1] == (CircuitBreaker.HALF_OPEN, 'failure')
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await client.get_json(url)
+
+        # a successful trial request closes it
+        await asyncio.sleep(0.25)
+        app['faults']['error_rate'] = 0.0
+        await client.get_json(url)
+        assert breaker.reported[-1] == (CircuitBreaker.HALF_OPEN, 'success')
+        assert breaker.state == CircuitBreaker.CLOSED
+        await client.get_json(url)
+        return breaker.opened, app['faulted']
+
+    opened, faulted = run_with_stub(scenario, error_rate=1.0, client={'retries': 0, 'breaker': breaker})
+    assert opened == 2
+    assert faulted == 4
+
+
+def test_stale_response_served_while_upstream_fails():
+    cache = ResponseCache(max_stale=0.3)
+
+    async def scenario(app, url, client):
+        def fetch():
+            return client.get_json(url)
+        fresh = await cache.get(url, 0.05, fetch)
+        await asyncio.sleep(0.1)
+        app['faults']['error_rate'] = 1.0
+        stale = await cache.get(url, 0.05, fetch)
+        assert stale == fresh
+        assert cache.stats()['stale_served'] == 1
+        # too old to be served any more
+        await asyncio.sleep(0.3)
+        with pytest.raises(HeliumAPIError):
+            await cache.get(url, 0.05, fetch)
+        return cache.stats()
+
+    stats = run_with_stub(scenario, client={'retries': 0})
+    assert stats['stale_served'] == 1
+    assert stats['inflight'] == 0
+
+
+def test_error_after_retries_run_out():
+    async def scenario(app, url, client):
+        with pytest.raises(HeliumAPIError) as error:
+            await client.get_json(url)
+        return error.value, client.retried, app['faulted']
+
+    error, retried, faulted = run_with_stub(scenario, error_rate=1.0, client={'retries': 2})
+    assert error.status == 503
+    assert error.retryable
+    assert (retried, faulted) == (2, 3)
+
+
+def test_timeout_after_retries_run_out():
+    async def scenario(app, url, client):
+        with pytest.raises(HeliumAPIError) as error:
+            await client.get_json(url)
+        return error.value, client.retried
+
+    error, retried = run_with_stub(scenario, hang_rate=1.0, hang_seconds=0.5,
+                                   client={'retries': 1, 'read_timeout': 0.1, 'route_timeouts': {}})
+    assert error.status is None
+    assert retried == 1
@@ -0,0 +1,116 @@
+"""! @brief Tests of the schema evolve steps, from a generation 0 DB to the current generation."""
+##
+# @file test_migrations.py
+# @package tests
+# @brief Tests of the schema evolve steps, from a generation 0 DB to the current generation.
+#
+# @section description_test_migrations Description
+# Every test writes users, owners, hotspots and activities in the format
+# used before the records were compacted into an in-memory DB, without the
+# index, timeline and aggregates trees and with the schema at generation 0.
+# It then opens the DB through DBUpgradeSchemaManager, which runs the evolve
+# steps registered in migrations.py.
+# Run from the src directory: python -m pytest tests
+
+import persistent.mapping
+import pytest
+from BTrees.OOBTree import OOBTree
+from zope.generations.generations import generations_key
+from zope.generations.interfaces import UnableToEvolve
+
+from benchmarks.bench_model_size import _legacy, _legacy_format, make_records
+from bot import init
+from bot.db import db
+from bot.db.DBManager import DBManager
+from bot.db.DBMigrationManager import DBMigrationManager
+from bot.db.DBUpgradeSchemaManager import DBUpgradeSchemaManager
+from util.constants import DbConstants
+from util.read_secrets import read_secrets
+
+HOTSPOTS = 5
+ACTIVITIES = 60
+RECORDS = 3 * HOTSPOTS + ACTIVITIES
+
+
+@pytest.fixture
+def legacy_db():
+    """! In-memory DB at generation 0 holding records in the old format."""
+    db.configure(storage='memory')
+
+    def write(connection):
+        root = connection.root()
+        with _legacy_format():
+            for tree_name, records in make_records(ACTIVITIES, HOTSPOTS):
+                tree = root[tree_name] = OOBTree()
+                for record in records:
+                    key = str(record.uuid)
+                    tree[key] = _legacy(record)
+        root[generations_key] = persistent.mapping.PersistentMapping({DbConstants.DB_APP_NAME: 0})
+    try:
+        DBManager.transact(write)
+        yield
+    finally:
+        DBManager.close_db()
+
+
+def check_evolved():
+    """! Assert that every step of the current generation has run to its end."""
+    storage = DBManager.get_db_ref().storage
+    with DBManager.connection() as connection:
+        assert DBManager.get_current_db_generation(connection) == DBUpgradeSchemaManager.generation
+        root = connection.root()
+        for tree_name in DbConstants.MODEL_TREES:
+            for key, record in root[tree_name].items():
+                assert key == str(record.uuid)
+                # rewritten in the compact format
+                pickle = storage.load(record._p_oid)[0]
+                assert b'tree_name' not in pickle and b'uuid' not in pickle
+        hotspots = list(DBManager.iter_records_by(connection, DbConstants.TREE_NAME_HOTSPOTS, 'owner_address', 'owner-1'))
+        assert [hotspot.hotspot_address for hotspot in hotspots] == ['hotspot-1']
+        owners = list(DBManager.iter_records_by(connection, DbConstants.TREE_NAME_OWNERS, 'telegram_user_id', 1001))
+        assert [owner.helium_address for owner in owners] == ['owner-1']
+        # the users of owner links are subscribed to the hotspots of the owner
+        subscriptions = list(DBManager.iter_user_subscriptions(connection, 1001))
+        assert [subscription.hotspot_address for subscription in subscriptions] == ['hotspot-1']
+    for i in range(HOTSPOTS):
+        address = 'hotspot-{}'.format(i)
+        assert len(DBManager.get_hotspot_activities(address)) == ACTIVITIES // HOTSPOTS
+        assert DBManager.get_activity_summary(address)['24h']['witnesses'] == ACTIVITIES // HOTSPOTS
+    for generation in range(2, DBUpgradeSchemaManager.generation + 1):
+        progress = DBMigrationManager.get_progress(generation)
+        assert progress['done']
+
+
+def test_evolve_from_generation_0(legacy_db, monkeypatch):
+    monkeypatch.setitem(read_secrets(), 'MIGRATION_CHUNK_SIZE', 7)
+    init.open_database()
+    check_evolved()
+    assert DBMigrationManager.get_progress(5)['count'] == RECORDS
+
+
+def test_interrupted_step_resumes_from_checkpoint(legacy_db, monkeypatch):
+    monkeypatch.setitem(read_secrets(), 'MIGRATION_CHUNK_SIZE', 10)
+    migration = DBMigrationManager.get_migration(5)
+    visit = migration.visit
+    visited = []
+
+    def interrupted(conn, tree_name, key, record):
+        visited.append(key)
+        if len(visited) > 25:
+            raise RuntimeError('interrupted')
+        visit(conn, tree_name, key, record)
+    monkeypatch.setattr(migration, 'visit', interrupted)
+    with pytest.raises(UnableToEvolve):
+        init.open_database()
+    # the two committed chunks are kept, the one that failed is rolled back
+    assert DBManager.get_current_db_generation() == 4
+    progress = DBMigrationManager.get_progress(5)
+    assert (progress['count'], progress['done']) == (20, False)
+
+    visited.clear()
+    monkeypatch.setattr(migration, 'visit', lambda *args: visited.append(args[2]) or visit(*args))
+    init.open_database()
+    check_evolved()
+    # resumed after the checkpoint instead of starting over
+    assert len(visited) == RECORDS - 20
+    assert DBMigrationManager.get_progress(5)['count'] == RECORDS
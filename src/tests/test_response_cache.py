@@ -0,0 +1,123 @@
+"""! @brief Tests of the coalescing, expiry and eviction of the response cache."""
+##
+# @file test_response_cache.py
+# @package tests
+# @brief Tests of the coalescing, expiry and eviction of the response cache.
+#
+# @section description_test_response_cache Description
+# The fetches are local coroutines, so no stub server is needed.
+# Run from the src directory: python -m pytest tests
+
+import asyncio
+
+import pytest
+
+from bot.response_cache import ResponseCache
+
+
+class Upstream():
+    """! Fetch coroutine factory counting its calls; every fetch waits until release() is called."""
+
+    def __init__(self, value='value'):
+        self.value = value
+        self.calls = 0
+        self.error = None
+        self._released = asyncio.Event()
+
+    def release(self):
+        self._released.set()
+
+    async def fetch(self):
+        self.calls += 1
+        await self._released.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def test_concurrent_gets_issue_one_fetch():
+    async def main():
+        cache = ResponseCache()
+        upstream = Upstream()
+        waiters = [asyncio.ensure_future(cache.get('key', 10, upstream.fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release()
+        return await asyncio.gather(*waiters), upstream.calls, cache.stats()
+
+    values, calls, stats = asyncio.run(main())
+    assert values == ['value'] * 5
+    assert calls == 1
+    assert (stats['misses'], stats['coalesced'], stats['inflight']) == (1, 4, 0)
+
+
+def test_cancelling_first_waiter_keeps_fetch_for_others():
+    async def main():
+        cache = ResponseCache()
+        upstream = Upstream()
+        first = asyncio.ensure_future(cache.get('key', 10, upstream.fetch))
+        await asyncio.sleep(0)
+        others = [asyncio.ensure_future(cache.get('key', 10, upstream.fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        upstream.release()
+        values = await asyncio.gather(*others)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # stored for later callers as well
+        cached = await cache.get('key', 10, upstream.fetch)
+        return values, cached, upstream.calls, cache.stats()
+
+    values, cached, calls, stats = asyncio.run(main())
+    assert values == ['value', 'value']
+    assert cached == 'value'
+    assert calls == 1
+    assert stats['hits'] == 1
+
+
+def test_stale_value_served_within_max_stale():
+    async def main():
+        cache = ResponseCache(max_stale=0.3)
+        upstream = Upstream()
+        upstream.release()
+        await cache.get('key', 0.05, upstream.fetch)
+        await asyncio.sleep(0.1)
+        upstream.value = 'new'
+        upstream.error = RuntimeError('upstream down')
+        stale = await cache.get('key', 0.05, upstream.fetch)
+        served = cache.stats()['stale_served']
+        await asyncio.sleep(0.3)
+        with pytest.raises(RuntimeError):
+            await cache.get('key', 0.05, upstream.fetch)
+        upstream.error = None
+        fresh = await cache.get('key', 0.05, upstream.fetch)
+        return stale, served, fresh
+
+    stale, served, fresh = asyncio.run(main())
+    assert stale == 'value'
+    assert served == 1
+    assert fresh == 'new'
+
+
+def test_lru_evicts_least_recently_used_first():
+    async def main():
+        cache = ResponseCache(max_size=3)
+        upstream = Upstream()
+        upstream.release()
+        for key in ('a', 'b', 'c'):
+            upstream.value = key
+            await cache.get(key, 10, upstream.fetch)
+        # 'a' is used again, so 'b' and then 'c' are the oldest
+        await cache.get('a', 10, upstream.fetch)
+        evicted = []
+        for key in ('d', 'e'):
+            before = set(cache._entries)
+            upstream.value = key
+            await cache.get(key, 10, upstream.fetch)
+            evicted.extend(before - set(cache._entries))
+        return evicted, list(cache._entries), cache.stats()['evictions']
+
+    evicted, kept, evictions = asyncio.run(main())
+    assert evicted == ['b', 'c']
+    assert kept == ['a', 'd', 'e']
+    assert evictions == 2
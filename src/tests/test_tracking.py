@@ -0,0 +1,77 @@
+"""! @brief Tests of the hotspots users track through owner and hotspot registrations."""
+##
+# @file test_tracking.py
+# @package tests
+# @brief Tests of the hotspots users track through owner and hotspot registrations.
+#
+# @section description_test_tracking Description
+# Runs the registrations on an in-memory DB; the Helium API lookups are
+# replaced by an account with three hotspots.
+# Run from the src directory: python -m pytest tests
+
+import asyncio
+
+import pytest
+
+from bot import init, tracking
+from bot.db import db
+from bot.db.DBManager import DBManager
+
+OWNER = 'owner-a'
+HOTSPOTS = ['hotspot-a1', 'hotspot-a2', 'hotspot-a3']
+
+
+@pytest.fixture
+def account(monkeypatch):
+    """! In-memory DB and an owner account with three hotspots."""
+    async def get_hotspot_data(hotspot_address):
+        return {'data': {'address': hotspot_address, 'name': 'name-' + hotspot_address, 'owner': OWNER}}
+
+    async def iter_account_hotspots(owner_address):
+        for address in HOTSPOTS:
+            yield {'address': address, 'name': 'name-' + address, 'owner': owner_address}
+    monkeypatch.setattr(tracking, 'get_hotspot_data', get_hotspot_data)
+    monkeypatch.setattr(tracking, 'iter_account_hotspots', iter_account_hotspots)
+    db.configure(storage='memory')
+    try:
+        init.open_database()
+        yield
+    finally:
+        DBManager.close_db()
+
+
+def hotspots_of(telegram_user_id):
+    return [hotspot.hotspot_address for hotspot in tracking.get_user_hotspots(telegram_user_id)]
+
+
+def test_hotspot_registration_tracks_only_that_hotspot(account):
+    async def main():
+        await tracking.register_hotspot(1, 'one', 'hotspot-a1')
+        await tracking.register_hotspot(2, 'two', 'hotspot-a2')
+        await tracking.register_hotspot(2, 'two', 'hotspot-a2')
+    asyncio.run(main())
+    assert hotspots_of(1) == ['hotspot-a1']
+    assert hotspots_of(2) == ['hotspot-a2']
+    assert DBManager.find_records_by('owners', 'telegram_user_id', 1) == []
+
+
+def test_owner_registration_tracks_all_hotspots_of_the_account(account):
+    async def main():
+        await tracking.register_hotspot(1, 'one', 'hotspot-a1')
+        return await tracking.register_owner(2, 'two', OWNER)
+    added = asyncio.run(main())
+    assert added == 2
+    assert hotspots_of(1) == ['hotspot-a1']
+    assert hotspots_of(2) == HOTSPOTS
+    assert [owner.helium_address for owner in DBManager.find_records_by('owners', 'telegram_user_id', 2)] == [OWNER]
+
+
+def test_notifications_reach_only_subscribers(account):
+    from bot.notifications import get_notification_targets
+
+    async def main():
+        await tracking.register_hotspot(1, 'one', 'hotspot-a1')
+        await tracking.register_owner(2, 'two', OWNER)
+    asyncio.run(main())
+    assert get_notification_targets('hotspot-a1', 0) == ([1, 2], 'name-hotspot-a1')
+    assert get_notification_targets('hotspot-a2', 0) == ([2], 'name-hotspot-a2')
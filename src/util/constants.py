@@ -4,7 +4,40 @@ class DbConstants():
     TREE_NAME_HOTSPOTS = 'hotspots'
     TREE_NAME_ACTIVITIES = 'activities'
     TREE_NAME_OWNERS = 'owners'
+    TREE_NAME_SUBSCRIPTIONS = 'subscriptions'
+    TREE_NAME_SYNC_STATE = 'sync_state'
+    TREE_NAME_ACTIVITY_TIMELINE = 'activity_timeline'
+    TREE_NAME_ACTIVITY_AGGREGATES = 'activity_aggregates'
+    TREE_NAME_AGGREGATE_HORIZONS = 'aggregate_horizons'
+    TREE_NAME_SNOOZES = 'snoozes'
+    TREE_NAME_SNOOZE_EXPIRY = 'snooze_expiry'
+    TREE_NAME_MIGRATIONS = 'migrations'
+    TREE_NAME_MAINTENANCE = 'maintenance'
     TREE_NAME_LABELS = 'constants'
+    DB_THREADS = 4
+    CONFLICT_RETRIES = 5
+    CONFLICT_BACKOFF = 0.05
+    BULK_CHUNK_SIZE = 1000
+    # trees holding BaseModel records
+    MODEL_TREES = [TREE_NAME_USERS, TREE_NAME_OWNERS, TREE_NAME_HOTSPOTS, TREE_NAME_ACTIVITIES]
+
+class MigrationConstants():
+    # records visited per transaction of a chunked evolve step
+    CHUNK_SIZE = 1000
+    LOG_INTERVAL = 10
+
+class StorageConstants():
+    STORAGE_FILE = 'file'
+    STORAGE_ZLIB = 'zlib'
+    STORAGE_MEMORY = 'memory'
+    STORAGE_ZEO = 'zeo'
+    STORAGES = [STORAGE_FILE, STORAGE_ZLIB, STORAGE_MEMORY, STORAGE_ZEO]
+    STORAGE = STORAGE_FILE
+    PATH = 'dataz.fs'
+    ZEO_ADDRESS = 'localhost:8100'
+    CACHE_SIZE = 10000
+    CACHE_SIZE_BYTES = 0
+    POOL_SIZE = 7
 
 class UiLabels():
     UI_LABEL_MAIN_MENU = 'Choose one of the following options:'
@@ -12,4 +45,211 @@ class UiLabels():
     UI_LABEL_OPTION_END = 'End Bot 🤚'
     UI_LABEL_OPTION_SETTINGS = 'Settings ⚙'
     UI_LABEL_OPTION_SNOOZE = 'Snooze ⏰'
-    UI_LABEL_STUB = 'STUB LABEL'
\ No newline at end of file
+    UI_LABEL_OPTION_SNOOZE_1H = '1 hour'
+    UI_LABEL_OPTION_SNOOZE_8H = '8 hours'
+    UI_LABEL_OPTION_SNOOZE_24H = '24 hours'
+    UI_LABEL_OPTION_RESUME = 'Resume 🔔'
+    UI_LABEL_OPTION_NOTIFICATIONS = 'Notifications 🔔'
+    UI_LABEL_OPTION_MY_HOTSPOTS = 'My hotspots 📡'
+    UI_LABEL_OPTION_BACK = 'Back ↩'
+    UI_LABEL_SNOOZE_MENU = 'Snooze notifications for:'
+    UI_LABEL_SETTINGS_MENU = 'Settings:'
+    UI_LABEL_STUB = 'STUB LABEL'
+
+class MenuConstants():
+    STATE_SIZE = 10000
+    MENU_MAIN = 'main'
+    MENU_SNOOZE = 'snooze'
+    MENU_SETTINGS = 'settings'
+    MENU_NOTIFICATIONS = 'notifications'
+    CALLBACK_SNOOZE_8H = 'snooze:8'
+    CALLBACK_RESUME = 'resume'
+class HttpConstants():
+    API_URL = 'https://api.helium.io'
+    ROUTE_ROLES = 'hotspots/roles'
+    ROUTE_ACCOUNT_HOTSPOTS = 'accounts/hotspots'
+    ROUTE_OTHER = 'other'
+    CONNECTION_LIMIT = 100
+    CONNECTION_LIMIT_PER_HOST = 20
+    DNS_CACHE_TTL = 300
+    KEEPALIVE_TIMEOUT = 30
+    TOTAL_TIMEOUT = 30
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 15
+    # (connect, read) timeouts in seconds per route, other routes use CONNECT_TIMEOUT/READ_TIMEOUT
+    ROUTE_TIMEOUTS = {
+        'stats': (3, 10),
+        'stats/token_supply': (3, 10),
+        'hotspots': (3, 10),
+        ROUTE_ROLES: (5, 20),
+        ROUTE_ACCOUNT_HOTSPOTS: (5, 20),
+    }
+    RETRIES = 2
+    RETRY_BACKOFF = 0.5
+    RETRY_BACKOFF_MAX = 5
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # requests per second to the Helium API, 0 for no limit; Retry-After pauses apply either way
+    RATE = 0
+    BURST = 20
+    MAX_WAIT = 10
+    DEFAULT_RETRY_AFTER = 5
+    BREAKER_THRESHOLD = 5
+    BREAKER_RESET_TIMEOUT = 30
+    CLIENT_DATA_KEY = 'helium_client'
+
+class CacheConstants():
+    MAX_SIZE = 1024
+    ROUTE_STATS = 'stats'
+    ROUTE_TOKEN_SUPPLY = 'stats/token_supply'
+    ROUTE_HOTSPOT = 'hotspots'
+    TTL_STATS = 60
+    TTL_TOKEN_SUPPLY = 300
+    TTL_HOTSPOT = 30
+    # expired responses are served for this many seconds while the Helium API is failing
+    MAX_STALE = 3600
+
+class RendererConstants():
+    MESSAGE_LIMIT = 4096
+    CACHE_SIZE = 256
+    MAX_ITEMS = 200
+    TEMPLATE_STATS = 'stats'
+    TEMPLATE_TOKEN_SUPPLY = 'token_supply'
+    TEMPLATE_HOTSPOT = 'hotspot'
+    TEMPLATE_ACTIVITY = 'activity'
+    TEMPLATE_RECENT_ACTIVITY = 'recent_activity'
+    TEMPLATE_SUMMARY = 'summary'
+
+class MetricsConstants():
+    ENABLED = False
+    LISTEN = '127.0.0.1'
+    PORT = 9108
+    PATH = '/metrics'
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    DATA_KEY = 'metrics_server'
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class LoggingConstants():
+    LEVEL = 'INFO'
+    # third-party loggers are quiet unless LOG_LEVELS says otherwise
+    LEVELS = {'aiohttp': 'WARNING', 'httpx': 'WARNING', 'telegram': 'INFO', 'apscheduler': 'WARNING',
+              'ZODB': 'INFO', 'ZEO': 'INFO', 'txn': 'WARNING'}
+    FORMAT_TEXT = 'text'
+    FORMAT_JSON = 'json'
+    FORMAT = FORMAT_TEXT
+    ROTATION_SIZE = 'size'
+    ROTATION_TIME = 'time'
+    ROTATION = ROTATION_SIZE
+    MAX_BYTES = 10 * 1024 * 1024
+    ROTATE_WHEN = 'midnight'
+    BACKUP_COUNT = 5
+    QUEUE_SIZE = 10000
+    NO_CORRELATION_ID = '-'
+
+class SyncConstants():
+    INTERVAL = 300
+    FIRST_RUN_DELAY = 10
+    INITIAL_HOURS = 24
+    JOB_NAME = 'activity_sync'
+
+class AggregateConstants():
+    BUCKET_SECONDS = 3600
+    # hourly buckets kept per hotspot, older ones are dropped as new hours start
+    RETENTION_HOURS = 30 * 24
+    # counters of a bucket, in array order; every activity counts towards total
+    COUNTERS = ('total', 'rewards', 'witnesses', 'beacons', 'challenges', 'data')
+    # (label, hours) of the windows shown by /hs_summary
+    WINDOWS = (('24h', 24), ('7d', 7 * 24), ('30d', 30 * 24))
+    REBUILD_DAYS = 30
+
+class StartupConstants():
+    KIND_IMPORT = 'import'
+    KIND_INIT = 'init'
+    # (subsystem, modules) imported in this order by --profile-startup; a later subsystem
+    # is only charged for the modules the earlier ones did not import
+    IMPORT_GROUPS = [
+        ('logging', ['util.logger']),
+        ('telegram', ['telegram', 'telegram.ext']),
+        ('zodb', ['ZODB', 'BTrees.OOBTree', 'zc.zlibstorage', 'zope.generations.generations']),
+        ('aiohttp', ['aiohttp', 'aiohttp.web']),
+        ('db', ['bot.db.DBManager', 'bot.db.AsyncDBManager']),
+        ('metrics', ['bot.metrics']),
+        ('helium', ['bot.helium_client', 'bot.helium_requests']),
+        ('send_queue', ['bot.send_queue', 'bot.renderer']),
+        ('scheduler', ['bot.activity_sync', 'bot.maintenance']),
+        ('handlers', ['bot.handlers']),
+        ('init', ['bot.init']),
+    ]
+
+class FanOutConstants():
+    CONCURRENCY = 50
+    BATCH_SIZE = 500
+
+class MaintenanceConstants():
+    ACTIVITY_RETENTION_DAYS = 30
+    RETENTION_INTERVAL = 3600
+    RETENTION_FIRST_RUN_DELAY = 60
+    RETENTION_JOB_NAME = 'activity_retention'
+    REAPER_GRACE_DAYS = 7
+    REAPER_BATCH_SIZE = 500
+    REAPER_TREES = [DbConstants.TREE_NAME_USERS, DbConstants.TREE_NAME_OWNERS,
+                    DbConstants.TREE_NAME_HOTSPOTS, DbConstants.TREE_NAME_ACTIVITIES]
+    PACK_INTERVAL = 86400
+    PACK_SIZE_THRESHOLD_MB = 256
+    PACK_KEEP_DAYS = 0
+    # key of the last pack time and size in the 'maintenance' tree
+    LAST_PACK_KEY = 'last_pack'
+    MAINTENANCE_INTERVAL = 3600
+    MAINTENANCE_FIRST_RUN_DELAY = 120
+    MAINTENANCE_JOB_NAME = 'db_maintenance'
+
+class SendQueueConstants():
+    GLOBAL_RATE = 30
+    GLOBAL_BURST = 30
+    CHAT_RATE = 1
+    CHAT_BURST = 3
+    WORKERS = 8
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 1.0
+    MAX_CHATS = 10000
+    LATENCY_SAMPLES = 1000
+    DRAIN_TIMEOUT = 10
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_NOTIFICATION = 10
+    DATA_KEY = 'send_queue'
+
+class NotificationConstants():
+    KIND_REWARD = 'reward'
+    KIND_WITNESS = 'witness'
+    KIND_BEACON = 'beacon'
+    ROLE_KINDS = {'reward_gateway': KIND_REWARD, 'witness': KIND_WITNESS, 'challengee': KIND_BEACON}
+    STATUS_ONLINE = 'online'
+    STATUS_OFFLINE = 'offline'
+    CHECK_STATUS = True
+    SNOOZE_HOURS = 8
+
+class BotModeConstants():
+    POLLING = 'polling'
+    WEBHOOK = 'webhook'
+    WORKERS = 'workers'
+    MODE = POLLING
+    WEBHOOK_LISTEN = '127.0.0.1'
+    WEBHOOK_PORT = 8443
+    WEBHOOK_URL_PATH = 'telegram'
+    WEBHOOK_MAX_CONNECTIONS = 40
+    TELEGRAM_API_URL = 'https://api.telegram.org'
+    CONCURRENT_UPDATES = 1
+
+class WorkerConstants():
+    COUNT = 2
+    LISTEN = '127.0.0.1'
+    BASE_PORT = 8450
+    UPDATE_PATH = '/update'
+    HEALTH_PATH = '/health'
+    TOKEN_ENV = 'HELIUM_BOT_WORKER_TOKEN'
+    TOKEN_HEADER = 'X-Worker-Token'
+    SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+    START_TIMEOUT = 60
+    STOP_TIMEOUT = 30
+    FORWARD_TIMEOUT = 10
+    SUPERVISE_INTERVAL = 1
+    LOG_SUFFIX = '-worker{}'
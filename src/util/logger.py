@@ -1,25 +1,185 @@
 # encoding: utf-8
-import os
+"""! @brief Non-blocking logging pipeline with rotation, JSON output and correlation ids."""
+##
+# @file logger.py
+# @package util
+# @brief Non-blocking logging pipeline with rotation, JSON output and correlation ids.
+#
+# @section description_logger Description
+# Loggers only put records on a queue through a QueueHandler. A
+# QueueListener thread formats them and writes them to a rotating log file
+# and the console, so no log call does I/O on the event loop or DB threads.
+# - Records carry the correlation id of the update being handled, set by a
+#   group -1 handler and propagated to DB threads with the context.
+# - LOG_FORMAT json writes one JSON object per line.
+# - LOG_LEVELS sets levels per logger, LOG_SAMPLING keeps only a fraction of
+#   the DEBUG and INFO records of noisy loggers.
+
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Dict, Optional
+
 from definitions import LOGS_DIR
+from util.constants import LoggingConstants
+from util.read_secrets import read_secrets
+
+correlation_id: contextvars.ContextVar = contextvars.ContextVar('correlation_id', default=LoggingConstants.NO_CORRELATION_ID)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_registered = False
+
+
+def set_correlation_id(value: str):
+    """! Set the correlation id of the records logged in the current context.
+    @return None
+    """
+    correlation_id.set(value)
+
+
+class CorrelationFilter(logging.Filter):
+    """! Adds the correlation id of the current context to every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """! Keeps only a fraction of the records below WARNING of the configured loggers and their children."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = {name: float(rate) for name, rate in rates.items()}
+
+    def _rate(self, name: str) -> float:
+        while True:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return rate
+            if '.' not in name:
+                return 1.0
+            name = name.rsplit('.', 1)[0]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
 
-def init_logger(logfile: str):
-    """! Initialize the root logger and standard log handlers."""
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """! QueueHandler that drops records instead of raising when the bounded queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """! Copy of the record to be queued. The base class merges the traceback into the message and clears
+        exc_info, so the traceback and the message without it are kept for the JsonFormatter as well.
+        """
+        prepared = super().prepare(record)
+        if record.exc_text:
+            prepared.exception_text = record.exc_text
+            prepared.plain_message = record.getMessage()
+        return prepared
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """! Formats a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': getattr(record, 'plain_message', None) or record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', LoggingConstants.NO_CORRELATION_ID),
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif getattr(record, 'exception_text', None):
+            # queued records only carry the traceback formatted by DroppingQueueHandler.prepare()
+            entry['exception'] = record.exception_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _file_handler(logfile: str, config: dict) -> logging.Handler:
+    rotation = config.get('LOG_ROTATION', LoggingConstants.ROTATION)
+    backup_count = int(config.get('LOG_BACKUP_COUNT', LoggingConstants.BACKUP_COUNT))
+    if rotation == LoggingConstants.ROTATION_TIME:
+        return logging.handlers.TimedRotatingFileHandler(logfile, when=config.get('LOG_ROTATE_WHEN', LoggingConstants.ROTATE_WHEN),
+                                                         backupCount=backup_count, encoding='utf-8')
+    if rotation == LoggingConstants.ROTATION_SIZE:
+        return logging.handlers.RotatingFileHandler(logfile, maxBytes=int(config.get('LOG_MAX_BYTES', LoggingConstants.MAX_BYTES)),
+                                                    backupCount=backup_count, encoding='utf-8')
+    raise ValueError('Unknown LOG_ROTATION {!r}, expected size or time.'.format(rotation))
+
+def init_logger(logfile: str, config: Optional[dict] = None):
+    """! Initialize the root logger with the queue pipeline and start the listener thread.
+    @param logfile path of the log file
+    @param config dictionary with optional LOG_* keys, secrets.json by default
+    @return the started QueueListener
+    """
+    global _listener, _registered
+    config = read_secrets() if config is None else config
     # check if logs directory exists, if not create it
-    
     if not os.path.exists(LOGS_DIR):
         os.mkdir(LOGS_DIR)
 
-    log_formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
-
-    file_handler = logging.FileHandler(logfile)
+    if str(config.get('LOG_FORMAT', LoggingConstants.FORMAT)).lower() == LoggingConstants.FORMAT_JSON:
+        log_formatter = JsonFormatter()
+    else:
+        log_formatter = logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+        )
+    file_handler = _file_handler(logfile, config)
     file_handler.setFormatter(log_formatter)
-    root_logger.addHandler(file_handler)
-
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(log_formatter)
-    root_logger.addHandler(console_handler)
\ No newline at end of file
+
+    queue_size = int(config.get('LOG_QUEUE_SIZE', LoggingConstants.QUEUE_SIZE))
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    # filters run in the logging thread, before the record is queued
+    queue_handler.addFilter(SamplingFilter(config.get('LOG_SAMPLING', {})))
+    queue_handler.addFilter(CorrelationFilter())
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(config.get('LOG_LEVEL', LoggingConstants.LEVEL).upper())
+    for name, level in dict(LoggingConstants.LEVELS, **config.get('LOG_LEVELS', {})).items():
+        logging.getLogger(name).setLevel(level.upper())
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+
+    stop_logger()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    if not _registered:
+        atexit.register(stop_logger)
+        _registered = True
+    return _listener
+
+def stop_logger():
+    """! Flush the queued records and stop the listener thread.
+    @return None
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -1,9 +1,20 @@
 import os
 import json
-def read_secrets() -> dict:
-    filename = os.path.join('.secret/secrets.json')
-    try:
-        with open(filename, mode='r') as secrets_file:
-            return json.load(secrets_file)
-    except FileNotFoundError:
-        return {}
\ No newline at end of file
+from typing import Optional
+
+_secrets: Optional[dict] = None
+
+def read_secrets(reload: bool = False) -> dict:
+    """! Settings from .secret/secrets.json. The file is read once per process and all modules
+    share the returned dictionary; reload=True reads it again.
+    @return dict, empty if the file does not exist
+    """
+    global _secrets
+    if _secrets is None or reload:
+        filename = os.path.join('.secret/secrets.json')
+        try:
+            with open(filename, mode='r') as secrets_file:
+                _secrets = json.load(secrets_file)
+        except FileNotFoundError:
+            _secrets = {}
+    return _secrets
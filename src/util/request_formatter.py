@@ -1,4 +1,47 @@
 import json
+from typing import List
+
+from util.constants import RendererConstants
+
+# characters that must be escaped anywhere in MarkdownV2 text
+_MARKDOWN_V2_ESCAPES = str.maketrans({char: '\\' + char for char in '\\_*[]()~`>#+-=|{}.!'})
+
+def escape_markdown_v2(text) -> str:
+    '''
+    Escape text for Telegram MarkdownV2 with a single translate pass.
+    '''
+    return str(text).translate(_MARKDOWN_V2_ESCAPES)
+
+def split_message(text: str, limit: int = RendererConstants.MESSAGE_LIMIT) -> List[str]:
+    '''
+    Split text into messages of at most limit characters, at line breaks
+    where possible. Lines longer than limit are cut without splitting an
+    escape sequence.
+    '''
+    if len(text) <= limit:
+        return [text]
+    chunks = []
+    lines = []
+    size = 0
+    for line in text.split('\n'):
+        if lines and size + 1 + len(line) > limit:
+            chunks.append('\n'.join(lines))
+            lines = []
+            size = 0
+        while len(line) > limit:
+            cut = limit
+            # do not end a chunk on the backslash of an escape sequence
+            backslashes = len(line[:cut]) - len(line[:cut].rstrip('\\'))
+            if backslashes % 2:
+                cut -= 1
+            chunks.append(line[:cut])
+            line = line[cut:]
+        size = size + 1 + len(line) if lines else len(line)
+        lines.append(line)
+    if lines:
+        chunks.append('\n'.join(lines))
+    return chunks
+
 
 def _code_block(text):
     return '```\n'+text+'\n```'
@@ -31,10 +74,5 @@ def get_human_readable_text(resp):
     '''
     Function for retrieving human readable text from request response.
     '''
-    result = ''
     d = resp['data']
-
-    for key in d:
-        result += str(key) + ' -> ' + str(d[key]) + '\n'
-    return _code_block(result)
-    
+    return _code_block('\n'.join('{} -> {}'.format(key, d[key]) for key in d))
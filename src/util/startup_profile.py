@@ -0,0 +1,79 @@
+"""! @brief Import and init timing of the bot's subsystems."""
+##
+# @file startup_profile.py
+# @package util
+# @brief Import and init timing of the bot's subsystems.
+#
+# @section description_startup_profile Description
+# Startup is recorded as a list of phases. main.py times the imports of each
+# subsystem with import_subsystems() and the startup steps with phase(); the
+# post-init hook adds the phases of the lazily started subsystems. The
+# phases are logged once the bot is up, and printed as a table by
+# python main.py --profile-startup.
+#
+# @section notes_startup_profile Notes
+# - Import phases only count the modules that were not imported yet, so the
+#   subsystems are imported in dependency order.
+# - For a per-module breakdown use python -X importtime main.py --profile-startup.
+
+import importlib
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Sequence, Tuple
+
+from util.constants import StartupConstants
+
+_phases: List[Tuple[str, str, float]] = []
+
+
+@contextmanager
+def phase(name: str, kind: str = StartupConstants.KIND_INIT) -> Iterator[None]:
+    """! Record the duration of the enclosed block as a startup phase.
+    @param name subsystem or step name
+    @param kind StartupConstants.KIND_IMPORT or StartupConstants.KIND_INIT
+    @return None
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((kind, name, time.perf_counter() - started))
+
+def import_subsystems(groups: Sequence[Tuple[str, Sequence[str]]] = StartupConstants.IMPORT_GROUPS):
+    """! Import the modules of every subsystem, recording one import phase per subsystem.
+    @param groups (subsystem name, module names) tuples in dependency order
+    @return None
+    """
+    for name, modules in groups:
+        with phase(name, StartupConstants.KIND_IMPORT):
+            for module in modules:
+                importlib.import_module(module)
+
+def get_phases() -> List[Tuple[str, str, float]]:
+    """! Getter for the recorded phases, in the order they finished.
+    @return list of (kind, name, seconds) tuples
+    """
+    return list(_phases)
+
+def summary() -> str:
+    """! One line summary of the recorded phases for the log.
+    @return str
+    """
+    total = sum(seconds for _, _, seconds in _phases)
+    return '{:.3f}s ({})'.format(total, ', '.join('{} {}: {:.3f}s'.format(kind, name, seconds) for kind, name, seconds in _phases))
+
+def report() -> str:
+    """! Table of the recorded phases with their share of the total startup time.
+    @return str
+    """
+    total = sum(seconds for _, _, seconds in _phases) or 1e-9
+    lines = ['{:<8} {:<16} {:>10} {:>7}'.format('kind', 'subsystem', 'ms', 'share')]
+    for kind in (StartupConstants.KIND_IMPORT, StartupConstants.KIND_INIT):
+        phases = [(name, seconds) for phase_kind, name, seconds in _phases if phase_kind == kind]
+        for name, seconds in phases:
+            lines.append('{:<8} {:<16} {:>10.1f} {:>6.1f}%'.format(kind, name, seconds * 1000, seconds / total * 100))
+        if phases:
+            subtotal = sum(seconds for _, seconds in phases)
+            lines.append('{:<8} {:<16} {:>10.1f} {:>6.1f}%'.format(kind, 'total', subtotal * 1000, subtotal / total * 100))
+    lines.append('{:<25} {:>10.1f}'.format('startup total', total * 1000))
+    return '\n'.join(lines)
@@ -1,4 +1,17 @@
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 """! @brief This function returns current UTC datetime in ISO format."""
 def get_iso_utc_time():
     return datetime.utcnow().isoformat()
+
+"""! @brief This function returns an epoch time as readable UTC datetime."""
+def format_utc_time(epoch_time):
+    return datetime.utcfromtimestamp(epoch_time).strftime('%Y-%m-%d %H:%M UTC')
+
+"""! @brief This function returns current UTC time as integer epoch seconds."""
+def get_epoch_utc_time():
+    return int(time.time())
+
+"""! @brief This function returns a UTC datetime in ISO format as integer epoch seconds."""
+def iso_to_epoch(iso_time):
+    return int(datetime.fromisoformat(iso_time).replace(tzinfo=timezone.utc).timestamp())